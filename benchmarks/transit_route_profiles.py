@@ -0,0 +1,69 @@
+"""
+Compares CPU time and response size of the /transit_route profiles on a
+synthetic OneMap response (3 itineraries, 5 legs each).
+
+    python benchmarks/transit_route_profiles.py
+"""
+import json
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+for key in ("ACCOUNT_KEY", "ONEMAP_API_TOKEN"):
+    os.environ.setdefault(key, "benchmark")
+
+import polyline
+from routers.directions import decode_transit_route
+from routers.utils import POLYLINE_DETAIL_TOLERANCES
+
+def make_leg(index: int) -> dict:
+    points = [
+        (1.30 + i * 0.00005, 103.80 + math.sin(i / 40 + index) * 0.002)
+        for i in range(400)
+    ]
+    return {
+        "mode": "BUS" if index % 2 else "WALK",
+        "distance": 2500.0,
+        "from": {"name": f"Stop {index}", "stopCode": f"{index:05d}"},
+        "to": {"name": f"Stop {index + 1}", "stopCode": f"{index + 1:05d}"},
+        "routeId": "10",
+        "duration": 600,
+        "transitLeg": bool(index % 2),
+        "legGeometry": {"points": polyline.encode(points)},
+        "intermediateStops": [
+            {"name": f"Stop {index}-{i}", "arrival": 0, "departure": 0, "lat": 1.3, "lon": 103.8, "stopCode": f"{i:05d}"}
+            for i in range(15)
+        ],
+    }
+
+def make_response() -> dict:
+    itinerary = {
+        "duration": 3000, "transfers": 2, "fare": "1.99", "walkDistance": 500.0,
+        "startTime": 0, "endTime": 3000,
+        "legs": [make_leg(i) for i in range(5)],
+    }
+    return {"plan": {"from": {"name": "A"}, "to": {"name": "B"}, "itineraries": [itinerary] * 3}}
+
+def run(data: dict, profile: str, detail: str, format: str, rounds: int = 50):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        body = json.dumps(decode_transit_route(data, POLYLINE_DETAIL_TOLERANCES[detail], format, profile), separators=(",", ":"))
+    elapsed_ms = (time.perf_counter() - start) * 1000 / rounds
+    return elapsed_ms, len(body.encode("utf-8"))
+
+if __name__ == "__main__":
+    data = make_response()
+    cases = [
+        ("full", "full", "json"),
+        ("full", "medium", "json"),
+        ("encoded", "full", "encoded"),
+        ("encoded", "medium", "encoded"),
+        ("summary", "full", "json"),
+    ]
+    baseline_ms, baseline_bytes = run(data, *cases[0])
+    print(f"{'profile':<8} {'detail':<7} {'ms/req':>8} {'bytes':>8} {'cpu x':>6} {'bytes x':>8}")
+    for profile, detail, format in cases:
+        elapsed_ms, size = run(data, profile, detail, format)
+        print(f"{profile:<8} {detail:<7} {elapsed_ms:>8.2f} {size:>8} {baseline_ms / elapsed_ms:>6.1f} {baseline_bytes / size:>8.1f}")
@@ -1,9 +1,11 @@
 from fastapi import FastAPI
-from routers.axiomMiddleware import AxiomLoggerMiddleware
+from routers.axiomMiddleware import axiom_sink
 from routers.client import lifespan
 from routers.database import db_router as db_router 
 from routers.busstop import busStops_router as busStops_router 
-from routers.middleware import FirebaseLoggerMiddleware
+from routers.middleware import firebase_sink
+from routers.telemetry import TelemetryMiddleware
+from routers.metrics import MetricsMiddleware, metrics_router
 from routers.users import users_router as users_router 
 from routers.bus import bus_router as bus_router
 from routers.car import car_related_router as car_related_router
@@ -11,6 +13,13 @@ from routers.mrt import MRT_router as MRT_router
 from routers.device_token import device_token_router as device_token_router
 from routers.feedback import feedback_router as feedback_router
 from routers.directions import directions_router as directions_router
+from routers.scheduler import jobs_router as jobs_router
+from routers.datasets import datasets_router as datasets_router
+from routers.watchdog import watchdog_router as watchdog_router
+from routers.profiling import ProfilingMiddleware, profiling_router
+from routers.admission import AdmissionMiddleware
+from routers.compression import CompressionMiddleware
+from routers.ratelimit import RateLimitMiddleware, ratelimit_router
 import uvicorn
 import os
 
@@ -25,26 +34,84 @@ app.include_router(MRT_router)
 app.include_router(device_token_router)
 app.include_router(feedback_router)
 app.include_router(directions_router)
-# app.add_middleware(FirebaseLoggerMiddleware, exclude_paths=['/bustiming'])
+app.include_router(jobs_router)
+app.include_router(datasets_router)
+app.include_router(metrics_router)
+app.include_router(watchdog_router)
+app.include_router(profiling_router)
+app.include_router(ratelimit_router)
+# Innermost, so route profiles cover the app and not the other middlewares
+app.add_middleware(ProfilingMiddleware)
+# Inside telemetry, so encoding shows up in Server-Timing and request durations
+app.add_middleware(CompressionMiddleware)
+
+# Per-route sampling rates by path prefix (0 = never log, 1 = always);
+# override with TELEMETRY_SAMPLING, e.g. "axiom:/bustiming=0.01"
 app.add_middleware(
-    FirebaseLoggerMiddleware,
-    exclude_prefixes=[
-        "/bustiming",
-        "/health",
-        "/favicon.ico",
-        "/transit_route"
-    ]
+    TelemetryMiddleware,
+    sinks=[firebase_sink, axiom_sink],
+    sampling={
+        "firebase": {
+            "/bustiming": 0,
+            "/health": 0,
+            "/metrics": 0,
+            "/debug": 0,
+            "/favicon.ico": 0,
+            "/transit_route": 0
+        },
+        "axiom": {
+            "/favicon.ico": 0,
+            "/health": 0,
+            "/metrics": 0,
+            "/debug": 0,
+            "/transit_route": 0
+        }
+    }
 )
 
+# Route classes by path prefix, limits in routers/admission.py (ADMISSION_LIMITS);
+# None bypasses admission control, anything unmatched is interactive
 app.add_middleware(
-    AxiomLoggerMiddleware,
-    exclude_prefixes=[
-        "/favicon.ico",
-        "/health",
-        "/transit_route"
-    ]
+    AdmissionMiddleware,
+    routes={
+        "/bus-routes/stops": "heavy",
+        "/bus-routes/polylines": "heavy",
+        "/getBusRoutesData": "heavy",
+        "/getBusServicesData": "heavy",
+        "/getallbusstops": "heavy",
+        "/busstops/tiles": "heavy",
+        "/transit_route_full": "heavy",
+        "/extract": "batch",
+        "/bulkUpdateBusRoutes": "batch",
+        "/health": None,
+        "/metrics": None,
+        "/debug": None,
+        "/datasets": None,
+        "/db/stats": None,
+        "/jobs": None,
+        "/cache": None,
+        "/ingest/status": None
+    }
 )
 
+# Per-client limits by path prefix as "requests/seconds"; override with RATE_LIMITS.
+# Outside admission control so abusive clients never take a slot
+app.add_middleware(
+    RateLimitMiddleware,
+    limits={
+        "/bustiming": "30/60",
+        "/getallbusstops": "20/3600",
+        "/getBusRoutesData": "20/3600",
+        "/busstops/tiles": "600/3600",
+        "/bus-routes": "120/60",
+        "/transit_route": "30/60",
+        "/submitFeedback": "5/3600"
+    }
+)
+
+# Added last so it is outermost and times the whole stack
+app.add_middleware(MetricsMiddleware)
+
 
 @app.get("/")
 async def root():
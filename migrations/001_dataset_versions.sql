@@ -0,0 +1,12 @@
+-- Versioned datasets (routers/datasets.py): every row of bus_stops, bus_route_raw and bus_route
+-- carries the version it was built under. Rows from before this migration have no version and
+-- are read until the first publish.
+alter table bus_stops add column version text;
+alter table bus_stops drop constraint bus_stops_pkey;
+alter table bus_stops add constraint bus_stops_id_version_key unique (id, version);
+alter table bus_route_raw add column version text;
+alter table bus_route_raw drop constraint bus_route_raw_pkey;
+alter table bus_route_raw add constraint bus_route_raw_id_version_key unique (id, version);
+alter table bus_route add column version text;
+alter table bus_route drop constraint bus_route_service_no_key;
+alter table bus_route add constraint bus_route_service_no_version_key unique (service_no, version);
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import time
+from collections import deque
+from routers.metrics import Counter, Gauge, Histogram
+from routers.utils import getEnvVariable
+
+# name: (max in flight, max queued, queue timeout in seconds, Retry-After in seconds, priority)
+# A lower priority number is more important; an in-flight limit of 0 disables admission limits for the class.
+DEFAULT_ROUTE_CLASSES = {
+    "interactive": (32, 64, 2.0, 1, 0),
+    "heavy": (4, 8, 5.0, 5, 1),
+    "batch": (1, 2, 10.0, 30, 2),
+}
+# Overrides as "class=in_flight:queued", e.g. "heavy=2:4,interactive=48:96"
+ADMISSION_LIMITS = getEnvVariable("ADMISSION_LIMITS", required=False) or ""
+
+admission_requests = Counter("admission_requests_total", "Requests seen by admission control, by route class.", ("class",))
+admission_shed = Counter(
+    "admission_shed_total", "Requests rejected with 503 by route class and reason (queue_full, timeout, priority).", ("class", "reason")
+)
+admission_wait = Histogram("admission_queue_wait_seconds", "Time admitted requests spent queued.", ("class",))
+
+class RouteClass:
+    """
+    At most `limit` requests of the class run at once; up to `queue` more
+    wait in FIFO order for queue_timeout seconds, and anything beyond that
+    is shed. A finishing request hands its slot straight to the next waiter.
+    """
+    def __init__(self, name: str, limit: int, queue: int, queue_timeout: float, retry_after: int, priority: int):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.priority = priority
+        self.in_flight = 0
+        self.waiters: deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> str | None:
+        """Takes a slot; returns None once admitted, otherwise why the request was shed."""
+        if self.limit <= 0:
+            self.in_flight += 1
+            return None
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            return None
+        # Interactive requests already waiting go first: lower classes shed instead of queueing
+        if any(other.waiters for other in route_classes.values() if other.priority < self.priority):
+            return "priority"
+        if len(self.waiters) >= self.queue:
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up
+                if isinstance(e, asyncio.CancelledError):
+                    self.release()
+                    raise
+            else:
+                try:
+                    self.waiters.remove(waiter)
+                except ValueError:
+                    pass
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                return "timeout"
+        admission_wait.observe(time.perf_counter() - started, self.name)
+        return None
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+def _build_route_classes() -> dict[str, RouteClass]:
+    settings = {name: list(values) for name, values in DEFAULT_ROUTE_CLASSES.items()}
+    for rule in filter(None, (item.strip() for item in ADMISSION_LIMITS.split(","))):
+        name, _, limits = rule.partition("=")
+        limit, _, queue = limits.partition(":")
+        values = settings.setdefault(name, list(DEFAULT_ROUTE_CLASSES["interactive"]))
+        values[0] = int(limit)
+        if queue:
+            values[1] = int(queue)
+    return {name: RouteClass(name, *values) for name, values in settings.items()}
+
+route_classes = _build_route_classes()
+
+Gauge(
+    "admission_in_flight", "Requests running per route class.", ("class",),
+    collect=lambda: [((name,), route_class.in_flight) for name, route_class in route_classes.items()]
+)
+Gauge(
+    "admission_queue_depth", "Requests waiting for a slot per route class.", ("class",),
+    collect=lambda: [((name,), len(route_class.waiters)) for name, route_class in route_classes.items()]
+)
+
+def get_admission_stats() -> dict:
+    return {
+        name: {"in_flight": route_class.in_flight, "queued": len(route_class.waiters), "limit": route_class.limit, "queue": route_class.queue}
+        for name, route_class in route_classes.items()
+    }
+
+class AdmissionMiddleware:
+    """
+    Pure ASGI middleware that admits each request through the RouteClass its
+    path maps to (the longest matching prefix wins, unmatched paths are
+    `default`). Paths mapped to None bypass admission control. Shed requests
+    get 503 with the class's Retry-After before any route code runs.
+    """
+    def __init__(self, app, routes: dict[str, str | None], default: str = "interactive"):
+        self.app = app
+        self.rules = sorted(routes.items(), key=lambda rule: len(rule[0]), reverse=True)
+        self.default = default
+
+    def route_class(self, path: str) -> RouteClass | None:
+        for prefix, name in self.rules:
+            if path.startswith(prefix):
+                return route_classes.get(name) if name else None
+        return route_classes[self.default]
+
+    async def __call__(self, scope, receive, send):
+        route_class = self.route_class(scope["path"]) if scope["type"] == "http" else None
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        admission_requests.inc(route_class.name)
+        reason = await route_class.acquire()
+        if reason is not None:
+            admission_shed.inc(route_class.name, reason)
+            await self._shed(send, route_class)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.release()
+
+    @staticmethod
+    async def _shed(send, route_class: RouteClass):
+        body = json.dumps({"detail": "Server is busy, please retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(route_class.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,26 +1,35 @@
-from datetime import datetime
 import json
 from typing import List, Optional
-import uuid
 from fastapi import APIRouter, HTTPException, Request, Response
 from fastapi.responses import JSONResponse
-import httpx
 from pydantic import BaseModel
-import pytz
-from routers.database import getDBClient
-from routers.utils import cache_headers, compress_to_gzip, getBusRoutesFromLTA, getBusServicesFromLTA ,getFormattedBusRoutesData, map_bus_services, restructure_to_stops_only
-import gzip
-from routers.cache import TWO_DAYS, cache
-
-dbClient = getDBClient()
+from routers.client import startup_timings
+from routers.logshipper import get_log_shipper_stats
+from routers.admission import get_admission_stats
+from routers.compression import ENCODING_CACHE_KEY, encoded_cache
+from routers.streaming import json_stream_response, json_text, object_member, prefetch_pages, stream_json, tee_gzip
+from routers.database import select_rows
+from routers.datasets import on_publish, published_version, read_dataset, versioned_key
+from routers.etl import delete_bus_routes as remove_bus_routes, refresh_bus_services, update_bus_routes
+from routers.network import get_network
+from routers.polylines import get_polyline_services, get_polyline_status
+from routers.ingest import get_bus_route_metrics
+from routers.scheduler import start_job
+from routers.utils import POLYLINE_DETAIL_TOLERANCES, POLYLINE_FORMATS, cache_headers
+from routers.cache import TWO_DAYS, get_cache, namespaces
 
 bus_router = APIRouter()
 
+# Gzipped dataset blobs, shared by every worker on the configured backend
+dataset_cache = get_cache("datasets", serializer="bytes")
+
+# Drop every cached bus_routes blob, and its other encodings, once a new version is published
+on_publish("bus_routes", lambda: dataset_cache.delete_prefix("bus_routes@"))
+on_publish("bus_routes", lambda: encoded_cache.delete_prefix("bus_routes@"))
+
 class DeleteRequest(BaseModel):
     serviceNumbers: list[str]
 
-    
-GEOJSON_URL = "https://data.busrouter.sg/v1/routes.min.geojson"
 
 class PolylineRequest(BaseModel):
     serviceNumbers: list[str]
@@ -33,43 +42,21 @@ async def health_check(request: Request):
     """
     if request.method == "HEAD":
         return {}
-    return {"status": "API is running"}
+    return {"status": "API is running", "startup": startup_timings, "logs": get_log_shipper_stats(), "admission": get_admission_stats()}
 
-@bus_router.get("/extractBusRoutesRawData")
-async def extract_bus_routes_raw_data():
-    try:
-        bus_route_key = "busRouteRaw"
-        raw_data = await getBusRoutesFromLTA()
-        stops_data = restructure_to_stops_only(raw_data)
-
-        sgt_timezone = pytz.timezone("Asia/Singapore")
-        current_timestamp = datetime.now(sgt_timezone).isoformat()
-
-        formatted_data = [
-            {
-                "id": str(bus_stop_code),
-                "bus_stop_code": str(bus_stop_code),
-                "json_value": json.dumps(bus_stop_data),  # Convert dict to JSON string
-                "modified_at": current_timestamp
-            }
-            for bus_stop_code, bus_stop_data in stops_data.items()
-        ]
-
-        # Upsert data into the bus_route_raw table
-        response = dbClient.table("bus_route_raw").upsert(
-            formatted_data,
-            on_conflict="id"  # Update if id already exists
-        ).execute()
-
-        # # Check if the operation was successful
-        if not response.data:
-            raise HTTPException(status_code=500, detail="Failed to store bus routes data in Supabase")
-
-        return {"message": "Extracted and stored successfully"}
+@bus_router.get("/extractBusRoutesRawData", status_code=202)
+async def extract_bus_routes_raw_data(refresh: bool = False):
+    """
+    Starts the bus_route_raw extract in the background; poll /jobs/bus_route_raw for its result.
+    """
+    return await start_job("bus_route_raw", refresh=refresh)
 
-    except Exception as e:
-        print(f"Error processing bus routes data: {e}")
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+@bus_router.get("/ingest/status")
+async def get_ingest_status():
+    """
+    Timing and throughput of the latest BusRoutes ingest.
+    """
+    return {"busRoutes": get_bus_route_metrics(), "polylines": get_polyline_status()}
 
 @bus_router.get("/bus-routes/stops")
 async def get_bus_routes_by_stops():
@@ -82,157 +69,51 @@ async def get_bus_routes_by_stops():
         #     return Response(content=cached, media_type="application/json",
         #                 headers={**cache_headers(), "Content-Encoding": "gzip", "X-Cache": "HIT"})
 
-        response = dbClient.table("bus_route_raw").select("bus_stop_code, json_value").execute()
-
-        if not response.data:
+        # Streamed page by page; json_value is stored as JSON text and copied as is
+        pages = await prefetch_pages(read_dataset("bus_route_raw", "bus_stop_code, json_value"))
+        if pages is None:
             return {"message": "No records available"}
 
-        combined_data = {
-            row["bus_stop_code"]: json.loads(row["json_value"]) 
-            for row in response.data
-        }
-
-        compressed_data = compress_to_gzip(combined_data)
-        # cache.set("bus_routes_stops", compressed_data, ttl=TWO_DAYS)
-
-        return Response(
-            content=compressed_data,
-            media_type="application/json",
-            headers={
-                **cache_headers(),
-                "Content-Encoding": "gzip",
-                "X-Original-Size": str(len(json.dumps(combined_data))) 
-            }
+        return json_stream_response(
+            stream_json(pages, lambda row: object_member(row["bus_stop_code"], json_text(row["json_value"])), b"{", b"}"),
+            headers=cache_headers()
         )
 
     except Exception as e:
         print(f"Error fetching bus route data: {e}")
         raise HTTPException(status_code=500, detail="Error fetching bus route data")
 
-@bus_router.get("/extractBusRoutesData")
-async def extract_bus_stops():
+@bus_router.get("/extractBusRoutesData", status_code=202)
+async def extract_bus_stops(refresh: bool = False):
     """
-    Extract bus routes data and upsert into Supabase if not already extracted.
-    - Checks if bus_routes and jsons tables have data.
-    - Upserts formatted_bus_route_data into bus_routes table.
-    - Upserts formatted_bus_stop_available_services into jsons table.
-    - Includes modified_at timestamp in SGT (GMT+8).
-    - Avoids overwriting existing data.
+    Starts the bus routes extract in the background; poll /jobs/bus_routes for its result.
+    - Upserts the services available at each bus stop into the jsons table.
+    - Reuses the latest BusRoutes ingest unless it is stale or refresh is set.
     """
-    bus_route_key = "busRoute"
-    bus_stop_available_services_key = "busStopAvailableServices"
+    return await start_job("bus_routes", refresh=refresh)
 
-    try:
-        # Check if data exists in bus_routes table
-        # bus_routes_check = dbClient.table("bus_route").select("service_no", count="exact").limit(1).execute()
-        # bus_routes_exists = bus_routes_check.count > 0
-
-        # # Check if data exists in jsons table for bus_stop_available_services_key
-        # jsons_check = dbClient.table("jsons").select("id").eq("id", bus_stop_available_services_key).execute()
-        # jsons_exists = len(jsons_check.data) > 0
-
-        # # If both datasets exist, return message
-        # if bus_routes_exists and jsons_exists:
-        #     return {"message": "Already Extracted"}
-
-        # If either dataset is missing, extract and upsert
-        raw_bus_route_data = await getBusRoutesFromLTA()
-        formatted_bus_route_data, formatted_bus_stop_available_services = getFormattedBusRoutesData(raw_bus_route_data)
-
-        # Get current timestamp in Singapore time (GMT+8)
-        sgt_timezone = pytz.timezone("Asia/Singapore")
-        current_timestamp = datetime.now(sgt_timezone).isoformat()
-
-        # Prepare bus routes data for upsert
-        formatted_bus_routes = [
-            {
-                "id": uuid.uuid4().hex[:12],
-                "service_no": str(bus_route["serviceNo"]),  # Ensure string format
-                "json_value": json.dumps(bus_route),  # Store full JSON object
-                "modified_at": current_timestamp
-            }
-            for bus_route in formatted_bus_route_data
-        ]
-
-        # Debug: Print number of bus routes
-        print(f"Prepared {len(formatted_bus_routes)} bus route records for upsert")
-
-        # Upsert bus routes in batches
-        batch_size = 1000
-        for i in range(0, len(formatted_bus_routes), batch_size):
-            batch = formatted_bus_routes[i:i + batch_size]
-            # response = dbClient.table("bus_route").upsert(
-            #     batch,
-            #     on_conflict="service_no"
-            # ).execute()
-
-            # Debug: Print batch progress
-            print(f"Upserted bus routes batch {i // batch_size + 1}: {len(batch)} records")
-
-            # Check if the operation was successful
-            # if not response.data:
-            #     raise HTTPException(status_code=500, detail="Failed to upsert bus routes data")
-
-        # Prepare bus stop available services data for upsert
-        formatted_bus_stop_services = {
-            "id": bus_stop_available_services_key,
-            "json_value": json.dumps(formatted_bus_stop_available_services),
-            "modified_at": current_timestamp
-        }
-
-        # Debug: Print bus stop services data
-        print(f"Prepared bus stop available services: {bus_stop_available_services_key}")
-
-        # Upsert bus stop available services
-        response = dbClient.table("jsons").upsert(
-            [formatted_bus_stop_services],
-            on_conflict="id"
-        ).execute()
-
-        # Check if the operation was successful
-        if not response.data:
-            raise HTTPException(status_code=500, detail="Failed to upsert bus stop available services data")
-
-        return {"message": formatted_bus_route_data}
-
-    except Exception as e:
-        print(f"Error processing bus routes data: {e}")
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
-    
 @bus_router.get("/getBusRoutesData")
 async def get_bus_route_data():
     key = "busRoute"
     try:
-        cached = cache.get("bus_routes")
+        version = await published_version("bus_routes")
+        cache_key = versioned_key("bus_routes", "bus_routes")
+        cached = await dataset_cache.get(cache_key)
         if cached:
             return Response(content=cached, media_type="application/json",
-                        headers={**cache_headers(), "Content-Encoding": "gzip", "X-Cache": "HIT"})
+                        headers={**cache_headers(), "Content-Encoding": "gzip", "X-Cache": "HIT", ENCODING_CACHE_KEY: cache_key})
         
-        response = dbClient.table("bus_route").select("service_no, json_value").execute()
-
-        if not response.data:
+        pages = await prefetch_pages(read_dataset("bus_routes", "service_no, json_value", version=version))
+        if pages is None:
             return {"message": "No records available"}
-        combined_data = []
 
-        for row in response.data:
-            json_value = row["json_value"]
-            data = json.loads(json_value) if isinstance(json_value, str) else json_value
-            combined_data.append(data)
-        
+        async def cache_body(compressed_data: bytes):
+            # Not cached if a new version was published while streaming
+            if cache_key == versioned_key("bus_routes", "bus_routes"):
+                await dataset_cache.set(cache_key, compressed_data, ttl=TWO_DAYS)
 
-        json_data = json.dumps(combined_data).encode("utf-8")
-        compressed_data = gzip.compress(json_data)
-
-        cache.set("bus_routes", compressed_data, ttl=TWO_DAYS)
-
-        return Response(
-            content=compressed_data,
-            media_type="application/json",
-            headers={
-                **cache_headers(),
-                "Content-Encoding": "gzip"
-            }
-        )
+        chunks = stream_json(pages, lambda row: json_text(row["json_value"]))
+        return json_stream_response(tee_gzip(chunks, cache_body), headers=cache_headers())
     except Exception as e:
         print(f"Error fetching bus route data: {e}")
         raise HTTPException(status_code=500, detail="Error fetching bus route data")
@@ -241,7 +122,7 @@ async def get_bus_route_data():
 async def get_bus_stop_available_busses_data():
     key = "busStopAvailableServices"
     try:
-        response = dbClient.table("jsons").select("json_value").eq("id", key).execute()
+        response = await select_rows("jsons", "json_value", eq={"id": key})
         if response.data:
             return response.data[0]["json_value"]
         else:
@@ -250,60 +131,94 @@ async def get_bus_stop_available_busses_data():
         print(f"Error fetching bus stop available busses data: {e}")
         raise HTTPException(status_code=500, detail="Error fetching bus stop available busses data")
     
+@bus_router.get("/bus-stops/{bus_stop_code}/services")
+async def get_bus_stop_services(bus_stop_code: str):
+    """
+    Services calling at a single bus stop, from the in-memory bus network.
+    """
+    network = await get_network()
+    services = network.services_at(bus_stop_code)
+    if services is None:
+        raise HTTPException(status_code=404, detail=f"Bus stop {bus_stop_code} not found")
+    return JSONResponse(
+        content={
+            "busStopCode": bus_stop_code,
+            "services": services,
+            "routes": [{"serviceNo": service_no, "direction": direction} for service_no, direction in network.stop_routes[bus_stop_code]]
+        },
+        headers=cache_headers()
+    )
+
+@bus_router.get("/bus-routes/{service_no}/{direction}/stops")
+async def get_bus_route_stops(service_no: str, direction: str):
+    """
+    Ordered bus stops of one service direction.
+    """
+    network = await get_network()
+    stops = network.stops_of(service_no, direction)
+    if stops is None:
+        raise HTTPException(status_code=404, detail=f"Service {service_no} direction {direction} not found")
+    return JSONResponse(
+        content={"serviceNo": service_no, "direction": direction, "busStopIDs": list(stops)},
+        headers=cache_headers()
+    )
+
+@bus_router.get("/bus-routes/{service_no}/{direction}/stops/{bus_stop_code}/adjacent")
+async def get_adjacent_bus_stops(service_no: str, direction: str, bus_stop_code: str):
+    """
+    Previous and next stop around a bus stop on one service direction.
+    """
+    network = await get_network()
+    adjacent = network.adjacent_stops(service_no, direction, bus_stop_code)
+    if adjacent is None:
+        raise HTTPException(status_code=404, detail=f"Service {service_no} direction {direction} does not call at {bus_stop_code}")
+    previous_stop, next_stop = adjacent
+    return JSONResponse(
+        content={
+            "serviceNo": service_no,
+            "direction": direction,
+            "busStopCode": bus_stop_code,
+            "previous": previous_stop,
+            "next": next_stop
+        },
+        headers=cache_headers()
+    )
+
+@bus_router.get("/bus-routes/{service_no}/{direction}/distance")
+async def get_bus_stop_distance(service_no: str, direction: str, from_stop: str, to_stop: str):
+    """
+    Number of stops between two bus stops on one service direction.
+    """
+    network = await get_network()
+    distance = network.stop_distance(service_no, direction, from_stop, to_stop)
+    if distance is None:
+        raise HTTPException(status_code=404, detail=f"{to_stop} is not reachable from {from_stop} on service {service_no} direction {direction}")
+    return JSONResponse(
+        content={
+            "serviceNo": service_no,
+            "direction": direction,
+            "from": from_stop,
+            "to": to_stop,
+            "stops": distance
+        },
+        headers=cache_headers()
+    )
+
 @bus_router.get("/getBusServicesData")
 async def get_bus_services_data(overwrite: Optional[bool] = False):
-    print(overwrite)
     pbKey = "busServices"
-
-    sgt_timezone = pytz.timezone("Asia/Singapore")
-    current_timestamp = datetime.now(sgt_timezone).isoformat()
     try:
         if not overwrite:
             # Get data from the database
-            db_data = dbClient.table("jsons").select("json_value").eq("id", pbKey).execute()
-            if db_data.data[0]["json_value"]:
+            db_data = await select_rows("jsons", "json_value", eq={"id": pbKey})
+            if db_data.data and db_data.data[0]["json_value"]:
                 data = db_data.data[0]["json_value"]
                 if isinstance(data, str):
                     data = json.loads(data)
                 return JSONResponse(content=data, headers=cache_headers())
-                # return db_data.__dict__["json_value"]
-            else:
-                # If no data in DB, fetch from API, map, and save.
-                busServices = await getBusServicesFromLTA()
-                if not busServices:
-                    return []
-                camelcased_bus_services = map_bus_services(busServices)
-                formatted_bus_stop_services = {
-                    "id": pbKey,
-                    "json_value": json.dumps(camelcased_bus_services),
-                    "modified_at": current_timestamp
-                }
-
-                # Upsert bus stop available services
-                response = dbClient.table("jsons").upsert(
-                    [formatted_bus_stop_services],
-                    on_conflict="id"
-                ).execute()
-                return camelcased_bus_services
 
-        else:
-            # Overwrite or fetch, map, and save to DB
-            busServices = await getBusServicesFromLTA()
-            if not busServices:
-                return []
-            camelcased_bus_services = map_bus_services(busServices)
-            formatted_bus_stop_services = {
-                "id": pbKey,
-                "json_value": json.dumps(camelcased_bus_services),
-                "modified_at": current_timestamp
-            }
-
-            # Upsert bus stop available services
-            response = dbClient.table("jsons").upsert(
-                [formatted_bus_stop_services],
-                on_conflict="id"
-            ).execute()
-            return camelcased_bus_services
+        # No data in DB or overwrite: fetch from API, map, and save
+        return await refresh_bus_services()
 
     except HTTPException as http_exc:
         raise http_exc
@@ -329,114 +244,51 @@ async def bulk_update_bus_routes(data: BusRouteBulkUpdate):
     - Inserts new rows with new UUIDs for id.
     """
     try:
-        sgt_timezone = pytz.timezone("Asia/Singapore")
-        current_timestamp = datetime.now(sgt_timezone).isoformat()
-
-        formatted_bus_routes = [
-            {
-                "id": uuid.uuid4().hex[:12],  
-                "service_no": str(bus_route.serviceNo), 
-                "json_value": json.dumps(bus_route.dict()),
-                "modified_at": current_timestamp
-            }
-            for bus_route in data.bus_routes
-        ]
-
-        print(f"Prepared {len(formatted_bus_routes)} bus route records for upsert")
-
-        batch_size = 1000
-        for i in range(0, len(formatted_bus_routes), batch_size):
-            batch = formatted_bus_routes[i:i + batch_size]
-            response = dbClient.table("bus_route").upsert(
-                batch,
-                on_conflict="service_no"
-            ).execute()
-
-            print(f"Upserted bus routes batch {i // batch_size + 1}: {len(batch)} records")
-
-            if not response.data:
-                raise HTTPException(status_code=500, detail="Failed to upsert bus routes data")
-
-        stored_routes = dbClient.table("bus_route").select("service_no", count="exact").execute()
-        print(f"Total stored bus routes: {stored_routes.count}")
-
-        return {"message": "Bulk update successful"}
+        result = await update_bus_routes([bus_route.dict() for bus_route in data.bus_routes])
+        return {"message": "Bulk update successful", **result}
 
     except Exception as e:
         print(f"Error processing bulk update: {e}")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @bus_router.post("/bus-routes/polylines")
-async def get_bus_routes_with_polylines(request: PolylineRequest):
-    # 1. Fetch GeoJSON and build O(1) lookup: {"serviceNo|direction": [[lat, lng], ...]}
-    async with httpx.AsyncClient() as client:
-        geojson_res = await client.get(GEOJSON_URL)
-        if geojson_res.status_code != 200:
-            raise HTTPException(status_code=502, detail="Failed to fetch GeoJSON source")
-        geojson = geojson_res.json()
-
-    lookup: dict[str, list[list[float]]] = {}
-    for feature in geojson.get("features", []):
-        props = feature.get("properties", {})
-        service_no = str(props.get("number", ""))
-        pattern = props.get("pattern")
-        direction = {0: "1", 1: "2"}.get(pattern)
-        if direction is None:
-            continue
-        coords = feature.get("geometry", {}).get("coordinates", [])
-        if not coords:
-            continue
-        # Swap [lng, lat] → [lat, lng]
-        transformed = [[lat, lng] for lng, lat in coords]
-        key = f"{service_no}|{direction}"
-        if key in lookup:
-            lookup[key].extend(transformed)  # concatenate multiple features
-        else:
-            lookup[key] = transformed
-
-    # 2. Fetch and format LTA data
-    raw_bus_route_data = await getBusRoutesFromLTA()
-    formatted_bus_route_data, _ = getFormattedBusRoutesData(raw_bus_route_data)
-
-    # 3. Filter to requested services and inject polylines
-    requested = set(request.serviceNumbers)
-    result = []
-    for svc in formatted_bus_route_data:
-        if svc["serviceNo"] not in requested:
-            continue
-        routes = []
-        for route in svc["routes"]:
-            key = f"{svc['serviceNo']}|{route['direction']}"
-            coords = lookup.get(key)
-            polyline = json.dumps(coords, separators=(",", ":")) if coords else ""
-            routes.append({**route, "polyline": polyline})
-        result.append({**svc, "routes": routes})
-
-    return {"bus_routes" : result}
+async def get_bus_routes_with_polylines(request: PolylineRequest, detail: str = "full", format: str = "json"):
+    """
+    Bus routes with polylines for the requested services.
+    - detail: full, high, medium or low (Douglas-Peucker simplified).
+    - format: json for a "[[lat,lng],...]" string, encoded for an encoded polyline.
+    """
+    if detail not in POLYLINE_DETAIL_TOLERANCES:
+        raise HTTPException(status_code=400, detail=f"detail must be one of {list(POLYLINE_DETAIL_TOLERANCES)}")
+    if format not in POLYLINE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(POLYLINE_FORMATS)}")
+
+    return {"bus_routes" : await get_polyline_services(request.serviceNumbers, detail, format)}
 
 @bus_router.delete("bus-routes")
 async def delete_bus_routes(request: DeleteRequest):
     if not request.serviceNumbers:
         raise HTTPException(status_code=400, detail="`serviceNumbers` must be a non-empty list.")
 
-    response = (
-        dbClient.table("bus_route")
-        .delete()
-        .in_("service_no", request.serviceNumbers)
-        .execute()
-    )
-
-    deleted = response.data or []
-
-    return {
-        "deleted": len(deleted),
-        "serviceNumbers": [row["service_no"] for row in deleted],
-    }
+    result = await remove_bus_routes(request.serviceNumbers)
+    return {"deleted": len(result["serviceNumbers"]), **result}
 
 @bus_router.post("/cache/purge")
-async def purge_cache(key: str = None):
+async def purge_cache(key: str = None, namespace: str = None):
+    """
+    Purges keys starting with `key` (or everything) in one namespace or in all of them.
+    """
+    if namespace and namespace not in namespaces:
+        raise HTTPException(status_code=404, detail=f"Cache namespace '{namespace}' not found")
+    for cache in [namespaces[namespace]] if namespace else namespaces.values():
+        if key:
+            await cache.delete_prefix(key)
+        else:
+            await cache.clear()
     if key:
-        cache.delete(key)
         return {"message": f"Cache key '{key}' purged"}
-    cache.clear()
-    return {"message": "All cache purged"}
\ No newline at end of file
+    return {"message": "All cache purged"}
+
+@bus_router.get("/cache/stats")
+async def get_cache_stats():
+    return {name: cache.stats() for name, cache in namespaces.items()}
@@ -1,12 +1,16 @@
 from datetime import datetime, timedelta, timezone
 import json
 import sys
-from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Response
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Request, Response
 from fastapi.responses import JSONResponse
-import pytz
-from routers.cache import TWO_DAYS, cache
-from routers.database import getDBClient
-from routers.utils import cache_headers, process_bus_service, queryAPI, service_sort_key
+from routers.cache import TWO_DAYS, get_cache
+from routers.compression import ENCODING_CACHE_KEY, encoded_cache
+from routers.streaming import json_stream_response, json_text, prefetch_pages, stream_json, tee_gzip
+from routers.datasets import on_publish, published_version, read_dataset, versioned_key
+from routers.scheduler import start_job
+from routers.tiles import GEOHASH_ALPHABET, TILE_PRECISIONS, get_tiles
+from routers.timing import span
+from routers.utils import cache_headers, etag_matches, getEnvVariable, process_bus_service, queryAPI, service_sort_key
 import asyncio
 from typing import Optional
 import logging
@@ -43,131 +47,26 @@ if not logger.handlers:
 # Get a module-specific logger
 logger = logging.getLogger(__name__)
 
-dbClient = getDBClient()
-
 busStops_router = APIRouter()
 SINGAPORE_TZ = timezone(timedelta(hours=8))
+TILE_TTL = 60 * 60 * 24 * 7
+# Seconds a BusArrival response is shared between requests for the same stop (0 disables)
+ARRIVALS_CACHE_TTL = int(getEnvVariable("ARRIVALS_CACHE_TTL", required=False) or 10)
+
+bus_stop_cache = get_cache("bus_stops", serializer="bytes")
+arrival_cache = get_cache("arrivals")
+on_publish("bus_stops", lambda: bus_stop_cache.clear())
+on_publish("bus_stops", lambda: encoded_cache.delete_prefix("all.json.gz@"))
 
-@busStops_router.get("/extractBusStops")
+@busStops_router.get("/extractBusStops", status_code=202)
 async def extract_bus_stops():
     """
-    Extract bus stop data from the LTA API and store/update in Supabase.
+    Starts the bus stops extract in the background; poll /jobs/bus_stops for its result.
     - Fetches bus stops from LTA API in batches.
     - Uses bus_stop_master_list from jsons table for bus_services.
-    - Upserts into bus_stops table with id as BusStopCode (TEXT).
-    - Includes modified_at timestamp in SGT (GMT+8).
+    - Writes a new bus_stops version when stops were added or changed.
     """
-    try:
-        # Get bus_stop_master_list from jsons table
-        logger.info("Fetching bus_stop_master_list from jsons table...")
-        jsons_response = dbClient.table("jsons").select("json_value").eq("id", "busStopAvailableServices").execute()
-        if not jsons_response.data:
-            raise HTTPException(status_code=500, detail="busStopAvailableServices not found in jsons table")
-        
-        bus_stop_master_list = jsons_response.data[0]["json_value"]
-        # Parse if json_value is TEXT
-        if isinstance(bus_stop_master_list, str):
-            bus_stop_master_list = json.loads(bus_stop_master_list)
-
-        # Get all existing bus stops
-        logger.info("Fetching existing bus stops from Supabase...")
-        bus_stop_map = {}
-        offset = 0
-        batch_size = 1000
-        while True:
-            response = dbClient.table("bus_stops").select("id, description, latitude, longitude, road_name, bus_services").range(offset, offset + batch_size - 1).execute()
-            if not response.data:
-                break
-            for stop in response.data:
-                bus_stop_map[stop["id"]] = stop
-            offset += batch_size
-        logger.info(f"Fetched {len(bus_stop_map)} existing bus stops")
-
-        # Fetch bus stops from LTA API
-        logger.info("Fetching bus stops from LTA API...")
-        counter = 0
-        results = []
-        while True:
-            result = await queryAPI("ltaodataservice/BusStops", {"$skip": str(counter)})
-            results.append(result)
-            counter += 500
-            logger.debug(f"Fetched {len(result.get('value', []))} bus stops at offset {counter}")
-            if counter >= 10000:  # Adjust based on API limits
-                break
-
-        # Flatten results
-        data_list = [item for res in results if res.get("value") for item in res["value"]]
-        logger.info(f"Fetched total {len(data_list)} bus stops from API")
-
-        # Get current timestamp in Singapore time (GMT+8)
-        sgt_timezone = pytz.timezone("Asia/Singapore")
-        current_timestamp = datetime.now(sgt_timezone).isoformat()
-
-        new_busstops = []
-        updated_busstops = []
-
-        for stop in data_list:
-            stop_id = stop["BusStopCode"]
-            bus_services = ",".join(map(str, bus_stop_master_list.get(stop_id, [])))
-
-            new_data = {
-                "id": stop_id,
-                "description": stop["Description"],
-                "latitude": float(stop["Latitude"]),
-                "longitude": float(stop["Longitude"]),
-                "road_name": stop["RoadName"],
-                "bus_services": bus_services,
-                "modified_at": current_timestamp
-            }
-
-            if stop_id not in bus_stop_map:
-                # New bus stop
-                new_busstops.append(new_data)
-            else:
-                # Compare with existing record
-                existing = bus_stop_map[stop_id]
-                existing_data = {
-                    "description": existing["description"],
-                    "latitude": existing["latitude"],
-                    "longitude": existing["longitude"],
-                    "road_name": existing["road_name"],
-                    "bus_services": existing["bus_services"]
-                }
-                new_data_no_id = {k: v for k, v in new_data.items() if k not in ["id", "modified_at"]}
-                if existing_data != new_data_no_id:
-                    updated_busstops.append(new_data)
-
-        logger.info(f"{len(new_busstops)} new bus stops to insert")
-        logger.info(f"{len(updated_busstops)} existing bus stops to update")
-
-        # Upsert new and updated bus stops in batches
-        all_busstops = new_busstops + updated_busstops
-        if all_busstops:
-            logger.info("Upserting bus stops (batched)...")
-            batch_size = 1000
-            for i in range(0, len(all_busstops), batch_size):
-                batch = all_busstops[i:i + batch_size]
-                response = dbClient.table("bus_stops").upsert(
-                    batch,
-                    on_conflict="id"
-                ).execute()
-                logger.debug(f"Upserted batch {i // batch_size + 1}: {len(batch)} records")
-                if not response.data:
-                    raise HTTPException(status_code=500, detail="Failed to upsert bus stops")
-
-        # Verify stored data
-        stored_busstops = dbClient.table("bus_stops").select("id", count="exact").execute()
-        logger.info(f"Total stored bus stops: {stored_busstops.count}")
-
-        return {
-            "message": "Bus stops processed successfully",
-            "new": len(new_busstops),
-            "updated": len(updated_busstops)
-        }
-
-    except Exception as e:
-        logger.error(f"Error processing bus stops: {e}")
-        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    return await start_job("bus_stops")
 
 
 @busStops_router.get("/getallbusstops")
@@ -176,46 +75,74 @@ async def get_all_bus_stops():
     Retrieve all bus stop information stored in PocketBase.
     """
     try:
-        # See if cache hit is possible
-        cached = cache.get("bus_stops")
+        # See if cache hit is possible; the cached body is the gzipped response
+        version = await published_version("bus_stops")
+        cache_key = versioned_key("bus_stops", "all.json.gz")
+        cached = await bus_stop_cache.get(cache_key)
         if cached:
-            return Response(content={"busStops": cached}, media_type="application/json",
-                        headers={**cache_headers(), "Content-Encoding": "gzip", "X-Cache": "HIT"})
-        
+            return Response(content=cached, media_type="application/json",
+                        headers={**cache_headers(), "Content-Encoding": "gzip", "X-Cache": "HIT", ENCODING_CACHE_KEY: cache_key})
 
-        response = dbClient.table("bus_stops").select("id, description, latitude, longitude, road_name, bus_services").execute()
-        bus_stop_data = []
-        for stop in response.data:
-            bus_stop_data.append({
-                "id": stop["id"],
-                "description": stop["description"],
-                "latitude": stop["latitude"],
-                "longitude": stop["longitude"],
-                "road_name": stop["road_name"],
-                "bus_services": stop["bus_services"]
-            })
+        # Rows are streamed as they are read; the select picks exactly the fields returned
+        pages = await prefetch_pages(read_dataset("bus_stops", "id, description, latitude, longitude, road_name, bus_services", version=version))
+        if pages is None:
+            return {"busStops": []}
 
-        # return {"busStops": bus_stop_data}
-        # full_structure = {"busStops": bus_stop_data}
-        # json_string = json.dumps(full_structure, separators=(',', ':'))
-        # json_bytes = json_string.encode("utf-8")
-        # compressed_data = gzip.compress(json_bytes)
+        async def cache_body(compressed_data: bytes):
+            # Not cached if a new version was published while streaming
+            if cache_key == versioned_key("bus_stops", "all.json.gz"):
+                await bus_stop_cache.set(cache_key, compressed_data, ttl=TWO_DAYS)
+
+        chunks = stream_json(pages, json_text, b'{"busStops":[', b"]}")
+        return json_stream_response(tee_gzip(chunks, cache_body), headers=cache_headers())
 
-        # return Response(
-        #     content=compressed_data,
-        #     media_type="application/json",
-        #     headers={
-        #         **cache_headers(),
-        #         "Content-Encoding": "gzip"
-        #     }
-        # )
-        cache.set("bus_routes_stops", bus_stop_data, ttl=TWO_DAYS)
-        return JSONResponse(content={"busStops": bus_stop_data}, headers=cache_headers())
-    
     except Exception as e:
         print(f"Error retrieving bus stops: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve bus stops")
 
+@busStops_router.get("/busstops/tiles")
+async def get_bus_stop_tile_index(precision: int = Query(5)):
+    """
+    Geohash tiles that contain bus stops at a precision, with their ETags.
+    Clients compare ETags to refetch only the tiles that changed.
+    """
+    if precision not in TILE_PRECISIONS:
+        raise HTTPException(400, f"precision must be one of {list(TILE_PRECISIONS)}")
+    try:
+        tiles = await get_tiles()
+        return JSONResponse(
+            content={"precision": precision, "tiles": tiles.index(precision)},
+            headers=cache_headers()
+        )
+    except Exception as e:
+        print(f"Error retrieving bus stop tiles: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve bus stop tiles")
+
+@busStops_router.get("/busstops/tiles/{geohash}")
+async def get_bus_stop_tile(geohash: str, request: Request):
+    """
+    Bus stops inside one geohash tile, for loading only the visible part of the map.
+    """
+    geohash = geohash.lower()
+    if len(geohash) not in TILE_PRECISIONS or any(c not in GEOHASH_ALPHABET for c in geohash):
+        raise HTTPException(400, f"Tile must be a geohash of length {list(TILE_PRECISIONS)}")
+    try:
+        tiles = await get_tiles()
+        tile = tiles.get(geohash)
+    except Exception as e:
+        print(f"Error retrieving bus stop tile {geohash}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve bus stop tile")
+
+    if tile is None:
+        body, etag = json.dumps({"geohash": geohash, "busStops": []}, separators=(",", ":")).encode("utf-8"), 'W/"empty"'
+    else:
+        body, etag = tile
+
+    headers = {**cache_headers(TILE_TTL), "ETag": etag}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @busStops_router.get("/bustiming")
 async def get_bus_timing(
     busstopcode: str = Query(..., regex=r'^\d{5}$'),
@@ -230,7 +157,11 @@ async def get_bus_timing(
     process_all = "all" in requested
     
     try:
-        response = await queryAPI("ltaodataservice/v3/BusArrival", {"BusStopCode": busstopcode})
+        fetch = lambda: queryAPI("ltaodataservice/v3/BusArrival", {"BusStopCode": busstopcode})
+        if ARRIVALS_CACHE_TTL:
+            response = await arrival_cache.get_or_fetch(busstopcode, ARRIVALS_CACHE_TTL, fetch)
+        else:
+            response = await fetch()
         services = response.get("Services", [])
         
         if not services:
@@ -238,17 +169,18 @@ async def get_bus_timing(
         
         current_time = datetime.now(SINGAPORE_TZ)
         
-        results = await asyncio.gather(*[
-            process_bus_service(s, current_time)
-            for s in services
-            if (no := s.get("ServiceNo")) and (process_all or no in requested)
-        ])
-        
-        # Filter None and sort
-        valid = sorted(
-            (r for r in results if r),
-            key=lambda x: service_sort_key(x["serviceNo"])
-        )
+        with span("transform"):
+            results = await asyncio.gather(*[
+                process_bus_service(s, current_time)
+                for s in services
+                if (no := s.get("ServiceNo")) and (process_all or no in requested)
+            ])
+
+            # Filter None and sort
+            valid = sorted(
+                (r for r in results if r),
+                key=lambda x: service_sort_key(x["serviceNo"])
+            )
 
         # Background tasks for non-critical I/O
         # if userID is not None:
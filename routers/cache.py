@@ -1,7 +1,33 @@
+from abc import ABC, abstractmethod
+import asyncio
+import hashlib
+import json
+import os
+import ssl
+import struct
+import tempfile
 import time
+from collections import OrderedDict
+from urllib.parse import unquote, urlparse
+from routers.utils import getEnvVariable
 
 TWO_DAYS = 60 * 60 * 24 * 2
 
+# "memory" (per process), "shared" (files in shared memory, across the workers of
+# one machine) or "redis" (across machines). CACHE_BACKENDS overrides it per
+# namespace, e.g. "arrivals=shared,bus_routes=redis".
+CACHE_BACKEND = (getEnvVariable("CACHE_BACKEND", required=False) or "memory").lower()
+CACHE_BACKENDS = getEnvVariable("CACHE_BACKENDS", required=False) or ""
+CACHE_MEMORY_MAX_ENTRIES = int(getEnvVariable("CACHE_MEMORY_MAX_ENTRIES", required=False) or 1000)
+CACHE_SHARED_DIR = getEnvVariable("CACHE_SHARED_DIR", required=False) or (
+    "/dev/shm/bustiming-cache" if os.path.isdir("/dev/shm") else os.path.join(tempfile.gettempdir(), "bustiming-cache")
+)
+# /dev/shm is RAM: cap the shared cache so it cannot grow into the machine's memory
+CACHE_SHARED_MAX_ENTRIES = int(getEnvVariable("CACHE_SHARED_MAX_ENTRIES", required=False) or 5000)
+CACHE_SHARED_MAX_BYTES = int(getEnvVariable("CACHE_SHARED_MAX_BYTES", required=False) or 64 * 1024 * 1024)
+CACHE_REDIS_URL = getEnvVariable("CACHE_REDIS_URL", required=False) or "redis://127.0.0.1:6379/0"
+CACHE_REDIS_TIMEOUT = float(getEnvVariable("CACHE_REDIS_TIMEOUT", required=False) or 0.5)
+
 class SimpleCache:
     def __init__(self):
         self._store = {}
@@ -21,7 +47,481 @@ class SimpleCache:
     def delete(self, key: str):
         self._store.pop(key, None)
 
+    def delete_prefix(self, prefix: str):
+        for key in [key for key in self._store if key.startswith(prefix)]:
+            del self._store[key]
+
     def clear(self):
         self._store.clear()
 
-cache = SimpleCache()
\ No newline at end of file
+class BoundedCache(SimpleCache):
+    """
+    TTL cache that keeps at most max_entries, evicting the least recently
+    used entry first. get_or_fetch coalesces concurrent misses for a key
+    into a single fetch.
+    """
+    def __init__(self, max_entries: int):
+        super().__init__()
+        self._store = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: str):
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        if time.time() >= entry["expires_at"]:
+            del self._store[key]
+            return None
+        self._store.move_to_end(key)
+        return entry["data"]
+
+    def set(self, key: str, data, ttl: int):
+        super().set(key, data, ttl)
+        self._store.move_to_end(key)
+        while len(self._store) > self.max_entries:
+            self._store.popitem(last=False)
+
+    async def get_or_fetch(self, key: str, ttl: int, fetch):
+        """
+        Returns the cached value for key, or awaits fetch() once for all
+        concurrent callers and caches its result. Failures are not cached.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._fetch(key, ttl, fetch))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        # Shielded so one caller disconnecting does not cancel the fetch for the rest
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, ttl: int, fetch):
+        try:
+            data = await fetch()
+            self.set(key, data, ttl)
+            return data
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._store),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
+
+class CacheBackend(ABC):
+    """
+    Key-value store with per-key TTL behind a cache namespace. Backends that
+    keep values in the process set stores_objects and skip serialization;
+    the others store bytes.
+    """
+    name = "base"
+    stores_objects = False
+
+    @abstractmethod
+    async def get(self, key: str):
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value, ttl: int):
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    async def delete_prefix(self, prefix: str):
+        ...
+
+    async def close(self):
+        pass
+
+class MemoryBackend(CacheBackend):
+    """Per-process LRU store; values are kept as objects."""
+    name = "memory"
+    stores_objects = True
+
+    def __init__(self, max_entries: int):
+        self._cache = BoundedCache(max_entries)
+
+    async def get(self, key: str):
+        return self._cache.get(key)
+
+    async def set(self, key: str, value, ttl: int):
+        self._cache.set(key, value, ttl)
+
+    async def delete(self, key: str):
+        self._cache.delete(key)
+
+    async def delete_prefix(self, prefix: str):
+        self._cache.delete_prefix(prefix)
+
+class SharedMemoryBackend(CacheBackend):
+    """
+    One file per key in a tmpfs directory (/dev/shm), shared by every worker
+    on the machine. Writes go to a temp file and are renamed into place, so
+    readers never see a partial value. Files start with the expiry time and
+    the key, which lets prefix deletes and sweeps work without an index.
+    File I/O runs in worker threads. Sweeps drop expired files, then the
+    oldest ones while the directory is over max_entries or max_bytes.
+    """
+    name = "shared"
+    HEADER = struct.Struct(">dI")
+    SWEEP_EVERY = 200  # sets between sweeps of expired files
+
+    def __init__(self, directory: str, max_entries: int, max_bytes: int):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._sets = 0
+        self._bytes_since_sweep = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def _read(self, path: str, header_only: bool = False) -> tuple[float, str, bytes] | None:
+        try:
+            with open(path, "rb") as f:
+                expires_at, key_length = self.HEADER.unpack(f.read(self.HEADER.size))
+                key = f.read(key_length).decode()
+                return expires_at, key, b"" if header_only else f.read()
+        except (FileNotFoundError, struct.error):
+            return None
+
+    def _unlink(self, path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _get(self, key: str):
+        path = self._path(key)
+        entry = self._read(path)
+        if entry is None:
+            return None
+        expires_at, _, value = entry
+        if time.time() >= expires_at:
+            self._unlink(path)
+            return None
+        return value
+
+    def _write(self, key: str, value: bytes, ttl: int):
+        path = self._path(key)
+        encoded_key = key.encode()
+        # A temp file of its own per write: sets of one key may run at once in several threads
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as f:
+            f.write(self.HEADER.pack(time.time() + ttl, len(encoded_key)))
+            f.write(encoded_key)
+            f.write(value)
+        try:
+            os.replace(f.name, path)
+        except OSError:
+            self._unlink(f.name)
+            raise
+
+    async def get(self, key: str):
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        await asyncio.to_thread(self._write, key, value, ttl)
+        self._sets += 1
+        self._bytes_since_sweep += len(value)
+        # Sweep every SWEEP_EVERY sets, or sooner when large values are coming in
+        if self._sets % self.SWEEP_EVERY == 0 or self._bytes_since_sweep > self.max_bytes // 10:
+            self._bytes_since_sweep = 0
+            await asyncio.to_thread(self._sweep, lambda key, expires_at: time.time() >= expires_at)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._unlink, self._path(key))
+
+    async def delete_prefix(self, prefix: str):
+        await asyncio.to_thread(self._sweep, lambda key, expires_at: key.startswith(prefix))
+
+    def _sweep(self, should_delete):
+        kept = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(self.directory, name)
+            entry = self._read(path, header_only=True)
+            if entry is None:
+                continue
+            if should_delete(entry[1], entry[0]):
+                self._unlink(path)
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            kept.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in kept)
+        if len(kept) <= self.max_entries and total <= self.max_bytes:
+            return
+        # Evict the least recently written files first
+        kept.sort()
+        for count, (_, size, path) in enumerate(kept):
+            if len(kept) - count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._unlink(path)
+            total -= size
+
+class RedisError(Exception):
+    pass
+
+class RedisBackend(CacheBackend):
+    """
+    Minimal RESP client over one asyncio connection, enough for GET, SET
+    with expiry, DEL and SCAN. Works against Redis, Upstash or any local
+    stand-in that speaks the protocol (see scripts/redis_standin.py).
+    """
+    name = "redis"
+
+    def __init__(self, url: str, timeout: float):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.use_tls = parsed.scheme == "rediss"
+        self.timeout = timeout
+        self._reader: asyncio.StreamReader = None
+        self._writer: asyncio.StreamWriter = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, str):
+                arg = arg.encode()
+            elif isinstance(arg, int):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    async def _read_reply(self):
+        line = await self._reader.readuntil(b"\r\n")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            return None if length < 0 else (await self._reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [await self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply {line!r}")
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(
+            self.host, self.port, ssl=ssl.create_default_context() if self.use_tls else None
+        )
+        if self.password:
+            await self._send(*(("AUTH", self.username, self.password) if self.username else ("AUTH", self.password)))
+        if self.db:
+            await self._send("SELECT", self.db)
+
+    async def _send(self, *args):
+        self._writer.write(self._encode(args))
+        await self._writer.drain()
+        return await self._read_reply()
+
+    async def _disconnect(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def command(self, *args):
+        async with self._lock:
+            try:
+                if self._writer is None or self._writer.is_closing():
+                    await asyncio.wait_for(self._connect(), self.timeout)
+                return await asyncio.wait_for(self._send(*args), self.timeout)
+            except RedisError:
+                raise
+            except BaseException:
+                # A timed out or broken exchange leaves the stream out of sync
+                await self._disconnect()
+                raise
+
+    async def get(self, key: str):
+        return await self.command("GET", key)
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        await self.command("SET", key, value, "PX", int(ttl * 1000))
+
+    async def delete(self, key: str):
+        await self.command("DEL", key)
+
+    async def delete_prefix(self, prefix: str):
+        pattern = "".join("\\" + c if c in "*?[]\\" else c for c in prefix) + "*"
+        cursor = "0"
+        while True:
+            cursor, keys = await self.command("SCAN", cursor, "MATCH", pattern, "COUNT", 500)
+            if keys:
+                await self.command("DEL", *keys)
+            if cursor in (b"0", "0"):
+                break
+
+    async def close(self):
+        async with self._lock:
+            await self._disconnect()
+
+SERIALIZERS = {
+    "bytes": (lambda value: value, lambda data: data),
+    "json": (lambda value: json.dumps(value, separators=(",", ":")).encode(), json.loads),
+}
+
+_backends: dict[str, CacheBackend] = {}
+
+def _namespace_backends() -> dict[str, str]:
+    pairs = (item.split("=", 1) for item in CACHE_BACKENDS.split(",") if "=" in item)
+    return {namespace.strip(): backend.strip().lower() for namespace, backend in pairs}
+
+def get_backend(name: str, namespace: str) -> CacheBackend:
+    # Memory stores are per namespace so a busy namespace cannot evict another's entries
+    backend_key = f"memory:{namespace}" if name == "memory" else name
+    backend = _backends.get(backend_key)
+    if backend is None:
+        if name == "memory":
+            backend = MemoryBackend(CACHE_MEMORY_MAX_ENTRIES)
+        elif name == "shared":
+            backend = SharedMemoryBackend(CACHE_SHARED_DIR, CACHE_SHARED_MAX_ENTRIES, CACHE_SHARED_MAX_BYTES)
+        elif name == "redis":
+            backend = RedisBackend(CACHE_REDIS_URL, CACHE_REDIS_TIMEOUT)
+        else:
+            raise ValueError(f"Unknown cache backend {name!r}")
+        _backends[backend_key] = backend
+    return backend
+
+class CacheNamespace:
+    """
+    A named group of cache keys on the backend configured for it.
+    Values are serialized for out-of-process backends, and backend errors
+    are counted and treated as misses so a cache outage never fails a request.
+    """
+    def __init__(self, name: str, serializer: str = "json"):
+        self.name = name
+        self.backend_name = _namespace_backends().get(name, CACHE_BACKEND)
+        self.backend = get_backend(self.backend_name, name)
+        self.dumps, self.loads = SERIALIZERS[serializer]
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def _key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    async def get(self, key: str):
+        value = await self._load(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def _load(self, key: str):
+        try:
+            value = await self.backend.get(self._key(key))
+        except Exception as e:
+            self.errors += 1
+            print(f"Cache {self.name} get failed on {self.backend_name}: {e!r}")
+            return None
+        if value is None or self.backend.stores_objects:
+            return value
+        return self.loads(value)
+
+    async def set(self, key: str, value, ttl: int):
+        try:
+            await self.backend.set(self._key(key), value if self.backend.stores_objects else self.dumps(value), ttl)
+        except Exception as e:
+            self.errors += 1
+            print(f"Cache {self.name} set failed on {self.backend_name}: {e!r}")
+
+    async def delete(self, key: str):
+        try:
+            await self.backend.delete(self._key(key))
+        except Exception as e:
+            self.errors += 1
+            print(f"Cache {self.name} delete failed on {self.backend_name}: {e!r}")
+
+    async def delete_prefix(self, prefix: str):
+        try:
+            await self.backend.delete_prefix(self._key(prefix))
+        except Exception as e:
+            self.errors += 1
+            print(f"Cache {self.name} delete_prefix failed on {self.backend_name}: {e!r}")
+
+    async def clear(self):
+        await self.delete_prefix("")
+
+    async def get_or_fetch(self, key: str, ttl: int, fetch):
+        """
+        Returns the cached value for key, or awaits fetch() once for all
+        concurrent callers in this process and stores its result.
+        """
+        cached = await self._load(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.create_task(self._fetch(key, ttl, fetch))
+            self._inflight[key] = task
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, ttl: int, fetch):
+        try:
+            value = await fetch()
+            await self.set(key, value, ttl)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend_name,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+        }
+
+namespaces: dict[str, CacheNamespace] = {}
+
+def get_cache(name: str, serializer: str = "json") -> CacheNamespace:
+    namespace = namespaces.get(name)
+    if namespace is None:
+        namespace = namespaces[name] = CacheNamespace(name, serializer)
+    return namespace
+
+async def close_cache_backends():
+    for backend in _backends.values():
+        await backend.close()
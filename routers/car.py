@@ -1,12 +1,10 @@
 from collections import defaultdict
 from fastapi import APIRouter, HTTPException, Response
-from routers.database import getDBClient
-from routers.utils import compress_to_gzip, getAllEVChargingPointsFromLTA, getCarParkAvailabilityFromLTA, getTrafficIncidentsFromLTA, getVMSFromLTA, queryAPI
+from routers.executor import run_cpu
+from routers.utils import dump_json, getAllEVChargingPointsFromLTA, getCarParkAvailabilityFromLTA, getTrafficIncidentsFromLTA, getVMSFromLTA, queryAPI
 import re
 from datetime import datetime
 
-dbClient = getDBClient()
-
 car_related_router = APIRouter()
 
 camera_id_descriptions = {
@@ -208,15 +206,9 @@ async def get_parking_availability():
                 "availableLots": available_lots
             })
 
-        compressed_data = compress_to_gzip(processed_car_parks)
+        body = await run_cpu(dump_json, processed_car_parks)
 
-        return Response(
-            content=compressed_data,
-            media_type="application/json",
-            headers={
-                "Content-Encoding": "gzip",
-            }
-        )
+        return Response(content=body, media_type="application/json")
 
     except HTTPException as he:
         raise he
@@ -255,15 +247,9 @@ async def ev_charging():
     try:
         ev_charging = await getAllEVChargingPointsFromLTA()
 
-        compressed_data = compress_to_gzip(ev_charging["evLocationsData"])
+        body = await run_cpu(dump_json, ev_charging["evLocationsData"])
 
-        return Response(
-            content=compressed_data,
-            media_type="application/json",
-            headers={
-                "Content-Encoding": "gzip",
-            }
-        )
+        return Response(content=body, media_type="application/json")
 
     except HTTPException as he:
         raise he
@@ -1,17 +1,53 @@
+import asyncio
 import os
+import time
 import httpx
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from routers.metrics import track_pool, upstream_hooks
+
+LTA_BASE_URL = "https://datamall2.mytransport.sg/"
 
 # Global persistent client
 _client: httpx.AsyncClient = None
 
+# Startup phase timings in ms, reported by /health
+startup_timings: dict = {}
+
 def get_client() -> httpx.AsyncClient:
     return _client
 
+track_pool("lta", get_client)
+
+async def _warm_lta_connection():
+    # Open a pooled connection to LTA so the first /bustiming skips the TLS handshake
+    try:
+        await _client.head(LTA_BASE_URL)
+    except Exception as e:
+        print(f"Error warming LTA connection: {e}")
+
+async def _warm_up(started: float):
+    # Imported here: routers.database imports routers.utils, which imports this module
+    from routers.database import connectDB
+    from routers.executor import warm_executor
+
+    await asyncio.gather(connectDB(), _warm_lta_connection(), warm_executor())
+    startup_timings["warm_up_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    print(f"Warm-up completed in {startup_timings['warm_up_ms']}ms")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global _client
+    from routers.database import closeDBClient, refreshDBSession
+    from routers.polylines import refresh_polylines_loop
+    from routers.executor import shutdown_executor
+    from routers.scheduler import start_scheduler
+    from routers.datasets import poll_dataset_versions_loop
+    from routers.cache import close_cache_backends
+    from routers.logshipper import start_log_shippers, stop_log_shippers
+    from routers.watchdog import watchdog
+
+    started = time.perf_counter()
     _client = httpx.AsyncClient(
         timeout=httpx.Timeout(
             connect=2.0,   # fail fast if LTA unreachable
@@ -25,7 +61,33 @@ async def lifespan(app: FastAPI):
             keepalive_expiry=30            # keep connections alive 30s
         ),
         headers={'AccountKey': os.getenv("ACCOUNT_KEY")},  # set once, reused forever
-        http2=True  # HTTP/2 multiplexing if LTA supports it
+        http2=True,  # HTTP/2 multiplexing if LTA supports it
+        event_hooks=upstream_hooks("lta")
     )
+
+    # Connections are warmed in the background so they stay off the cold-start path
+    background_tasks = [
+        asyncio.create_task(_warm_up(started)),
+        asyncio.create_task(refreshDBSession()),
+        asyncio.create_task(refresh_polylines_loop()),
+        asyncio.create_task(poll_dataset_versions_loop()),
+        asyncio.create_task(watchdog.run()),
+        *start_scheduler(),
+    ]
+
+    start_log_shippers()
+
+    startup_timings["startup_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    print(f"Startup completed in {startup_timings['startup_ms']}ms")
+
     yield
-    await _client.aclose()
\ No newline at end of file
+
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await _client.aclose()
+    await closeDBClient()
+    await close_cache_backends()
+    shutdown_executor()
+    # Last, so events logged while shutting down still go out
+    await stop_log_shippers()
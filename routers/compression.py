@@ -0,0 +1,238 @@
+import asyncio
+import gzip
+import zlib
+from routers.cache import get_cache
+from routers.executor import run_cpu
+from routers.timing import span
+from routers.utils import getEnvVariable
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; without it responses are gzip or identity
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(getEnvVariable("COMPRESSION_MIN_SIZE", required=False) or 1024)
+COMPRESSION_OFFLOAD_SIZE = 64 * 1024    # bodies at least this big are compressed in the CPU executor
+ENCODED_CACHE_TTL = 2 * 24 * 60 * 60
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5                      # per-response compression
+BROTLI_CACHED_QUALITY = 9               # cached payloads are compressed once per version
+COMPRESSIBLE_TYPES = (b"application/json", b"application/geo+json", b"text/", b"application/javascript")
+
+# Internal response header: handlers of cacheable payloads set it to a key that changes
+# with the payload (e.g. a versioned_key), and encoded bodies are reused under it.
+# It is removed before the response is sent.
+ENCODING_CACHE_KEY = "x-encoding-cache-key"
+_ENCODING_CACHE_KEY = ENCODING_CACHE_KEY.encode()
+
+encoded_cache = get_cache("encoded", serializer="bytes")
+
+def _accepted_encodings(headers) -> dict[str, float]:
+    for name, value in headers:
+        if name == b"accept-encoding":
+            accepted = {}
+            for item in value.decode("latin-1").lower().split(","):
+                coding, _, params = item.strip().partition(";")
+                quality = 1.0
+                params = params.strip()
+                if params.startswith("q="):
+                    try:
+                        quality = float(params[2:])
+                    except ValueError:
+                        quality = 0.0
+                accepted[coding.strip()] = quality
+            return accepted
+    return {}
+
+def negotiate(accepted: dict[str, float]) -> str:
+    """Picks br, gzip or identity from the parsed Accept-Encoding, preferring br on ties."""
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = "identity", 0.0
+    for coding in ("br", "gzip") if brotli is not None else ("gzip",):
+        quality = accepted.get(coding, wildcard)
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+def encode(body: bytes, encoding: str, cached: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_CACHED_QUALITY if cached else BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+def transcode(body: bytes, source: str, target: str, cached: bool = False) -> bytes:
+    if source == "gzip":
+        body = gzip.decompress(body)
+    elif source == "br":
+        body = brotli.decompress(body)
+    return encode(body, target, cached)
+
+class _StreamEncoder:
+    """Incremental gzip or brotli for responses sent in several body messages."""
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress, self.finish = self._compressor.process, self._compressor.finish
+        else:
+            self._compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.compress, self.finish = self._compressor.compress, self._compressor.flush
+
+class CompressionMiddleware:
+    """
+    Pure ASGI middleware that encodes JSON and text responses with the best
+    of br, gzip and identity the client accepts, and adds Vary: Accept-Encoding.
+    - Bodies under COMPRESSION_MIN_SIZE are sent as they are.
+    - Bodies from COMPRESSION_OFFLOAD_SIZE up are compressed in the CPU executor;
+      stream chunks that big in a worker thread, since the encoder's state
+      cannot move to a process pool.
+    - Responses a handler already encoded (e.g. gzip bytes from a cache) pass
+      through when the client accepts that encoding, and are transcoded otherwise.
+    - With an x-encoding-cache-key header, encoded bodies are kept in the
+      "encoded" cache namespace, so a cacheable payload is compressed once
+      per encoding instead of once per request.
+    - Streaming responses are compressed chunk by chunk.
+    """
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        responder = _Responder(send, _accepted_encodings(scope["headers"]), self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+class _Responder:
+    def __init__(self, send, accepted: dict[str, float], minimum_size: int):
+        self._send = send
+        self.accepted = accepted
+        self.target = negotiate(accepted)
+        self.minimum_size = minimum_size
+        self.start = None
+        self.stream: _StreamEncoder | None = None
+        self.passthrough = False
+
+    def accepts(self, coding: str) -> bool:
+        return self.accepted.get(coding, self.accepted.get("*", 0.0)) > 0
+
+    async def send(self, message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            self.start = message
+            return
+        if message_type != "http.response.body" or self.passthrough:
+            await self._send(message)
+            return
+        if self.stream is not None:
+            await self._send_chunk(message)
+            return
+        await self._first_body(message)
+
+    async def _first_body(self, message):
+        start = self.start
+        headers = []
+        content_type = b""
+        content_encoding = cache_key = ""
+        for name, value in start.get("headers", ()):
+            if name == b"content-type":
+                content_type = value
+            elif name == b"content-encoding":
+                content_encoding = value.decode("latin-1").strip().lower()
+            elif name == _ENCODING_CACHE_KEY:
+                cache_key = value.decode("latin-1")
+                continue
+            headers.append((name, value))
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        compressible = content_type.startswith(COMPRESSIBLE_TYPES) and start["status"] not in (204, 304)
+        if compressible:
+            headers = _add_vary(headers)
+
+        target = self.target
+        source = content_encoding or "identity"
+        if source == "identity":
+            passthrough = target == "identity" or (not more_body and len(body) < self.minimum_size)
+        else:
+            # Already encoded: transcode only for clients that cannot take it, or once per
+            # cache key to serve the better encoding; never re-encode a stream
+            passthrough = (
+                more_body
+                or source == target
+                or source not in ("gzip", "br")
+                or (source == "br" and brotli is None)
+                or (self.accepts(source) and not cache_key)
+            )
+        if not compressible or passthrough:
+            self.passthrough = True
+            await self._send({**start, "headers": headers})
+            await self._send(message)
+            return
+
+        if more_body:
+            self.stream = _StreamEncoder(target)
+            await self._send({**start, "headers": _set_encoding(_without_length(headers), target)})
+            await self._send_chunk(message)
+            return
+
+        with span("encode"):
+            encoded = await self._encode(body, source, target, cache_key)
+        headers = _set_encoding(_without_length(headers), target)
+        headers.append((b"content-length", str(len(encoded)).encode()))
+        self.passthrough = True
+        await self._send({**start, "headers": headers})
+        await self._send({"type": "http.response.body", "body": encoded})
+
+    async def _encode(self, body: bytes, source: str, target: str, cache_key: str) -> bytes:
+        if cache_key:
+            key = f"{cache_key}:{target}"
+            encoded = await encoded_cache.get(key)
+            if encoded is not None:
+                return encoded
+        cached = bool(cache_key)
+        if len(body) >= COMPRESSION_OFFLOAD_SIZE:
+            encoded = await run_cpu(transcode, body, source, target, cached)
+        else:
+            encoded = transcode(body, source, target, cached)
+        if cache_key:
+            await encoded_cache.set(key, encoded, ttl=ENCODED_CACHE_TTL)
+        return encoded
+
+    async def _send_chunk(self, message):
+        chunk = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if len(chunk) >= COMPRESSION_OFFLOAD_SIZE:
+            data = await asyncio.to_thread(self.stream.compress, chunk)
+        else:
+            data = self.stream.compress(chunk) if chunk else b""
+        if not more_body:
+            data += self.stream.finish()
+        if data or not more_body:
+            await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+def _add_vary(headers: list) -> list:
+    for index, (name, value) in enumerate(headers):
+        if name == b"vary":
+            if b"accept-encoding" not in value.lower():
+                headers[index] = (name, value + b", Accept-Encoding")
+            return headers
+    headers.append((b"vary", b"Accept-Encoding"))
+    return headers
+
+def _without_length(headers: list) -> list:
+    return [(name, value) for name, value in headers if name != b"content-length"]
+
+def _set_encoding(headers: list, encoding: str) -> list:
+    """Replaces Content-Encoding; a strong ETag becomes weak, as it now covers several encodings."""
+    updated = []
+    for name, value in headers:
+        if name == b"content-encoding":
+            continue
+        if name == b"etag" and not value.startswith(b"W/"):
+            value = b"W/" + value
+        updated.append((name, value))
+    if encoding != "identity":
+        updated.append((b"content-encoding", encoding.encode()))
+    return updated
@@ -1,7 +1,18 @@
-from fastapi import APIRouter
+import asyncio
+import hashlib
+import json
+import math
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+import time
+from fastapi import APIRouter, HTTPException
 from dotenv import load_dotenv
+import httpx
+from postgrest.exceptions import APIError
+from routers.metrics import track_pool, upstream_hooks
+from routers.timing import span
 from routers.utils import getEnvVariable
-from supabase import create_client
+from supabase import AsyncClient, AsyncClientOptions, acreate_client
 
 load_dotenv()
 
@@ -12,17 +23,489 @@ SUPABASE_API_KEY = getEnvVariable("SUPABASE_API_KEY")
 SUPABASE_EMAIL = getEnvVariable("SUPABASE_EMAIL")
 SUPABASE_PASSWORD = getEnvVariable("SUPABASE_PASSWORD")
 
-supabase = create_client(SUPABASE_URL,SUPABASE_API_KEY)
+DB_QUERY_TIMEOUT = float(getEnvVariable("DB_QUERY_TIMEOUT", required=False) or 10)
+DB_TRANSPORT_TIMEOUT_MARGIN = 2.0     # httpx gives up this long after the query deadline
+DB_MAX_CONNECTIONS = int(getEnvVariable("DB_MAX_CONNECTIONS", required=False) or 10)
+DB_READ_PAGE_SIZE = int(getEnvVariable("DB_READ_PAGE_SIZE", required=False) or 1000)
+DB_READ_CONCURRENCY = int(getEnvVariable("DB_READ_CONCURRENCY", required=False) or 4)
+DB_WRITE_BATCH_SIZE = int(getEnvVariable("DB_WRITE_BATCH_SIZE", required=False) or 1000)
+DB_WRITE_CONCURRENCY = int(getEnvVariable("DB_WRITE_CONCURRENCY", required=False) or 3)
+DB_WRITE_RETRIES = int(getEnvVariable("DB_WRITE_RETRIES", required=False) or 3)
+DB_WRITE_RETRY_BACKOFF = 0.5          # seconds before the first retry, doubled per attempt
+DB_SESSION_CHECK_INTERVAL = 60        # seconds between session expiry checks
+DB_SESSION_REFRESH_MARGIN = 5 * 60    # refresh when the token expires within 5 minutes
 
-supabase.auth.sign_in_with_password(
-    {
-        "email": SUPABASE_EMAIL,
-        "password": SUPABASE_PASSWORD
+# Shared async client, created on first use
+_db_client: AsyncClient = None
+_db_http_client: httpx.AsyncClient = None
+_db_client_lock = asyncio.Lock()
+_db_status = {
+    "connect_ms": None,
+    "connected_at": None,
+    "last_refresh_at": None,
+    "refresh_count": 0,
+    "refresh_failures": 0,
+}
+
+# Per-query latency stats: name -> counters + recent samples (ms)
+_query_stats = defaultdict(lambda: {
+    "count": 0,
+    "errors": 0,
+    "timeouts": 0,
+    "total_ms": 0.0,
+    "max_ms": 0.0,
+    "samples": deque(maxlen=256),
+})
+
+# Bulk write checkpoints: job -> digests of batches already written. They are
+# also persisted in the jsons table, so a rerun on another machine or after a
+# restart resumes too.
+BULK_CHECKPOINT_PREFIX = "bulkCheckpoint:"
+_bulk_checkpoints: dict[str, set[str]] = defaultdict(set)
+# Latest bulk write per job
+_bulk_write_runs: dict[str, dict] = {}
+
+track_pool("supabase", lambda: _db_http_client)
+
+async def getDBClient() -> AsyncClient:
+    """
+    Returns the shared non-blocking Supabase client.
+    The client is created and signed in on first use (normally kicked off
+    by connectDB during app startup) and reuses one pooled httpx connection
+    pool for every PostgREST call.
+    """
+    global _db_client, _db_http_client
+    if _db_client is not None:
+        return _db_client
+
+    async with _db_client_lock:
+        if _db_client is None:
+            start = time.perf_counter()
+            # The query deadline in execute() fires first and becomes a 504; the
+            # transport timeout only catches calls made outside execute()
+            http_client = httpx.AsyncClient(
+                timeout=httpx.Timeout(DB_QUERY_TIMEOUT + DB_TRANSPORT_TIMEOUT_MARGIN, connect=2.0),
+                limits=httpx.Limits(
+                    max_keepalive_connections=DB_MAX_CONNECTIONS,
+                    max_connections=DB_MAX_CONNECTIONS,
+                    keepalive_expiry=30
+                ),
+                follow_redirects=True,
+                http2=True,
+                event_hooks=upstream_hooks("supabase")
+            )
+            try:
+                client = await acreate_client(
+                    SUPABASE_URL,
+                    SUPABASE_API_KEY,
+                    # Session refresh is handled by refreshDBSession
+                    options=AsyncClientOptions(httpx_client=http_client, auto_refresh_token=False)
+                )
+                await client.auth.sign_in_with_password(
+                    {
+                        "email": SUPABASE_EMAIL,
+                        "password": SUPABASE_PASSWORD
+                    }
+                )
+            except BaseException:
+                await http_client.aclose()
+                raise
+            _db_http_client = http_client
+            _db_client = client
+            _db_status["connect_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            _db_status["connected_at"] = time.time()
+            print(f"Connected to Supabase in {_db_status['connect_ms']}ms")
+    return _db_client
+
+async def connectDB():
+    """
+    Warm-up hook for the app lifespan: connects and signs in without
+    failing startup if Supabase is unreachable. Queries retry the
+    connection on first use.
+    """
+    try:
+        await getDBClient()
+    except Exception as e:
+        print(f"Error connecting to Supabase: {e}")
+
+async def refreshDBSession():
+    """
+    Background task that keeps the Supabase session alive.
+    Refreshes the access token shortly before it expires and signs in
+    again if the refresh token is no longer valid.
+    """
+    while True:
+        await asyncio.sleep(DB_SESSION_CHECK_INTERVAL)
+        if _db_client is None:
+            continue
+        try:
+            session = await _db_client.auth.get_session()
+            if session and session.expires_at and session.expires_at - time.time() > DB_SESSION_REFRESH_MARGIN:
+                continue
+            try:
+                await _db_client.auth.refresh_session()
+            except Exception:
+                await _db_client.auth.sign_in_with_password(
+                    {
+                        "email": SUPABASE_EMAIL,
+                        "password": SUPABASE_PASSWORD
+                    }
+                )
+            _db_status["refresh_count"] += 1
+            _db_status["last_refresh_at"] = time.time()
+        except Exception as e:
+            _db_status["refresh_failures"] += 1
+            print(f"Error refreshing Supabase session: {e}")
+
+async def closeDBClient():
+    global _db_client, _db_http_client
+    if _db_http_client is not None:
+        await _db_http_client.aclose()
+    _db_client = None
+    _db_http_client = None
+
+async def execute(name: str, build, timeout: float | None = None):
+    """
+    Runs a single PostgREST query without blocking the event loop.
+
+    Args:
+        name (str): Label used for latency stats, e.g. "bus_stops.select".
+        build (callable): Receives the client and returns the query builder to execute.
+        timeout (float): Per-query timeout in seconds (default: DB_QUERY_TIMEOUT).
+
+    Raises:
+        HTTPException: 504 if the query does not finish within the timeout,
+            or if the HTTP transport times out first.
+    """
+    client = await getDBClient()
+    stats = _query_stats[name]
+    start = time.perf_counter()
+    try:
+        with span("db"):
+            return await asyncio.wait_for(build(client).execute(), timeout or DB_QUERY_TIMEOUT)
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        stats["timeouts"] += 1
+        raise HTTPException(504, f"Database query '{name}' timed out")
+    except Exception:
+        stats["errors"] += 1
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        stats["count"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+        stats["samples"].append(elapsed_ms)
+
+def _filter(query, eq: dict | None, in_: dict | None):
+    """Adds equality filters (None matches NULL) and IN filters to a query."""
+    for column, value in (eq or {}).items():
+        query = query.is_(column, "null") if value is None else query.eq(column, value)
+    for column, values in (in_ or {}).items():
+        query = query.in_(column, values)
+    return query
+
+async def select_rows(
+    table: str,
+    columns: str = "*",
+    eq: dict | None = None,
+    in_: dict | None = None,
+    range_: tuple[int, int] | None = None,
+    order: str | None = None,
+    count: str | None = None,
+    head: bool | None = None,
+    timeout: float | None = None
+):
+    def build(client: AsyncClient):
+        query = _filter(client.table(table).select(columns, count=count, head=head), eq, in_)
+        if order is not None:
+            query = query.order(order)
+        if range_ is not None:
+            query = query.range(*range_)
+        return query
+    return await execute(f"{table}.select", build, timeout)
+
+async def count_rows(table: str, column: str = "id", eq: dict | None = None, timeout: float | None = None) -> int:
+    response = await select_rows(table, column, eq=eq, count="exact", head=True, timeout=timeout)
+    return response.count or 0
+
+async def _read_range(table: str, columns: str, order: str, eq: dict | None, start: int, end: int) -> list[dict]:
+    # PostgREST may cap rows per response below the requested range; keep
+    # reading the rest of the range instead of silently returning it short.
+    rows = []
+    while start <= end:
+        response = await select_rows(table, columns, eq=eq, range_=(start, end), order=order)
+        if not response.data:
+            break
+        rows.extend(response.data)
+        start += len(response.data)
+    return rows
+
+async def read_table(
+    table: str,
+    columns: str = "*",
+    order: str = "id",
+    page_size: int | None = None,
+    concurrency: int | None = None,
+    eq: dict | None = None
+):
+    """
+    Reads a whole table as an async stream of row pages.
+    Gets the row count first, then keeps `concurrency` range requests in
+    flight and yields each page in order as soon as it is ready, so
+    consumers can start work before the last page arrives.
+
+    Args:
+        table (str): Table name.
+        columns (str): Columns to select.
+        order (str): Unique column that keeps range pages stable (default: "id").
+        page_size (int): Rows per range request (default: DB_READ_PAGE_SIZE).
+        concurrency (int): Range requests in flight (default: DB_READ_CONCURRENCY).
+        eq (dict): Equality filters on the rows read, e.g. a dataset version.
+    """
+    page_size = page_size or DB_READ_PAGE_SIZE
+    concurrency = concurrency or DB_READ_CONCURRENCY
+
+    total = await count_rows(table, order, eq)
+    num_pages = math.ceil(total / page_size)
+
+    def fetch_page(page: int):
+        start = page * page_size
+        end = min(start + page_size, total) - 1
+        return asyncio.create_task(_read_range(table, columns, order, eq, start, end))
+
+    pending = [fetch_page(page) for page in range(min(concurrency, num_pages))]
+    next_page = len(pending)
+    read = 0
+    try:
+        while pending:
+            rows = await pending.pop(0)
+            if next_page < num_pages:
+                pending.append(fetch_page(next_page))
+                next_page += 1
+            read += len(rows)
+            yield rows
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if read != total:
+        print(f"Warning: read {read} of {total} rows from {table} (table changed during read?)")
+
+async def upsert_rows(table: str, rows: list[dict], on_conflict: str, timeout: float | None = None, **kwargs):
+    return await execute(
+        f"{table}.upsert",
+        lambda client: client.table(table).upsert(rows, on_conflict=on_conflict, **kwargs),
+        timeout
+    )
+
+async def insert_rows(table: str, rows, timeout: float | None = None):
+    return await execute(f"{table}.insert", lambda client: client.table(table).insert(rows), timeout)
+
+async def update_rows(table: str, values: dict, eq: dict, timeout: float | None = None):
+    """Updates the rows matching every eq filter; response.data holds the rows changed."""
+    def build(client: AsyncClient):
+        query = client.table(table).update(values)
+        for column, value in eq.items():
+            query = query.eq(column, value)
+        return query
+    return await execute(f"{table}.update", build, timeout)
+
+async def delete_rows(table: str, eq: dict | None = None, in_: dict | None = None, timeout: float | None = None):
+    def build(client: AsyncClient):
+        return _filter(client.table(table).delete(), eq, in_)
+    return await execute(f"{table}.delete", build, timeout)
+
+async def compare_and_set_json(key: str, value, expected: str | None) -> str | None:
+    """
+    Writes value to the jsons row `key` only if the row's modified_at is
+    still `expected`, or with expected None, only if the row does not exist.
+    Returns the modified_at written, or None if another writer got there first.
+    """
+    modified_at = datetime.now(timezone.utc).isoformat()
+    row = {"json_value": json.dumps(value), "modified_at": modified_at}
+    if expected is None:
+        try:
+            await insert_rows("jsons", [{"id": key, **row}])
+        except APIError as e:
+            if e.code == "23505":  # unique_violation: the row exists now
+                return None
+            raise
+        return modified_at
+    response = await update_rows("jsons", row, eq={"id": key, "modified_at": expected})
+    return modified_at if response.data else None
+
+def _batch_digest(batch: list[dict], ignore_fields: tuple[str, ...]) -> str:
+    stable = [{k: v for k, v in row.items() if k not in ignore_fields} for row in batch]
+    return hashlib.sha1(json.dumps(stable, sort_keys=True, default=str).encode()).hexdigest()
+
+async def _load_checkpoint(job: str) -> set[str]:
+    try:
+        response = await select_rows("jsons", "json_value", eq={"id": BULK_CHECKPOINT_PREFIX + job})
+    except Exception as e:
+        print(f"[{job}] Could not load bulk write checkpoint: {e}")
+        return set()
+    if not response.data:
+        return set()
+    digests = response.data[0]["json_value"]
+    return set(json.loads(digests) if isinstance(digests, str) else digests)
+
+async def _save_checkpoint(job: str, digests: set[str]):
+    try:
+        await upsert_rows(
+            "jsons",
+            [{"id": BULK_CHECKPOINT_PREFIX + job, "json_value": json.dumps(sorted(digests)), "modified_at": datetime.now(timezone.utc).isoformat()}],
+            on_conflict="id"
+        )
+    except Exception as e:
+        print(f"[{job}] Could not save bulk write checkpoint: {e}")
+
+async def _clear_checkpoint(job: str):
+    try:
+        await delete_rows("jsons", eq={"id": BULK_CHECKPOINT_PREFIX + job})
+    except Exception as e:
+        print(f"[{job}] Could not clear bulk write checkpoint: {e}")
+
+async def bulk_upsert(
+    table: str,
+    rows: list[dict],
+    on_conflict: str,
+    job: str | None = None,
+    batch_size: int | None = None,
+    concurrency: int | None = None,
+    retries: int | None = None,
+    ignore_fields: tuple[str, ...] = ("id", "modified_at")
+) -> dict:
+    """
+    Upserts rows in batches, keeping `concurrency` batches in flight and
+    retrying a failed batch with exponential backoff.
+    Completed batches are checkpointed under `job`, in memory and in the
+    jsons table, so rerunning the same write after a failure (on any machine)
+    skips the batches that already landed. Batches are
+    matched by content, ignoring `ignore_fields` that change on every run
+    (generated ids, timestamps).
+
+    Args:
+        table (str): Table name.
+        rows (list[dict]): Rows to upsert, in batch order.
+        on_conflict (str): Conflict column(s) for the upsert.
+        job (str): Checkpoint name (default: the table).
+        batch_size (int): Rows per upsert request (default: DB_WRITE_BATCH_SIZE).
+        concurrency (int): Batches in flight (default: DB_WRITE_CONCURRENCY).
+        retries (int): Retries per batch (default: DB_WRITE_RETRIES).
+        ignore_fields (tuple): Fields left out of the batch checkpoint digest.
+
+    Returns the run summary (rows written and skipped, retries, rows per second).
+    Raises HTTPException 500 if any batch still fails; its checkpoint is kept.
+    """
+    job = job or table
+    batch_size = batch_size or DB_WRITE_BATCH_SIZE
+    concurrency = concurrency or DB_WRITE_CONCURRENCY
+    retries = DB_WRITE_RETRIES if retries is None else retries
+
+    batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+    completed = _bulk_checkpoints[job]
+    completed |= await _load_checkpoint(job)
+    semaphore = asyncio.Semaphore(concurrency)
+    # Serializes checkpoint saves, so a slower save never overwrites a newer one
+    checkpoint_lock = asyncio.Lock()
+    run = {
+        "table": table,
+        "status": "running",
+        "started_at": time.time(),
+        "rows": len(rows),
+        "batches": len(batches),
+        "written_rows": 0,
+        "skipped_batches": 0,
+        "failed_batches": 0,
+        "retries": 0,
+        "duration_ms": None,
+        "rows_per_second": None,
     }
-)
+    _bulk_write_runs[job] = run
+
+    async def write_batch(number: int, batch: list[dict]):
+        digest = _batch_digest(batch, ignore_fields)
+        if digest in completed:
+            run["skipped_batches"] += 1
+            return
+        async with semaphore:
+            for attempt in range(retries + 1):
+                try:
+                    response = await upsert_rows(table, batch, on_conflict=on_conflict)
+                    if not response.data:
+                        raise HTTPException(status_code=500, detail=f"Upsert into {table} returned no rows")
+                    break
+                except Exception as e:
+                    if attempt == retries:
+                        run["failed_batches"] += 1
+                        raise
+                    run["retries"] += 1
+                    print(f"[{job}] Batch {number} failed ({e}), retry {attempt + 1}/{retries}")
+                    await asyncio.sleep(DB_WRITE_RETRY_BACKOFF * 2 ** attempt)
+        completed.add(digest)
+        run["written_rows"] += len(batch)
+        async with checkpoint_lock:
+            await _save_checkpoint(job, completed)
 
-def getDBClient():
-    return supabase
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(write_batch(number, batch) for number, batch in enumerate(batches, start=1)),
+        return_exceptions=True
+    )
+    elapsed = time.perf_counter() - start
+    run["duration_ms"] = round(elapsed * 1000, 2)
+    run["rows_per_second"] = round(run["written_rows"] / elapsed) if elapsed else None
+
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        run["status"] = "failed"
+        run["error"] = str(errors[0])
+        print(f"[{job}] Bulk write failed: {run}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"{run['failed_batches']} of {len(batches)} batches failed writing {table}, rerun to resume: {errors[0]}"
+        )
+
+    _bulk_checkpoints.pop(job, None)
+    if batches:
+        await _clear_checkpoint(job)
+    run["status"] = "completed"
+    print(f"[{job}] Bulk write: {run}")
+    return run
+
+def get_query_stats() -> dict:
+    result = {}
+    for name, stats in _query_stats.items():
+        samples = sorted(stats["samples"])
+        result[name] = {
+            "count": stats["count"],
+            "errors": stats["errors"],
+            "timeouts": stats["timeouts"],
+            "avg_ms": round(stats["total_ms"] / stats["count"], 2) if stats["count"] else 0.0,
+            "max_ms": round(stats["max_ms"], 2),
+            "p50_ms": round(samples[len(samples) // 2], 2) if samples else 0.0,
+            "p95_ms": round(samples[int(len(samples) * 0.95)], 2) if samples else 0.0,
+        }
+    return result
+
+@db_router.get("/db/stats")
+async def db_stats():
+    """
+    Query latency stats per table/operation and connection pool settings.
+    """
+    return {
+        "pool": {
+            "max_connections": DB_MAX_CONNECTIONS,
+            "query_timeout_seconds": DB_QUERY_TIMEOUT,
+            "connected": _db_client is not None
+        },
+        "session": _db_status,
+        "queries": get_query_stats(),
+        "bulk_writes": {
+            job: {**run, "checkpointed_batches": len(_bulk_checkpoints.get(job, ()))}
+            for job, run in _bulk_write_runs.items()
+        }
+    }
 
 # Utility function to create a user
 def create_dbuser(data: dict):
@@ -0,0 +1,284 @@
+import asyncio
+import inspect
+import json
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from fastapi import APIRouter
+from routers.database import compare_and_set_json, delete_rows, read_table, select_rows
+from routers.utils import INSTANCE_ID, getEnvVariable
+
+datasets_router = APIRouter()
+
+# Table holding the rows of each dataset. Every row carries the version of the build
+# that wrote it: a build writes a full copy of the dataset under a new version, and
+# publishing moves the dataset's pointer to it, so readers never see a build in progress.
+DATASET_TABLES = {"bus_routes": "bus_route", "bus_stops": "bus_stops", "bus_route_raw": "bus_route_raw"}
+# Column identifying a row within one version of each dataset
+DATASET_KEYS = {"bus_routes": "service_no", "bus_stops": "id", "bus_route_raw": "id"}
+# One jsons row per dataset, {"version", "previous", "building"}, under this prefix. While a
+# build runs, "holder" and "expires_at" record the process building it and its lease
+DATASET_POINTER_PREFIX = "datasetVersion:"
+DATASET_POLL_INTERVAL = int(getEnvVariable("DATASET_POLL_INTERVAL", required=False) or 60)
+# A running build renews its lease every third of this; a crashed builder's version can be
+# resumed elsewhere once it expires
+DATASET_BUILD_LEASE_SECONDS = int(getEnvVariable("DATASET_BUILD_LEASE_SECONDS", required=False) or 300)
+DATASET_PUBLISH_RETRIES = 3
+DATASET_PUBLISH_BACKOFF = 0.5   # seconds before the first retry, doubled per attempt
+DATASET_PRUNE_BATCH_SIZE = 200  # keys per delete request
+
+# Published version per dataset, as last seen by this machine
+_versions: dict[str, str] = {}
+# Builds in progress per dataset
+_building: dict[str, int] = defaultdict(int)
+# Callbacks that drop artifacts of a dataset once a new version is published
+_invalidators: dict[str, list] = defaultdict(list)
+_poll_lock = asyncio.Lock()
+_dataset_status = {"published_at": {}, "publish_failures": {}, "last_poll_at": None, "poll_failures": 0}
+
+def dataset_version(dataset: str) -> str:
+    return _versions.get(dataset, "")
+
+def versioned_key(dataset: str, key: str) -> str:
+    """Cache key tied to the current version, so a publish makes it unreachable."""
+    return f"{key}@{dataset_version(dataset)}"
+
+def on_publish(dataset: str, callback):
+    """Registers a callback run whenever a new version of dataset is seen."""
+    _invalidators[dataset].append(callback)
+
+async def _apply_versions(record: dict[str, str]):
+    for dataset, version in record.items():
+        if _versions.get(dataset) == version:
+            continue
+        _versions[dataset] = version
+        for callback in _invalidators[dataset]:
+            try:
+                result = callback()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"Error invalidating {dataset} artifacts: {e}")
+        print(f"Dataset {dataset} is now at version {version}")
+
+async def _read_pointers(datasets) -> dict[str, tuple[dict, str]]:
+    """dataset -> (pointer record, modified_at of its row) for the datasets that have one."""
+    response = await select_rows(
+        "jsons", "id, json_value, modified_at", in_={"id": [DATASET_POINTER_PREFIX + dataset for dataset in datasets]}
+    )
+    pointers = {}
+    for row in response.data or []:
+        record = row["json_value"]
+        pointers[row["id"].removeprefix(DATASET_POINTER_PREFIX)] = (
+            json.loads(record) if isinstance(record, str) else record, row["modified_at"]
+        )
+    return pointers
+
+async def refresh_versions():
+    pointers = await _read_pointers(DATASET_TABLES)
+    await _apply_versions({dataset: record["version"] for dataset, (record, _) in pointers.items() if record.get("version")})
+    _dataset_status["last_poll_at"] = time.time()
+
+async def published_version(dataset: str) -> str:
+    """The published version of dataset, reading the pointers first if this process has not yet."""
+    if _dataset_status["last_poll_at"] is None:
+        async with _poll_lock:
+            if _dataset_status["last_poll_at"] is None:
+                await refresh_versions()
+    return dataset_version(dataset)
+
+async def read_dataset(dataset: str, columns: str = "*", order: str = "id", version: str | None = None):
+    """
+    Reads the rows of the published version of dataset (or of `version`) as
+    read_table pages. Before the first publish, rows have no version.
+    """
+    if version is None:
+        version = await published_version(dataset)
+    async for rows in read_table(DATASET_TABLES[dataset], columns, order, eq={"version": version or None}):
+        yield rows
+
+class DatasetBuild:
+    """
+    A build of one dataset: its rows are written under `version`, and rows
+    it does not change are copied forward from `base`, the version that was
+    published when the build started.
+    """
+    def __init__(self, dataset: str, version: str, base: str | None, resumed: bool = False):
+        self.dataset = dataset
+        self.table = DATASET_TABLES[dataset]
+        self.key = DATASET_KEYS[dataset]
+        self.version = version
+        self.base = base
+        self.resumed = resumed
+        self.keys: set = set()
+        self.published = False
+        self.publish_error: str | None = None
+
+    @property
+    def checkpoint(self) -> str:
+        """bulk_upsert job name, so a rerun of a failed build resumes it."""
+        return f"{self.table}@{self.version}"
+
+    def tag(self, rows: list[dict]) -> list[dict]:
+        """The rows to write, under the build's version."""
+        self.keys.update(row[self.key] for row in rows)
+        return [{**row, "version": self.version} for row in rows]
+
+    async def read_base(self, columns: str = "*", order: str = "id"):
+        async for rows in read_table(self.table, columns, order, eq={"version": self.base}):
+            yield rows
+
+    def summary(self) -> dict:
+        summary = {"version": self.version, "published": self.published}
+        if self.publish_error:
+            summary["publish_error"] = self.publish_error
+        return summary
+
+def _build_lease(version: str, expires_at: float) -> dict:
+    return {"building": version, "holder": INSTANCE_ID, "expires_at": expires_at}
+
+async def _start_build(dataset: str) -> DatasetBuild:
+    """
+    Reserves a version for a build in the dataset's pointer, leased to this
+    process. A version left reserved by a build that failed, or whose holder
+    let its lease expire, is taken over, so the rerun overwrites its rows and
+    resumes its bulk write checkpoint. Raises while another process holds it.
+    """
+    key = DATASET_POINTER_PREFIX + dataset
+    for _ in range(DATASET_PUBLISH_RETRIES + 1):
+        record, modified_at = (await _read_pointers([dataset])).get(dataset, ({}, None))
+        now = time.time()
+        building = record.get("building")
+        if building and record.get("expires_at", 0) > now:
+            raise RuntimeError(f"{dataset} version {building} is being built by {record.get('holder')}")
+        version = building or f"{int(now)}-{uuid.uuid4().hex[:6]}"
+        if await compare_and_set_json(key, {**record, **_build_lease(version, now + DATASET_BUILD_LEASE_SECONDS)}, modified_at):
+            return DatasetBuild(dataset, version, record.get("version"), resumed=bool(building))
+    raise RuntimeError(f"Could not reserve a build version for {dataset}, its pointer kept changing")
+
+async def _set_build_lease(build: DatasetBuild, expires_at: float) -> bool:
+    """Moves the expiry of the build's lease; False if this process no longer holds it."""
+    key = DATASET_POINTER_PREFIX + build.dataset
+    for _ in range(DATASET_PUBLISH_RETRIES + 1):
+        record, modified_at = (await _read_pointers([build.dataset])).get(build.dataset, ({}, None))
+        if record.get("building") != build.version or record.get("holder") != INSTANCE_ID:
+            return False
+        if await compare_and_set_json(key, {**record, **_build_lease(build.version, expires_at)}, modified_at):
+            return True
+    return False
+
+async def _renew_build_lease(build: DatasetBuild):
+    """Background task of a running build: keeps its lease from expiring."""
+    while True:
+        await asyncio.sleep(DATASET_BUILD_LEASE_SECONDS / 3)
+        try:
+            if not await _set_build_lease(build, time.time() + DATASET_BUILD_LEASE_SECONDS):
+                print(f"Lost the lease of {build.dataset} version {build.version}, it will not be published")
+                return
+        except Exception as e:
+            print(f"Error renewing the lease of {build.dataset} version {build.version}: {e}")
+
+async def _prune(build: DatasetBuild):
+    """Deletes the rows an earlier, failed run of a resumed build wrote and this run did not."""
+    stale = []
+    async for rows in read_table(build.table, build.key, build.key, eq={"version": build.version}):
+        stale.extend(row[build.key] for row in rows if row[build.key] not in build.keys)
+    for start in range(0, len(stale), DATASET_PRUNE_BATCH_SIZE):
+        await delete_rows(build.table, eq={"version": build.version}, in_={build.key: stale[start:start + DATASET_PRUNE_BATCH_SIZE]})
+
+async def publish_dataset(build: DatasetBuild):
+    """
+    Points the dataset at the build's version with a compare-and-set on its
+    pointer row, so concurrent publishes never lose one another, and drops
+    the rows of the version before the previous one (machines that have not
+    polled yet still read the previous one). Other machines pick the new
+    version up on their next poll. Only the holder of the build's lease
+    publishes it: once it expired and another process took the version over,
+    that process publishes it.
+    """
+    key = DATASET_POINTER_PREFIX + build.dataset
+    for attempt in range(DATASET_PUBLISH_RETRIES + 1):
+        try:
+            record, modified_at = (await _read_pointers([build.dataset])).get(build.dataset, ({}, None))
+            if record.get("version") == build.version:
+                break  # a concurrent run of the same build published it
+            if record.get("building") != build.version or record.get("holder") != INSTANCE_ID:
+                error = "another process took the build over"
+                continue
+            pointer = {"version": build.version, "previous": record.get("version"), "building": None}
+            if await compare_and_set_json(key, pointer, modified_at):
+                if "previous" in record:
+                    await _drop_version(build.table, record["previous"])
+                break
+            error = "the pointer changed during the publish"
+        except Exception as e:
+            error = str(e)
+        if attempt < DATASET_PUBLISH_RETRIES:
+            await asyncio.sleep(DATASET_PUBLISH_BACKOFF * 2 ** attempt)
+    else:
+        build.publish_error = error
+        _dataset_status["publish_failures"][build.dataset] = {"version": build.version, "error": error, "at": time.time()}
+        print(f"Error publishing {build.dataset} version {build.version}, rerun the build to publish it: {error}")
+        return
+
+    build.published = True
+    _dataset_status["published_at"][build.dataset] = time.time()
+    _dataset_status["publish_failures"].pop(build.dataset, None)
+    await _apply_versions({build.dataset: build.version})
+
+async def _drop_version(table: str, version: str | None):
+    try:
+        await delete_rows(table, eq={"version": version})
+    except Exception as e:
+        print(f"Error dropping version {version} rows from {table}: {e}")
+
+@asynccontextmanager
+async def dataset_build(dataset: str):
+    """
+    Wraps the writes of a dataset build and yields its DatasetBuild. Readers
+    keep reading the published version while it runs; the new version is
+    published only if the build completes. A publish that still fails after
+    retries is logged and reported in build.summary(), not raised, since
+    the rows are already written.
+    """
+    build = await _start_build(dataset)
+    _building[dataset] += 1
+    renewal = asyncio.create_task(_renew_build_lease(build))
+    try:
+        yield build
+        if build.resumed:
+            await _prune(build)
+    except BaseException:
+        # The version stays reserved for a rerun, which need not wait for the lease to expire
+        try:
+            await _set_build_lease(build, 0)
+        except Exception as e:
+            print(f"Error releasing the lease of {dataset} version {build.version}: {e}")
+        raise
+    finally:
+        renewal.cancel()
+        _building[dataset] -= 1
+    await publish_dataset(build)
+
+async def poll_dataset_versions_loop():
+    """Background task: follows versions published by other machines."""
+    while True:
+        try:
+            await refresh_versions()
+        except Exception as e:
+            _dataset_status["poll_failures"] += 1
+            print(f"Error polling dataset versions: {e}")
+        await asyncio.sleep(DATASET_POLL_INTERVAL)
+
+@datasets_router.get("/datasets")
+async def get_datasets():
+    """
+    Published version of every dataset on this machine and builds in progress.
+    """
+    return {
+        "versions": _versions,
+        "building": [dataset for dataset, count in _building.items() if count],
+        "poll_interval_seconds": DATASET_POLL_INTERVAL,
+        **_dataset_status
+    }
@@ -3,12 +3,10 @@ from fastapi import APIRouter, HTTPException
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import pytz
-from routers.database import getDBClient
+from routers.database import delete_rows, upsert_rows
 
 device_token_router = APIRouter()
 
-supabase = getDBClient()
-
 class DeviceToken(BaseModel):
     token: str
     device_type: str
@@ -42,12 +40,13 @@ async def register_device_token(device: DeviceToken):
             device_data["push_to_start_token"] = device.push_to_start_token
 
         # Upsert into devices table
-        response = supabase.table("devices").upsert(
+        response = await upsert_rows(
+            "devices",
             [device_data],
             on_conflict="id",
             ignore_duplicates=False, 
             returning="minimal" 
-        ).execute()
+        )
 
         # Check if the operation was successful
         # if not response.data:
@@ -72,10 +71,7 @@ async def delete_device_token(device: DeviceToken):
     - Accepts a device token in the request body.
     """
     try:
-        response = (supabase.table("devices")
-                    .delete()
-                    .eq("id",device.token)
-                    .execute())
+        response = await delete_rows("devices", eq={"id": device.token})
 
         print(f"Deleted device token: {device.token}")
 
@@ -1,16 +1,35 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Response
 import httpx
 from pydantic import BaseModel
 from datetime import datetime
+import json
 import polyline
+import pytz
 
-from routers.utils import getEnvVariable
+from routers.cache import BoundedCache
+from routers.metrics import track_cache, upstream_hooks
+from routers.utils import POLYLINE_DETAIL_TOLERANCES, POLYLINE_FORMATS, getEnvVariable, simplify_polyline
 
 directions_router = APIRouter()
 
 ONEMAP_API_TOKEN = getEnvVariable("ONEMAP_API_TOKEN")
 ONEMAP_ROUTE_URL = "https://www.onemap.gov.sg/api/public/routingsvc/route"
 
+# Requests whose ends round to the same ~110m grid cell and depart in the same
+# 10 minute bucket share one cached OneMap response
+ROUTE_COORD_DECIMALS = 3
+ROUTE_TIME_BUCKET_MINUTES = 10
+ROUTE_CACHE_TTL = 60 * 10
+# summary: itinerary and leg totals only; encoded: full with encoded leg geometry
+TRANSIT_ROUTE_PROFILES = ("summary", "encoded", "full")
+SGT = pytz.timezone("Asia/Singapore")
+
+# Raw OneMap response bytes, and encoded /transit_route outputs per detail/format
+onemap_route_cache = BoundedCache(max_entries=500)
+transit_route_cache = BoundedCache(max_entries=1000)
+track_cache("onemap_route", onemap_route_cache.stats)
+track_cache("transit_route", transit_route_cache.stats)
+
 class TransitRouteRequest(BaseModel):
     start_lat: float
     start_lon: float
@@ -19,12 +38,25 @@ class TransitRouteRequest(BaseModel):
     date: str = None
     time: str = None
 
-@directions_router.post("/transit_route_full")
-async def get_transit_route_full(body: TransitRouteRequest):
+def route_cache_key(body: TransitRouteRequest) -> str:
+    """Quantized start/end coordinates plus the departure date and time bucket."""
+    now = datetime.now(SGT)
+    date = body.date or now.strftime("%m-%d-%Y")
+    if body.time:
+        try:
+            hours, minutes = (int(part) for part in body.time.split(":")[:2])
+        except ValueError:
+            hours, minutes = now.hour, now.minute
+    else:
+        hours, minutes = now.hour, now.minute
+    bucket = (hours * 60 + minutes) // ROUTE_TIME_BUCKET_MINUTES
+    coords = (body.start_lat, body.start_lon, body.end_lat, body.end_lon)
+    return "|".join(f"{round(c, ROUTE_COORD_DECIMALS):.{ROUTE_COORD_DECIMALS}f}" for c in coords) + f"|{date}|{bucket}"
+
+async def fetch_onemap_route(body: TransitRouteRequest) -> bytes:
     """
-    Calls OneMap public transport routing API with start/end points.
+    Calls OneMap public transport routing API and returns the raw JSON body.
     """
-
     headers = {
         "Authorization": f"{ONEMAP_API_TOKEN}"
     }
@@ -35,7 +67,7 @@ async def get_transit_route_full(body: TransitRouteRequest):
     params = {
         "start": start,
         "end": end,
-        "routeType": "pt",  
+        "routeType": "pt",
         "mode": "transit",
         "n_itineraries": "3"
     }
@@ -45,7 +77,7 @@ async def get_transit_route_full(body: TransitRouteRequest):
     if body.time:
         params["time"] = body.time
 
-    async with httpx.AsyncClient() as client:
+    async with httpx.AsyncClient(event_hooks=upstream_hooks("onemap")) as client:
         response = await client.get(ONEMAP_ROUTE_URL, headers=headers, params=params)
 
     if response.status_code != 200:
@@ -54,60 +86,100 @@ async def get_transit_route_full(body: TransitRouteRequest):
             detail=f"OneMap API error: {response.text}"
         )
 
-    return response.json()
+    return response.content
+
+async def get_onemap_route(body: TransitRouteRequest, key: str) -> bytes:
+    return await onemap_route_cache.get_or_fetch(key, ROUTE_CACHE_TTL, lambda: fetch_onemap_route(body))
+
+@directions_router.post("/transit_route_full")
+async def get_transit_route_full(body: TransitRouteRequest):
+    """
+    Calls OneMap public transport routing API with start/end points.
+    """
+    content = await get_onemap_route(body, route_cache_key(body))
+    return Response(content=content, media_type="application/json")
 
 @directions_router.post("/transit_route")
-async def get_transit_route(body: TransitRouteRequest):
+async def get_transit_route(
+    body: TransitRouteRequest,
+    detail: str = "full",
+    format: str = "json",
+    profile: str = "full"
+):
     """
     Calls OneMap public transport routing API and decodes all leg geometries
+    - detail: full, high, medium or low (Douglas-Peucker simplified).
+    - format: json for decoded "coordinates", encoded for an encoded "polyline" per leg.
+    - profile: summary (no geometry or intermediate stops), encoded (same as
+      format=encoded) or full.
+    """
+    if profile not in TRANSIT_ROUTE_PROFILES:
+        raise HTTPException(status_code=400, detail=f"profile must be one of {list(TRANSIT_ROUTE_PROFILES)}")
+    if profile == "encoded":
+        format = "encoded"
+    elif profile == "summary":
+        # Geometry is skipped, so detail/format must not split the cache
+        detail, format = "full", "json"
+    if detail not in POLYLINE_DETAIL_TOLERANCES:
+        raise HTTPException(status_code=400, detail=f"detail must be one of {list(POLYLINE_DETAIL_TOLERANCES)}")
+    if format not in POLYLINE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(POLYLINE_FORMATS)}")
+
+    key = route_cache_key(body)
+
+    async def build() -> bytes:
+        data = json.loads(await get_onemap_route(body, key))
+        result = decode_transit_route(data, POLYLINE_DETAIL_TOLERANCES[detail], format, profile)
+        return json.dumps(result, separators=(",", ":")).encode("utf-8")
+
+    content = await transit_route_cache.get_or_fetch(f"{key}|{profile}|{detail}|{format}", ROUTE_CACHE_TTL, build)
+    return Response(content=content, media_type="application/json")
+
+@directions_router.get("/transit_route/cache")
+async def get_transit_route_cache_stats():
+    return {"onemap": onemap_route_cache.stats(), "transit_route": transit_route_cache.stats()}
+
+def decode_transit_route(data: dict, tolerance: float, format: str, profile: str = "full") -> dict:
+    """
+    Flattens a OneMap routing response, decoding or re-encoding every legGeometry.
+    The summary profile skips leg geometry and intermediate stops entirely.
     """
-
-    headers = {
-        "Authorization": f"{ONEMAP_API_TOKEN}"
-    }
-
-    start = f"{body.start_lat},{body.start_lon}"
-    end = f"{body.end_lat},{body.end_lon}"
-
-    params = {
-        "start": start,
-        "end": end,
-        "routeType": "pt",
-        "mode": "transit", 
-        "n_itineraries": "3"
-    }
-
-    if body.date:
-        params["date"] = body.date
-    if body.time:
-        params["time"] = body.time
-
-    async with httpx.AsyncClient() as client:
-        response = await client.get(ONEMAP_ROUTE_URL, headers=headers, params=params)
-
-    if response.status_code != 200:
-        raise HTTPException(
-            status_code=response.status_code,
-            detail=f"OneMap API error: {response.text}"
-        )
-
-    data = response.json()
 
     # ------------------------------------------
     # Loop through itineraries and legs
     # Decode all legGeometry points
     # ------------------------------------------
     decoded_itineraries = []
+    summary = profile == "summary"
 
-    for itin_index, itinerary in enumerate(data.get("plan", {}).get("itineraries", [])):
+    for itinerary in data.get("plan", {}).get("itineraries", []):
         decoded_legs = []
 
-        for leg_index, leg in enumerate(itinerary.get("legs", [])):
+        for leg in itinerary.get("legs", []):
+            decoded_leg = {
+                "mode": leg.get("mode"),
+                "distance": leg.get("distance"),
+                "start_name": leg.get("from", {}).get("name"),
+                "start_code": leg.get("from", {}).get("stopCode"),
+                "end_name": leg.get("to", {}).get("name"),
+                "end_code": leg.get("to", {}).get("stopCode"),
+                "route_id": leg.get("routeId"),
+                "duration": leg.get("duration"),
+            }
+            if summary:
+                decoded_legs.append(decoded_leg)
+                continue
+
             encoded_poly = leg.get("legGeometry", {}).get("points")
-            if encoded_poly:
-                coords = polyline.decode(encoded_poly)  # List of (lat, lon)
+            if format == "encoded" and not tolerance:
+                decoded_leg["polyline"] = encoded_poly or ""  # Pass OneMap's encoding through
             else:
-                coords = []
+                coords = polyline.decode(encoded_poly) if encoded_poly else []  # List of (lat, lon)
+                coords = simplify_polyline(coords, tolerance)
+                if format == "encoded":
+                    decoded_leg["polyline"] = polyline.encode(coords) if coords else ""
+                else:
+                    decoded_leg["coordinates"] = coords
 
             intermediate_stops = []
             if leg.get("transitLeg"):
@@ -120,19 +192,8 @@ async def get_transit_route(body: TransitRouteRequest):
                         "lon": stop.get("lon"),
                         "stopCode": stop.get("stopCode")
                     })
-
-            decoded_legs.append({
-                "mode": leg.get("mode"),
-                "distance": leg.get("distance"),
-                "start_name": leg.get("from", {}).get("name"),
-                "start_code": leg.get("from", {}).get("stopCode"),
-                "end_name": leg.get("to", {}).get("name"),
-                "end_code": leg.get("to", {}).get("stopCode"),
-                "route_id": leg.get("routeId"),
-                "coordinates": coords,
-                "duration": leg.get("duration"),
-                "intermediate_stops": intermediate_stops
-            })
+            decoded_leg["intermediate_stops"] = intermediate_stops
+            decoded_legs.append(decoded_leg)
 
         decoded_itineraries.append({
             "duration": itinerary.get("duration"),
@@ -148,4 +209,4 @@ async def get_transit_route(body: TransitRouteRequest):
         "from": data.get("plan", {}).get("from"),
         "to": data.get("plan", {}).get("to"),
         "itineraries": decoded_itineraries
-    }
\ No newline at end of file
+    }
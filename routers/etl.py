@@ -0,0 +1,203 @@
+import json
+import logging
+import uuid
+from datetime import datetime
+import pytz
+from routers.database import bulk_upsert, select_rows, upsert_rows
+from routers.datasets import dataset_build, read_dataset
+from routers.executor import run_cpu
+from routers.ingest import get_bus_route_views
+from routers.timing import span
+from routers.utils import format_bus_route_raw_rows, getBusServicesFromLTA, map_bus_services, queryAPI
+
+logger = logging.getLogger(__name__)
+
+SGT = pytz.timezone("Asia/Singapore")
+BUS_STOP_AVAILABLE_SERVICES_KEY = "busStopAvailableServices"
+BUS_SERVICES_KEY = "busServices"
+
+BUS_ROUTE_COLUMNS = "id, service_no, json_value, modified_at"
+BUS_STOP_COLUMNS = "id, description, latitude, longitude, road_name, bus_services"
+
+# Dataset refreshes shared by the extract endpoints and the scheduled jobs.
+# They raise on failure; the endpoints turn errors into HTTP responses.
+# Each dataset build writes a full copy of its dataset (see routers/datasets.py).
+
+async def extract_bus_routes_raw(refresh: bool = False) -> dict:
+    """Stores one bus_route_raw row per bus stop from the latest BusRoutes ingest."""
+    views = await get_bus_route_views(refresh)
+    current_timestamp = datetime.now(SGT).isoformat()
+
+    with span("serialize"):
+        formatted_data = await run_cpu(format_bus_route_raw_rows, views["stops"], current_timestamp)
+
+    async with dataset_build("bus_route_raw") as build:
+        response = await upsert_rows("bus_route_raw", build.tag(formatted_data), on_conflict="id,version")
+        if not response.data:
+            raise RuntimeError("Failed to store bus routes data in Supabase")
+    return build.summary()
+
+async def extract_bus_routes(refresh: bool = False) -> list[dict]:
+    """
+    Stores the services available at each bus stop (the busStopAvailableServices
+    jsons row) from the latest BusRoutes ingest and returns the bus routes view.
+    """
+    views = await get_bus_route_views(refresh)
+    formatted_bus_route_data = views["bus_routes"]
+    print(f"Prepared {len(formatted_bus_route_data)} bus route records")
+
+    response = await upsert_rows(
+        "jsons",
+        [{
+            "id": BUS_STOP_AVAILABLE_SERVICES_KEY,
+            "json_value": json.dumps(views["bus_stop_services"]),
+            "modified_at": datetime.now(SGT).isoformat()
+        }],
+        on_conflict="id"
+    )
+    if not response.data:
+        raise RuntimeError("Failed to upsert bus stop available services data")
+    return formatted_bus_route_data
+
+async def refresh_bus_services() -> list[dict]:
+    """Fetches BusServices from LTA and stores them in the busServices jsons row."""
+    bus_services = await getBusServicesFromLTA()
+    if not bus_services:
+        return []
+    camelcased_bus_services = map_bus_services(bus_services)
+    await upsert_rows(
+        "jsons",
+        [{
+            "id": BUS_SERVICES_KEY,
+            "json_value": json.dumps(camelcased_bus_services),
+            "modified_at": datetime.now(SGT).isoformat()
+        }],
+        on_conflict="id"
+    )
+    return camelcased_bus_services
+
+async def _write_bus_routes(build, bus_routes: list[dict], removed: set[str]) -> dict:
+    """Writes the bus_route rows of a build: the given services plus the unchanged ones from its base."""
+    current_timestamp = datetime.now(SGT).isoformat()
+    formatted_bus_routes = [
+        {
+            "id": uuid.uuid4().hex[:12],
+            "service_no": str(bus_route["serviceNo"]),
+            "json_value": json.dumps(bus_route),
+            "modified_at": current_timestamp
+        }
+        for bus_route in bus_routes
+    ]
+    replaced = {row["service_no"] for row in formatted_bus_routes} | removed
+    async for rows in build.read_base(BUS_ROUTE_COLUMNS):
+        formatted_bus_routes.extend({**row, "id": uuid.uuid4().hex[:12]} for row in rows if row["service_no"] not in replaced)
+    print(f"Prepared {len(formatted_bus_routes)} bus route records for version {build.version}")
+
+    write = await bulk_upsert(
+        "bus_route", build.tag(formatted_bus_routes), on_conflict="service_no,version", job=build.checkpoint
+    )
+    print(f"Upserted {write['written_rows']} bus route records at {write['rows_per_second']} rows/s")
+    return write
+
+async def update_bus_routes(bus_routes: list[dict]) -> dict:
+    """Publishes bus routes with the given services replaced; returns the bulk write summary."""
+    async with dataset_build("bus_routes") as build:
+        write = await _write_bus_routes(build, bus_routes, set())
+    return {"write": write, **build.summary()}
+
+async def delete_bus_routes(service_numbers: list[str]) -> dict:
+    """Publishes bus routes without the given services; returns the services that were removed."""
+    async with dataset_build("bus_routes") as build:
+        deleted = set()
+        async for rows in build.read_base("service_no"):
+            deleted.update(row["service_no"] for row in rows if row["service_no"] in service_numbers)
+        await _write_bus_routes(build, [], deleted)
+    return {"serviceNumbers": sorted(deleted), **build.summary()}
+
+async def extract_bus_stops() -> dict:
+    """
+    Fetches bus stops from the LTA API and upserts the new and changed ones
+    into bus_stops, with the services from busStopAvailableServices.
+    """
+    logger.info("Fetching bus_stop_master_list from jsons table...")
+    jsons_response = await select_rows("jsons", "json_value", eq={"id": BUS_STOP_AVAILABLE_SERVICES_KEY})
+    if not jsons_response.data:
+        raise RuntimeError("busStopAvailableServices not found in jsons table")
+
+    bus_stop_master_list = jsons_response.data[0]["json_value"]
+    # Parse if json_value is TEXT
+    if isinstance(bus_stop_master_list, str):
+        bus_stop_master_list = json.loads(bus_stop_master_list)
+
+    logger.info("Fetching existing bus stops from Supabase...")
+    bus_stop_map = {}
+    async for rows in read_dataset("bus_stops", BUS_STOP_COLUMNS + ", modified_at"):
+        for stop in rows:
+            bus_stop_map[stop["id"]] = stop
+    logger.info(f"Fetched {len(bus_stop_map)} existing bus stops")
+
+    logger.info("Fetching bus stops from LTA API...")
+    counter = 0
+    results = []
+    while True:
+        result = await queryAPI("ltaodataservice/BusStops", {"$skip": str(counter)})
+        results.append(result)
+        counter += 500
+        logger.debug(f"Fetched {len(result.get('value', []))} bus stops at offset {counter}")
+        if counter >= 10000:  # Adjust based on API limits
+            break
+
+    data_list = [item for res in results if res.get("value") for item in res["value"]]
+    logger.info(f"Fetched total {len(data_list)} bus stops from API")
+
+    current_timestamp = datetime.now(SGT).isoformat()
+    new_busstops = []
+    updated_busstops = []
+
+    for stop in data_list:
+        stop_id = stop["BusStopCode"]
+        new_data = {
+            "id": stop_id,
+            "description": stop["Description"],
+            "latitude": float(stop["Latitude"]),
+            "longitude": float(stop["Longitude"]),
+            "road_name": stop["RoadName"],
+            "bus_services": ",".join(map(str, bus_stop_master_list.get(stop_id, []))),
+            "modified_at": current_timestamp
+        }
+
+        existing = bus_stop_map.get(stop_id)
+        if existing is None:
+            new_busstops.append(new_data)
+        elif {k: existing[k] for k in ("description", "latitude", "longitude", "road_name", "bus_services")} != {
+            k: v for k, v in new_data.items() if k not in ("id", "modified_at")
+        }:
+            updated_busstops.append(new_data)
+
+    logger.info(f"{len(new_busstops)} new bus stops to insert")
+    logger.info(f"{len(updated_busstops)} existing bus stops to update")
+
+    # A new version holds every existing stop, with the new and changed ones replaced
+    write = None
+    dataset = {}
+    if new_busstops or updated_busstops:
+        for stop in new_busstops + updated_busstops:
+            bus_stop_map[stop["id"]] = stop
+        logger.info("Upserting bus stops (batched)...")
+        async with dataset_build("bus_stops") as build:
+            write = await bulk_upsert(
+                "bus_stops", build.tag(list(bus_stop_map.values())), on_conflict="id,version",
+                job=build.checkpoint, ignore_fields=("modified_at",)
+            )
+        logger.info(f"Upserted {write['written_rows']} bus stops at {write['rows_per_second']} rows/s")
+        dataset = build.summary()
+
+    logger.info(f"Total stored bus stops: {len(bus_stop_map)}")
+
+    return {
+        "message": "Bus stops processed successfully",
+        "new": len(new_busstops),
+        "updated": len(updated_busstops),
+        "write": write,
+        **dataset
+    }
@@ -0,0 +1,49 @@
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from routers.utils import getEnvVariable
+
+# "thread" (default), "process" or "inline" (run on the event loop, for debugging).
+# On our single-CPU VM threads keep loop stalls to about one GIL switch interval;
+# processes only pay off with spare cores, since arguments and results are
+# pickled and unpickled while holding the GIL.
+CPU_EXECUTOR = (getEnvVariable("CPU_EXECUTOR", required=False) or "thread").lower()
+CPU_WORKERS = int(getEnvVariable("CPU_WORKERS", required=False) or 1)
+
+_executor: Executor = None
+
+def get_executor() -> Executor | None:
+    global _executor
+    if _executor is None and CPU_EXECUTOR != "inline":
+        if CPU_EXECUTOR == "process":
+            # spawn: forking a process that already runs the event loop and httpx threads is unsafe
+            _executor = ProcessPoolExecutor(max_workers=CPU_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            _executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu")
+    return _executor
+
+async def run_cpu(func, *args, **kwargs):
+    """
+    Runs a CPU-bound transform off the event loop and awaits its result.
+    With the process executor, func and its arguments must be picklable
+    (module-level functions and plain data).
+    """
+    call = functools.partial(func, *args, **kwargs)
+    executor = get_executor()
+    if executor is None:
+        return call()
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+async def warm_executor():
+    # Start the worker up front so the first offloaded call does not pay for the spawn
+    try:
+        await run_cpu(int, 0)
+    except Exception as e:
+        print(f"Error starting CPU executor: {e}")
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -2,15 +2,13 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from datetime import datetime
 
-from routers.database import getDBClient
+from routers.database import insert_rows
 
 class FeedbackRequest(BaseModel):
     device_token: str
     message: str
     app_version: str
 
-dbClient = getDBClient()
-
 feedback_router = APIRouter()
 
 @feedback_router.post("/submitFeedback")
@@ -22,7 +20,7 @@ async def submit_feedback(feedback: FeedbackRequest):
             "app_version": feedback.app_version,
             "created_at": datetime.utcnow().isoformat()
         }
-        response = dbClient.table("feedback").insert(data).execute()
+        response = await insert_rows("feedback", data)
         if response.data:
             return {"message": "Feedback submitted successfully"}
         else:
@@ -0,0 +1,60 @@
+import asyncio
+import time
+from routers.executor import run_cpu
+from routers.timing import span
+from routers.utils import build_bus_route_views, getBusRoutesFromLTA
+
+# Reuse one BusRoutes fetch across the extract endpoints for this long
+BUS_ROUTE_VIEWS_MAX_AGE = 60 * 60
+
+# Latest published views and the metrics of the run that built them
+_bus_route_views: dict = None
+_bus_route_metrics: dict = {}
+_ingest_lock = asyncio.Lock()
+
+async def run_bus_route_ingest() -> dict:
+    """
+    Fetches BusRoutes from LTA once and builds every derived view in one pass.
+    The views are published together so all consumers see the same run.
+    """
+    global _bus_route_views, _bus_route_metrics
+
+    start = time.perf_counter()
+    raw_bus_route_data = await getBusRoutesFromLTA()
+    fetched = time.perf_counter()
+    with span("transform"):
+        views = await run_cpu(build_bus_route_views, raw_bus_route_data)
+    built = time.perf_counter()
+
+    transform_seconds = built - fetched
+    _bus_route_views = views
+    _bus_route_metrics = {
+        "completed_at": time.time(),
+        "rows": len(raw_bus_route_data),
+        "services": len(views["bus_routes"]),
+        "bus_stops": len(views["stops"]),
+        "fetch_ms": round((fetched - start) * 1000, 2),
+        "transform_ms": round(transform_seconds * 1000, 2),
+        "total_ms": round((built - start) * 1000, 2),
+        "transform_rows_per_second": round(len(raw_bus_route_data) / transform_seconds) if transform_seconds else None,
+    }
+    print(f"Bus route ingest: {_bus_route_metrics}")
+    return views
+
+async def get_bus_route_views(refresh: bool = False) -> dict:
+    """
+    Returns the latest bus route views, running the ingest if they are
+    missing, older than BUS_ROUTE_VIEWS_MAX_AGE or refresh is set.
+    Concurrent callers wait for the same run instead of fetching again.
+    """
+    requested_at = time.time()
+    async with _ingest_lock:
+        # Another caller may have finished a run while we waited
+        completed_at = _bus_route_metrics.get("completed_at", 0)
+        fresh = completed_at >= requested_at if refresh else requested_at - completed_at < BUS_ROUTE_VIEWS_MAX_AGE
+        if _bus_route_views is None or not fresh:
+            await run_bus_route_ingest()
+        return _bus_route_views
+
+def get_bus_route_metrics() -> dict:
+    return _bus_route_metrics
@@ -0,0 +1,127 @@
+import asyncio
+from collections import deque
+import httpx
+from routers.utils import getEnvVariable
+
+LOG_BATCH_SIZE = int(getEnvVariable("LOG_BATCH_SIZE", required=False) or 100)
+LOG_FLUSH_INTERVAL = float(getEnvVariable("LOG_FLUSH_INTERVAL", required=False) or 2)
+LOG_QUEUE_SIZE = int(getEnvVariable("LOG_QUEUE_SIZE", required=False) or 5000)
+LOG_SHUTDOWN_TIMEOUT = 3.0  # seconds allowed for the final flush
+LOG_MAX_CONNECTIONS = 4     # pooled connections per sink, and requests in flight
+
+class LogShipper:
+    """
+    Ships log events to an HTTP ingest endpoint from one background task.
+    emit() only appends to a bounded in-memory queue; when the queue is full
+    the oldest event is dropped. Events are sent once LOG_BATCH_SIZE are
+    waiting or every LOG_FLUSH_INTERVAL seconds, as one JSON array per batch
+    when the endpoint accepts arrays, otherwise one request per event over
+    the same pooled connections, at most LOG_MAX_CONNECTIONS at a time.
+    """
+    def __init__(self, name: str, url: str, headers: dict | None = None, accepts_batches: bool = True):
+        self.name = name
+        self.url = url
+        self.headers = headers or {}
+        self.accepts_batches = accepts_batches
+        self._queue: deque = deque(maxlen=LOG_QUEUE_SIZE)
+        self._ready = asyncio.Event()
+        self._client: httpx.AsyncClient = None
+        self._task: asyncio.Task = None
+        self._stopping = False
+        self._in_flight = asyncio.Semaphore(LOG_MAX_CONNECTIONS)
+        self.stats = {"queued": 0, "sent": 0, "dropped": 0, "failed": 0, "batches": 0}
+
+    def emit(self, event: dict):
+        if len(self._queue) == self._queue.maxlen:
+            self.stats["dropped"] += 1
+        self._queue.append(event)
+        self.stats["queued"] += 1
+        if len(self._queue) >= LOG_BATCH_SIZE:
+            self._ready.set()
+
+    def start(self):
+        if self._task is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(5.0, connect=2.0),
+                limits=httpx.Limits(
+                    max_keepalive_connections=LOG_MAX_CONNECTIONS, max_connections=LOG_MAX_CONNECTIONS, keepalive_expiry=30
+                ),
+                headers=self.headers
+            )
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._ready.wait(), LOG_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._ready.clear()
+            await self.flush()
+
+    async def flush(self):
+        while self._queue:
+            batch = [self._queue.popleft() for _ in range(min(LOG_BATCH_SIZE, len(self._queue)))]
+            await self._send(batch)
+
+    async def _send(self, batch: list[dict]):
+        self.stats["batches"] += 1
+        if self.accepts_batches:
+            requests = [self._post(batch)]
+        else:
+            requests = [self._post(event) for event in batch]
+        results = await asyncio.gather(*requests, return_exceptions=True)
+        for result in results:
+            delivered = len(batch) if self.accepts_batches else 1
+            if isinstance(result, Exception) or result.is_error:
+                # Logs are best effort: count the loss and move on
+                self.stats["failed"] += delivered
+            else:
+                self.stats["sent"] += delivered
+
+    async def _post(self, payload):
+        # Waiting here rather than in the pool keeps queued posts from hitting PoolTimeout
+        async with self._in_flight:
+            return await self._client.post(self.url, json=payload)
+
+    async def stop(self):
+        """
+        Lets the background task finish the send in progress and flush the
+        queue, then sends what was emitted meanwhile and closes the client,
+        all within LOG_SHUTDOWN_TIMEOUT. Whatever is left then is dropped.
+        """
+        if self._task is None:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + LOG_SHUTDOWN_TIMEOUT
+        self._stopping = True
+        self._ready.set()
+        try:
+            await asyncio.wait_for(self._task, LOG_SHUTDOWN_TIMEOUT)
+            if self._queue:
+                await asyncio.wait_for(self.flush(), max(deadline - loop.time(), 0))
+        except Exception as e:
+            print(f"Error flushing {self.name} logs, {len(self._queue)} dropped: {e!r}")
+        self._task = None
+        await self._client.aclose()
+
+    def status(self) -> dict:
+        return {**self.stats, "pending": len(self._queue)}
+
+log_shippers: dict[str, LogShipper] = {}
+
+def get_log_shipper(name: str, url: str, headers: dict | None = None, accepts_batches: bool = True) -> LogShipper:
+    shipper = log_shippers.get(name)
+    if shipper is None:
+        shipper = log_shippers[name] = LogShipper(name, url, headers, accepts_batches)
+    return shipper
+
+def start_log_shippers():
+    for shipper in log_shippers.values():
+        shipper.start()
+
+async def stop_log_shippers():
+    await asyncio.gather(*(shipper.stop() for shipper in log_shippers.values()))
+
+def get_log_shipper_stats() -> dict:
+    return {name: shipper.status() for name, shipper in log_shippers.items()}
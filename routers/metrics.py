@@ -0,0 +1,220 @@
+import os
+import resource
+import time
+from bisect import bisect_left
+from fastapi import APIRouter, Response
+import httpx
+
+metrics_router = APIRouter()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+class Metric:
+    """
+    A metric family. Values are either updated in place on the hot path or,
+    when collect is given, read from collect() (label values, value) pairs
+    at scrape time.
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), collect=None):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.collect = collect
+        self.values: dict[tuple, float] = {}
+        registry.append(self)
+
+    def samples(self):
+        if self.collect is not None:
+            self.values = dict(self.collect())
+        for label_values, value in self.values.items():
+            yield self.name, _format_labels(self.label_names, label_values), value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{labels} {value}" for name, labels, value in self.samples())
+        return lines
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, *label_values):
+        self.values[label_values] = value
+
+class Histogram(Metric):
+    """
+    Fixed-bucket histogram. observe() is a bisect and two additions; the
+    counts are only made cumulative when scraped.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self.series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for label_values, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _format_labels((*self.label_names, "le"), (*label_values, bound))
+                yield f"{self.name}_bucket", labels, cumulative
+            labels = _format_labels(self.label_names, label_values)
+            yield f"{self.name}_sum", labels, round(total, 6)
+            yield f"{self.name}_count", labels, cumulative
+
+registry: list[Metric] = []
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route template.", ("method", "route")
+)
+http_requests = Counter(
+    "http_requests_total", "Requests by route template and status.", ("method", "route", "status")
+)
+upstream_duration = Histogram(
+    "upstream_request_duration_seconds", "Latency of calls to LTA, OneMap and Supabase until response headers.", ("service", "endpoint")
+)
+upstream_responses = Counter(
+    "upstream_responses_total", "Upstream responses by status; status is \"error\" when no response arrived.", ("service", "endpoint", "status")
+)
+loop_lag = Histogram(
+    "event_loop_lag_seconds", "Delay of a scheduled wake-up of the event loop (observed by routers/watchdog.py).", buckets=LOOP_LAG_BUCKETS
+)
+
+# Sources read at scrape time: cache name -> stats() and client name -> getter
+_cache_sources: dict[str, object] = {}
+_pool_sources: dict[str, object] = {}
+
+def track_cache(name: str, stats):
+    """Reports hit/miss counts of a cache; stats() returns a dict with hits and misses."""
+    _cache_sources[name] = stats
+
+def track_pool(name: str, get_client):
+    """Reports connection pool use of the httpx client returned by get_client()."""
+    _pool_sources[name] = get_client
+
+def _all_cache_stats() -> dict[str, dict]:
+    from routers.cache import namespaces
+    stats = {name: cache.stats() for name, cache in namespaces.items()}
+    stats.update((name, source()) for name, source in _cache_sources.items())
+    return stats
+
+def _collect_cache_requests():
+    for name, stats in _all_cache_stats().items():
+        for result in ("hits", "misses", "coalesced", "errors"):
+            if result in stats:
+                yield (name, result), stats[result]
+
+def _collect_cache_hit_ratio():
+    for name, stats in _all_cache_stats().items():
+        lookups = stats["hits"] + stats["misses"]
+        yield (name,), round(stats["hits"] / lookups, 4) if lookups else 0
+
+def _collect_pools():
+    for name, get_client in _pool_sources.items():
+        client = get_client()
+        if client is None:
+            continue
+        # httpx does not expose its pool; read httpcore's, and skip it if that changes
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        if pool is None:
+            continue
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for connection in connections if connection.is_idle())
+        yield (name, "active"), len(connections) - idle
+        yield (name, "idle"), idle
+        yield (name, "queued"), sum(1 for request in getattr(pool, "_requests", []) if request.is_queued())
+        yield (name, "max"), getattr(pool, "_max_connections", 0)
+
+def _collect_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            yield (), int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is the peak, in kilobytes on Linux
+        yield (), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+Counter("cache_requests_total", "Cache lookups by namespace and result.", ("namespace", "result"), collect=_collect_cache_requests)
+Gauge("cache_hit_ratio", "Hits over hits plus misses, by namespace.", ("namespace",), collect=_collect_cache_hit_ratio)
+Gauge("httpx_pool_connections", "Connections of the shared httpx clients by state.", ("client", "state"), collect=_collect_pools)
+Gauge("process_resident_memory_bytes", "Resident set size.", collect=_collect_rss)
+Counter("process_cpu_seconds_total", "User and system CPU time.", collect=lambda: [((), round(time.process_time(), 3))])
+
+def upstream_hooks(service: str) -> dict:
+    """httpx event hooks that record latency and status of every call made with a client."""
+    async def on_request(request: httpx.Request):
+        request.extensions["metrics_start"] = time.perf_counter()
+
+    async def on_response(response: httpx.Response):
+        request = response.request
+        start = request.extensions.get("metrics_start")
+        if start is not None:
+            upstream_duration.observe(time.perf_counter() - start, service, request.url.path)
+        upstream_responses.inc(service, request.url.path, response.status_code)
+
+    return {"request": [on_request], "response": [on_response]}
+
+def record_upstream_error(service: str, request: httpx.Request | None):
+    upstream_responses.inc(service, request.url.path if request is not None else "", "error")
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency and status per route template."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched route in the scope; templates keep label counts bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_request_duration.observe(time.perf_counter() - start, scope["method"], route)
+            http_requests.inc(scope["method"], route, status)
+
+def render_metrics() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+@metrics_router.get("/metrics")
+async def get_metrics():
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4")
@@ -1,54 +1,21 @@
-import uuid
-import datetime
-import threading
-from fastapi import FastAPI, Request
-import httpx
+from routers.logshipper import get_log_shipper
+from routers.telemetry import TelemetrySink
 
 LOG_ENDPOINT = "https://bussinganalytics.vercel.app/api/log"
 
-class FirebaseLoggerMiddleware:
-    def __init__(self, app: FastAPI, exclude_prefixes: list[str] | None = None):
-        self.app = app
-        self.exclude_prefixes = tuple(exclude_prefixes or [])
-
-    def _should_log(self, path: str) -> bool:
-        return not path.startswith(self.exclude_prefixes)
-
-    async def __call__(self, scope, receive, send):
-        if scope["type"] != "http":
-            await self.app(scope, receive, send)
-            return
-
-        request = Request(scope, receive=receive)
-
-        async def send_wrapper(message):
-            if (
-                message["type"] == "http.response.start"
-                and self._should_log(request.url.path)
-            ):
-                log_data = {
-                    "id": str(uuid.uuid4()),
-                    "timestamp": datetime.datetime.utcnow().isoformat(),
-                    "method": request.method,
-                    "path": request.url.path,
-                    "ip": request.client.host if request.client else None,
-                    "status_code": message["status"],
-                    "user_agent": request.headers.get("user-agent"),
-                    "params": dict(request.query_params),
-                }
-                threading.Thread(
-                    target=self._send_log,
-                    args=(log_data,),
-                    daemon=True
-                ).start()
-
-            await send(message)
-
-        await self.app(scope, receive, send_wrapper)
-
-    def _send_log(self, log_data: dict):
-        try:
-            httpx.post(LOG_ENDPOINT, json=log_data, timeout=0.5)
-        except Exception:
-            # Fail silently
-            pass
\ No newline at end of file
+# The analytics endpoint takes one event per request
+firebase_logs = get_log_shipper("firebase", LOG_ENDPOINT, accepts_batches=False)
+
+def format_firebase_event(event: dict, sample_rate: float) -> dict:
+    return {
+        "id": event["id"],
+        "timestamp": event["timestamp"],
+        "method": event["method"],
+        "path": event["path"],
+        "ip": event["ip"],
+        "status_code": event["status"],
+        "user_agent": event["user_agent"],
+        "params": event["params"],
+    }
+
+firebase_sink = TelemetrySink(firebase_logs, format_firebase_event)
@@ -1,10 +1,9 @@
 import time
 from fastapi import APIRouter, HTTPException, Query
-from routers.database import getDBClient
+from routers.database import select_rows
 from routers.utils import cache_headers, queryAPI
 from typing import List, Optional
 
-dbClient = getDBClient()
 MRT_router = APIRouter()
 
 @MRT_router.get("/mrt_crowd_density")
@@ -63,7 +62,7 @@ async def get_mrt_crowd_density(mrt_lines: List[str] = Query(..., description="L
 async def get_stationCoord_data():
     key = "stationCoords"
     try:
-        response = dbClient.table("jsons").select("json_value").eq("id", key).execute()
+        response = await select_rows("jsons", "json_value", eq={"id": key})
         if response.data:
             return response.data[0]["json_value"]
         else:
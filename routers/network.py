@@ -0,0 +1,112 @@
+import asyncio
+import json
+import sys
+from collections import defaultdict
+from routers.datasets import dataset_version, on_publish, published_version, read_dataset
+from routers.utils import service_sort_key
+
+class BusNetwork:
+    """
+    Compact in-memory view of the bus network built from bus_route rows.
+    Every lookup is a dict access; stop lists are stored once as tuples.
+    """
+    __slots__ = ("routes", "stop_services", "stop_routes", "positions")
+
+    def __init__(self, bus_routes: list[dict]):
+        # (serviceNo, direction) -> ordered bus stop codes
+        self.routes: dict[tuple[str, str], tuple[str, ...]] = {}
+        # busStopCode -> sorted serviceNos calling at the stop
+        self.stop_services: dict[str, list[str]] = {}
+        # busStopCode -> (serviceNo, direction) pairs calling at the stop
+        self.stop_routes: dict[str, list[tuple[str, str]]] = {}
+        # (serviceNo, direction) -> busStopCode -> indexes in the route (loops visit a stop twice)
+        self.positions: dict[tuple[str, str], dict[str, list[int]]] = {}
+
+        stop_services = defaultdict(set)
+        stop_routes = defaultdict(list)
+        for bus_route in bus_routes:
+            service_no = sys.intern(str(bus_route["serviceNo"]))
+            for route in bus_route.get("routes", []):
+                direction = sys.intern(str(route["direction"]))
+                stops = tuple(sys.intern(str(code)) for code in route.get("busStopIDs", []))
+                key = (service_no, direction)
+                self.routes[key] = stops
+
+                positions = defaultdict(list)
+                for index, code in enumerate(stops):
+                    positions[code].append(index)
+                    stop_services[code].add(service_no)
+                self.positions[key] = dict(positions)
+                for code in positions:
+                    stop_routes[code].append(key)
+
+        self.stop_services = {
+            code: sorted(services, key=service_sort_key)
+            for code, services in stop_services.items()
+        }
+        self.stop_routes = {
+            code: sorted(keys, key=lambda key: (service_sort_key(key[0]), key[1]))
+            for code, keys in stop_routes.items()
+        }
+
+    def services_at(self, bus_stop_code: str) -> list[str] | None:
+        return self.stop_services.get(bus_stop_code)
+
+    def stops_of(self, service_no: str, direction: str) -> tuple[str, ...] | None:
+        return self.routes.get((service_no, direction))
+
+    def adjacent_stops(self, service_no: str, direction: str, bus_stop_code: str) -> tuple[str | None, str | None] | None:
+        """Returns (previous, next) around the first visit of the stop, or None if the route does not call there."""
+        indexes = self.positions.get((service_no, direction), {}).get(bus_stop_code)
+        if not indexes:
+            return None
+        stops = self.routes[(service_no, direction)]
+        index = indexes[0]
+        previous_stop = stops[index - 1] if index > 0 else None
+        next_stop = stops[index + 1] if index + 1 < len(stops) else None
+        return previous_stop, next_stop
+
+    def stop_distance(self, service_no: str, direction: str, from_stop: str, to_stop: str) -> int | None:
+        """Number of stops travelled from from_stop to the next visit of to_stop, or None if unreachable."""
+        positions = self.positions.get((service_no, direction), {})
+        from_indexes = positions.get(from_stop)
+        to_indexes = positions.get(to_stop)
+        if not from_indexes or not to_indexes:
+            return None
+        distances = [
+            to_index - from_index
+            for from_index in from_indexes
+            for to_index in to_indexes
+            if to_index >= from_index
+        ]
+        return min(distances) if distances else None
+
+# Shared network, loaded on first use and again after each bus_routes publish
+_network: BusNetwork = None
+_network_version: str = None
+_network_lock = asyncio.Lock()
+
+async def get_network() -> BusNetwork:
+    global _network, _network_version
+    if _network is not None and _network_version == dataset_version("bus_routes"):
+        return _network
+
+    async with _network_lock:
+        if _network is None or _network_version != dataset_version("bus_routes"):
+            # Tagged with the version it started from, so a publish mid-load forces a reload
+            version = await published_version("bus_routes")
+            bus_routes = []
+            async for rows in read_dataset("bus_routes", "service_no, json_value", version=version):
+                for row in rows:
+                    json_value = row["json_value"]
+                    bus_routes.append(json.loads(json_value) if isinstance(json_value, str) else json_value)
+            _network, _network_version = BusNetwork(bus_routes), version
+            print(f"Loaded bus network: {len(_network.routes)} routes, {len(_network.stop_services)} stops")
+    return _network
+
+def reset_network():
+    """Drops the loaded network so the next lookup reloads it from bus_route."""
+    global _network
+    _network = None
+
+on_publish("bus_routes", reset_network)
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import time
+from fastapi import HTTPException
+import httpx
+import polyline
+from routers.cache import BoundedCache
+from routers.executor import run_cpu
+from routers.metrics import upstream_hooks
+from routers.ingest import get_bus_route_views
+from routers.utils import POLYLINE_DETAIL_TOLERANCES, simplify_polyline
+
+GEOJSON_URL = "https://data.busrouter.sg/v1/routes.min.geojson"
+POLYLINE_REFRESH_INTERVAL = 60 * 60 * 6
+POLYLINE_DEFAULT_DETAIL = "full"
+POLYLINE_DEFAULT_FORMAT = "json"
+POLYLINE_VARIANT_CACHE_SIZE = 2000  # services kept at a non-default detail level or format
+
+# "serviceNo|direction" -> [[lat, lng], ...] from the GeoJSON source
+_geometry: dict[str, list[list[float]]] = {}
+# Validators of the last GeoJSON response, for conditional refreshes
+_geojson_validators: dict[str, str] = {}
+# serviceNo -> (position, service with default-variant polylines, per-direction geometry)
+_index: dict[str, tuple[int, dict, list]] = None
+_index_generation = 0
+# "generation|serviceNo|detail|format" -> service with polylines, for the non-default variants
+_variant_cache = BoundedCache(POLYLINE_VARIANT_CACHE_SIZE)
+_index_views: dict = None
+_polyline_lock = asyncio.Lock()
+_polyline_status = {"built_at": None, "build_ms": None, "geojson_checked_at": None, "geojson_changed_at": None}
+
+def parse_geojson_routes(geojson: dict) -> dict[str, list[list[float]]]:
+    lookup: dict[str, list[list[float]]] = {}
+    for feature in geojson.get("features", []):
+        props = feature.get("properties", {})
+        service_no = str(props.get("number", ""))
+        pattern = props.get("pattern")
+        direction = {0: "1", 1: "2"}.get(pattern)
+        if direction is None:
+            continue
+        coords = feature.get("geometry", {}).get("coordinates", [])
+        if not coords:
+            continue
+        # Swap [lng, lat] → [lat, lng]
+        transformed = [[lat, lng] for lng, lat in coords]
+        key = f"{service_no}|{direction}"
+        if key in lookup:
+            lookup[key].extend(transformed)  # concatenate multiple features
+        else:
+            lookup[key] = transformed
+    return lookup
+
+async def _fetch_geometry() -> bool:
+    """
+    Conditionally refetches the GeoJSON source. Returns True if it changed.
+    """
+    global _geometry
+    headers = {}
+    if etag := _geojson_validators.get("etag"):
+        headers["If-None-Match"] = etag
+    if last_modified := _geojson_validators.get("last-modified"):
+        headers["If-Modified-Since"] = last_modified
+
+    async with httpx.AsyncClient(timeout=30, event_hooks=upstream_hooks("busrouter")) as client:
+        geojson_res = await client.get(GEOJSON_URL, headers=headers)
+    _polyline_status["geojson_checked_at"] = time.time()
+
+    if geojson_res.status_code == 304 and _geometry:
+        return False
+    if geojson_res.status_code != 200:
+        raise HTTPException(status_code=502, detail="Failed to fetch GeoJSON source")
+
+    _geometry = parse_geojson_routes(geojson_res.json())
+    for name in ("etag", "last-modified"):
+        if value := geojson_res.headers.get(name):
+            _geojson_validators[name] = value
+    _polyline_status["geojson_changed_at"] = time.time()
+    return True
+
+def encode_route_geometry(coords: list[list[float]] | None, detail: str = POLYLINE_DEFAULT_DETAIL, format: str = POLYLINE_DEFAULT_FORMAT) -> str:
+    """
+    Serializes a route at one detail level, as a JSON [[lat, lng], ...]
+    string or as an encoded polyline.
+    """
+    simplified = simplify_polyline(coords, POLYLINE_DETAIL_TOLERANCES[detail]) if coords else []
+    if not simplified:
+        return ""
+    if format == "encoded":
+        return polyline.encode(simplified)
+    return json.dumps(simplified, separators=(",", ":"))
+
+def _service_variant(svc: dict, geometries: list, detail: str, format: str) -> dict:
+    routes = [{**route, "polyline": encode_route_geometry(coords, detail, format)} for route, coords in zip(svc["routes"], geometries)]
+    return {**svc, "routes": routes}
+
+def _build_index(bus_routes: list[dict], geometry: dict[str, list[list[float]]]) -> dict[str, tuple[int, dict, list]]:
+    """Only the default variant is serialized up front; the others are built on request."""
+    index = {}
+    for position, svc in enumerate(bus_routes):
+        geometries = [geometry.get(f"{svc['serviceNo']}|{route['direction']}") for route in svc["routes"]]
+        index[svc["serviceNo"]] = (position, _service_variant(svc, geometries, POLYLINE_DEFAULT_DETAIL, POLYLINE_DEFAULT_FORMAT), geometries)
+    return index
+
+def _build_variants(entries: list[tuple[int, dict, list]], detail: str, format: str) -> list[dict]:
+    return [_service_variant(default, geometries, detail, format) for _, default, geometries in entries]
+
+async def refresh_polylines(force_geometry: bool = False):
+    """
+    Rebuilds the index if the GeoJSON source or the bus route views changed.
+    """
+    global _index, _index_views, _index_generation
+    async with _polyline_lock:
+        geometry_changed = await _fetch_geometry() if force_geometry or not _geometry else False
+        views = await get_bus_route_views()
+        if _index is not None and not geometry_changed and views is _index_views:
+            return
+
+        start = time.perf_counter()
+        _index = await run_cpu(_build_index, views["bus_routes"], _geometry)
+        _index_views = views
+        _index_generation += 1
+        _polyline_status["built_at"] = time.time()
+        _polyline_status["build_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        print(f"Built polyline index for {len(_index)} services in {_polyline_status['build_ms']}ms")
+
+async def get_polyline_index() -> dict[str, tuple[int, dict, list]]:
+    if _index is None:
+        await refresh_polylines()
+    return _index
+
+async def get_polyline_services(service_numbers: list[str], detail: str = POLYLINE_DEFAULT_DETAIL, format: str = POLYLINE_DEFAULT_FORMAT) -> list[dict]:
+    """
+    The requested services with polylines, in source order. Variants other
+    than the default are built on first request and kept in an LRU cache.
+    """
+    index = await get_polyline_index()
+    generation = _index_generation
+    entries = sorted((index[no] for no in set(service_numbers) if no in index), key=lambda entry: entry[0])
+    if (detail, format) == (POLYLINE_DEFAULT_DETAIL, POLYLINE_DEFAULT_FORMAT):
+        return [default for _, default, _ in entries]
+
+    keys = [f"{generation}|{default['serviceNo']}|{detail}|{format}" for _, default, _ in entries]
+    services = [_variant_cache.get(key) for key in keys]
+    missing = [i for i, service in enumerate(services) if service is None]
+    if missing:
+        built = await run_cpu(_build_variants, [entries[i] for i in missing], detail, format)
+        for i, service in zip(missing, built):
+            services[i] = service
+            _variant_cache.set(keys[i], service, POLYLINE_REFRESH_INTERVAL * 2)
+    return services
+
+async def refresh_polylines_loop():
+    """Background task: keeps a built index in sync with its sources."""
+    while True:
+        await asyncio.sleep(POLYLINE_REFRESH_INTERVAL)
+        if _index is None:
+            continue
+        try:
+            await refresh_polylines(force_geometry=True)
+        except Exception as e:
+            print(f"Error refreshing polylines: {e}")
+
+def get_polyline_status() -> dict:
+    return {**_polyline_status, "services": len(_index) if _index else 0, "variants": _variant_cache.stats()}
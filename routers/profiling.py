@@ -0,0 +1,209 @@
+import asyncio
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+from collections import Counter
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse, Response
+from routers.utils import require_admin_token
+
+profiling_router = APIRouter()
+
+PROFILE_MAX_SECONDS = 60
+PROFILE_MODES = {"sampling": ("collapsed",), "cprofile": ("text", "pstats")}
+PROFILE_STATS_LIMIT = 80    # functions listed in the text report
+
+_labels: dict = {}
+
+def _frame_label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        for marker in ("site-packages/", "lib/python"):
+            if marker in filename:
+                filename = filename.split(marker, 1)[1]
+                break
+        label = _labels[code] = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+    return label
+
+class StackSampler(threading.Thread):
+    """
+    Samples the stacks of the event-loop thread and the CPU executor threads
+    every interval seconds and counts them in collapsed form
+    ("thread;outer;...;inner"), which flamegraph.pl and speedscope read as is.
+    With within set, only stacks running inside that code object count, so a
+    route profile keeps the samples of its own requests.
+    """
+    def __init__(self, interval: float, loop_thread_id: int, within=None):
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval
+        self.loop_thread_id = loop_thread_id
+        self.within = within
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stopping = threading.Event()
+
+    def _sampled_threads(self) -> dict[int, str]:
+        return {
+            thread.ident: thread.name for thread in threading.enumerate()
+            if thread.ident == self.loop_thread_id or thread.name.startswith("cpu")
+        }
+
+    def run(self):
+        threads = self._sampled_threads()
+        while not self._stopping.wait(self.interval):
+            self.samples += 1
+            for thread_id, frame in sys._current_frames().items():
+                name = threads.get(thread_id)
+                if name is None:
+                    continue
+                stack = []
+                matched = self.within is None
+                while frame is not None:
+                    matched = matched or frame.f_code is self.within
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                if matched:
+                    stack.append(name)
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopping.set()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+class RouteTarget:
+    """The next `requests` requests whose path starts with prefix."""
+    def __init__(self, prefix: str, requests: int, profiler: cProfile.Profile | None):
+        self.prefix = prefix
+        self.remaining = requests
+        self.profiler = profiler
+        self.active = 0
+        self.profiled = 0
+        self.closed = False
+        self.done = asyncio.Event()
+
+    def enter(self):
+        self.remaining -= 1
+        self.active += 1
+        if self.active == 1 and self.profiler is not None and not self.closed:
+            self.profiler.enable()
+
+    def exit(self):
+        self.active -= 1
+        self.profiled += 1
+        if self.active == 0 and self.profiler is not None and not self.closed:
+            self.profiler.disable()
+        if self.remaining <= 0 and self.active == 0:
+            self.done.set()
+
+_route_target: RouteTarget | None = None
+_profile_lock = asyncio.Lock()
+
+class ProfilingMiddleware:
+    """
+    Pure ASGI middleware that routes the requests picked by a route profile
+    through _profiled. Otherwise it costs one attribute check per request.
+    cProfile is on the whole time one of those requests is in flight, so
+    other requests interleaved on the loop show up in it too; the sampler
+    only counts stacks that run inside _profiled.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        target = _route_target
+        if target is not None and target.remaining > 0 and scope["type"] == "http" and scope["path"].startswith(target.prefix):
+            await self._profiled(scope, receive, send, target)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _profiled(self, scope, receive, send, target: RouteTarget):
+        target.enter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            target.exit()
+
+def _cprofile_response(profiler: cProfile.Profile, format: str, headers: dict) -> Response:
+    profiler.create_stats()
+    if format == "pstats":
+        # Same layout as Profile.dump_stats(); open with pstats or snakeviz
+        return Response(
+            content=marshal.dumps(profiler.stats),
+            media_type="application/octet-stream",
+            headers={**headers, "Content-Disposition": 'attachment; filename="profile.pstats"'}
+        )
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(PROFILE_STATS_LIMIT)
+    return PlainTextResponse(report.getvalue(), headers=headers)
+
+@profiling_router.get("/debug/profile", dependencies=[Depends(require_admin_token)])
+async def profile(
+    seconds: float = 10,
+    mode: str = "sampling",
+    format: str | None = None,
+    route: str | None = None,
+    requests: int = 1,
+    interval_ms: float = 5
+):
+    """
+    Profiles the running process for `seconds` and returns the result.
+
+    mode=sampling (default) samples stacks every interval_ms and returns
+    collapsed stacks; mode=cprofile runs the deterministic profiler on the
+    event-loop thread and returns a text report sorted by cumulative time,
+    or format=pstats for the binary stats file.
+    With route (a path prefix such as /bustiming), only the next `requests`
+    requests to it are profiled; `seconds` is then the longest wait for them.
+    """
+    global _route_target
+    if mode not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {list(PROFILE_MODES)}")
+    format = format or PROFILE_MODES[mode][0]
+    if format not in PROFILE_MODES[mode]:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(PROFILE_MODES[mode])} for mode {mode}")
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {PROFILE_MAX_SECONDS}")
+    if requests < 1 or not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="requests must be at least 1 and interval_ms between 1 and 1000")
+    if _profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+    async with _profile_lock:
+        profiler = cProfile.Profile() if mode == "cprofile" else None
+        sampler = None
+        if mode == "sampling":
+            within = ProfilingMiddleware._profiled.__code__ if route else None
+            sampler = StackSampler(interval_ms / 1000, threading.get_ident(), within)
+            sampler.start()
+        target = None
+        try:
+            if route:
+                target = _route_target = RouteTarget(route, requests, profiler)
+                try:
+                    await asyncio.wait_for(target.done.wait(), seconds)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                if profiler is not None:
+                    profiler.enable()
+                await asyncio.sleep(seconds)
+        finally:
+            _route_target = None
+            if target is not None:
+                target.closed = True
+            if profiler is not None:
+                profiler.disable()
+            if sampler is not None:
+                sampler.stop()
+                await asyncio.to_thread(sampler.join)
+
+    headers = {"X-Profiled-Requests": str(target.profiled)} if target is not None else {}
+    if sampler is not None:
+        return PlainTextResponse(sampler.collapsed(), headers={**headers, "X-Profile-Samples": str(sampler.samples)})
+    return _cprofile_response(profiler, format, headers)
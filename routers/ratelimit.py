@@ -0,0 +1,195 @@
+import json
+import math
+import time
+from fastapi import APIRouter, Depends
+from urllib.parse import parse_qsl
+from routers.metrics import Counter, Gauge
+from routers.utils import getEnvVariable, require_admin_token
+
+ratelimit_router = APIRouter()
+
+# Overrides of the limits passed to the middleware as "prefix=requests/seconds", e.g.
+# "/bustiming=120/60,/getallbusstops=5/3600"
+RATE_LIMITS = getEnvVariable("RATE_LIMITS", required=False) or ""
+# The identified requests of one IP (userID or device token) are capped together at this
+# multiple of the route limit, so rotating identifiers does not lift the limit. It is set far
+# above one client's rate, since carrier-grade NAT puts many users behind one IP
+RATE_LIMIT_IP_FACTOR = int(getEnvVariable("RATE_LIMIT_IP_FACTOR", required=False) or 100)
+# Fly-Client-IP is set by Fly's proxy, and anyone can send it to a server that is not behind
+# it, so it is only trusted on Fly (FLY_APP_NAME set) unless this says otherwise
+RATE_LIMIT_TRUST_PROXY = (
+    getEnvVariable("RATE_LIMIT_TRUST_PROXY", required=False)
+    or ("true" if getEnvVariable("FLY_APP_NAME", required=False) else "false")
+).lower() == "true"
+RATE_LIMIT_KEY_LENGTH = 64      # longer client identifiers are truncated
+RATE_LIMIT_TOP_BLOCKED = 1000   # blocked keys counted for /debug/ratelimit
+
+ratelimit_requests = Counter("ratelimit_requests_total", "Requests checked by the rate limiter, by route prefix.", ("route",))
+ratelimit_blocked = Counter(
+    "ratelimit_blocked_total", "Requests rejected with 429 by route prefix and key type (user, device, ip).", ("route", "key_type")
+)
+
+class GcraLimiter:
+    """
+    Generic cell rate algorithm: `requests` per `period` seconds with bursts
+    of up to `requests`. The whole state of a client is one float, its
+    theoretical arrival time (TAT).
+    Entries live in two generations that rotate every `period` seconds; a key
+    not seen for a full period has a TAT in the past, which is the same as
+    no state, so the old generation is dropped wholesale. Memory follows the
+    clients active in the last two periods, with no per-request sweeping.
+    Keys are stored as their hash, an int, rather than the identifier string.
+    """
+    __slots__ = ("requests", "period", "interval", "tolerance", "current", "previous", "rotated_at")
+
+    def __init__(self, requests: int, period: float):
+        self.requests = requests
+        self.period = period
+        self.interval = period / requests
+        self.tolerance = period - self.interval
+        self.current: dict[int, float] = {}
+        self.previous: dict[int, float] = {}
+        self.rotated_at = time.monotonic()
+
+    def hit(self, key: str, now: float) -> float:
+        """Counts a request; returns 0 when allowed, otherwise seconds until one is."""
+        if now - self.rotated_at >= self.period:
+            self.previous = self.current if now - self.rotated_at < 2 * self.period else {}
+            self.current = {}
+            self.rotated_at = now
+        key = hash(key)
+        tat = self.current.get(key)
+        if tat is None:
+            tat = self.previous.pop(key, now)
+        tat = max(tat, now)
+        wait = tat - now - self.tolerance
+        if wait > 0:
+            self.current[key] = tat
+            return wait
+        self.current[key] = tat + self.interval
+        return 0.0
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+class RouteLimit:
+    def __init__(self, prefix: str, requests: int, period: float):
+        self.prefix = prefix
+        self.clients = GcraLimiter(requests, period)
+        self.ips = GcraLimiter(requests * RATE_LIMIT_IP_FACTOR, period)
+        self.blocked_keys: dict[str, int] = {}
+
+    def block(self, key: str):
+        if key not in self.blocked_keys and len(self.blocked_keys) >= RATE_LIMIT_TOP_BLOCKED:
+            # Halve the counts so persistent offenders stay and one-off keys make room
+            self.blocked_keys = {blocked: count // 2 for blocked, count in self.blocked_keys.items() if count > 1}
+        self.blocked_keys[key] = self.blocked_keys.get(key, 0) + 1
+
+def _parse_limit(limit: str) -> tuple[int, float]:
+    requests, _, period = limit.partition("/")
+    return int(requests), float(period or 1)
+
+route_limits: dict[str, RouteLimit] = {}
+
+Gauge(
+    "ratelimit_tracked_keys", "Clients with rate limiter state, by route prefix.", ("route",),
+    collect=lambda: [((prefix,), len(limit.clients) + len(limit.ips)) for prefix, limit in route_limits.items()]
+)
+
+def _client_key(scope) -> tuple[str, str, str]:
+    """
+    (key type, key, client IP): userID, then device token, then the client IP.
+    Identifiers come from the client unverified, so their keys are scoped to
+    the client IP: sending someone else's userID does not use up their limit.
+    """
+    ip = None
+    device_token = None
+    for name, value in scope["headers"]:
+        if name == b"fly-client-ip":
+            if RATE_LIMIT_TRUST_PROXY:
+                ip = value.decode("latin-1")
+        elif name == b"x-device-token":
+            device_token = value.decode("latin-1")
+    if ip is None:
+        client = scope.get("client")
+        ip = client[0] if client else "unknown"
+
+    query_string = scope.get("query_string", b"")
+    if query_string:
+        params = dict(parse_qsl(query_string.decode("latin-1")))
+        if params.get("userID"):
+            return "user", f"user:{ip}:{params['userID'][:RATE_LIMIT_KEY_LENGTH]}", ip
+        device_token = params.get("deviceToken") or device_token
+    if device_token:
+        return "device", f"device:{ip}:{device_token[:RATE_LIMIT_KEY_LENGTH]}", ip
+    return "ip", "ip:" + ip, ip
+
+class RateLimitMiddleware:
+    """
+    Pure ASGI middleware limiting each client per route prefix, with limits
+    given as "requests/seconds" (the longest matching prefix wins, other
+    paths are not limited). Blocked requests get 429 with Retry-After.
+    """
+    def __init__(self, app, limits: dict[str, str]):
+        self.app = app
+        limits = dict(limits)
+        for rule in filter(None, (item.strip() for item in RATE_LIMITS.split(","))):
+            prefix, _, limit = rule.rpartition("=")
+            limits[prefix] = limit
+        for prefix, limit in limits.items():
+            route_limits[prefix] = RouteLimit(prefix, *_parse_limit(limit))
+        self.rules = sorted(route_limits.values(), key=lambda rule: len(rule.prefix), reverse=True)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            path = scope["path"]
+            for limit in self.rules:
+                if path.startswith(limit.prefix):
+                    wait = self.check(limit, scope)
+                    if wait:
+                        await self._reject(send, wait)
+                        return
+                    break
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def check(limit: RouteLimit, scope) -> float:
+        key_type, key, ip = _client_key(scope)
+        now = time.monotonic()
+        ratelimit_requests.inc(limit.prefix)
+        wait = limit.clients.hit(key, now)
+        if not wait and key_type != "ip":
+            # Unidentified requests are already limited per IP by their own key
+            wait = limit.ips.hit(ip, now)
+            if wait:
+                key_type, key = "ip", "ip:" + ip
+        if wait:
+            ratelimit_blocked.inc(limit.prefix, key_type)
+            limit.block(key)
+        return wait
+
+    @staticmethod
+    async def _reject(send, wait: float):
+        body = json.dumps({"detail": "Too many requests"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(wait)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+@ratelimit_router.get("/debug/ratelimit", dependencies=[Depends(require_admin_token)])
+async def get_rate_limit_stats(top: int = 20):
+    """Limits, tracked clients and the most blocked client keys per route prefix."""
+    return {
+        prefix: {
+            "limit": f"{limit.clients.requests}/{limit.clients.period:g}",
+            "tracked_keys": len(limit.clients) + len(limit.ips),
+            "top_blocked": sorted(limit.blocked_keys.items(), key=lambda item: item[1], reverse=True)[:top],
+        }
+        for prefix, limit in route_limits.items()
+    }
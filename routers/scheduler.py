@@ -0,0 +1,281 @@
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from fastapi import APIRouter, Depends, HTTPException
+import pytz
+from routers import etl
+from routers.database import compare_and_set_json, select_rows
+from routers.utils import INSTANCE_ID, getEnvVariable, require_admin_token
+
+jobs_router = APIRouter()
+
+SGT = pytz.timezone("Asia/Singapore")
+SCHEDULER_ENABLED = (getEnvVariable("ETL_SCHEDULER_ENABLED", required=False) or "true").lower() == "true"
+# A job lease outlives a crashed holder by at most this long
+JOB_LEASE_SECONDS = int(getEnvVariable("ETL_JOB_LEASE_SECONDS", required=False) or 60 * 60)
+
+class CronSchedule:
+    """
+    Five-field cron expression (minute hour day-of-month month day-of-week),
+    evaluated in Singapore time. Fields accept *, numbers, lists, ranges and
+    steps, e.g. "30 3 * * *" or "0 */6 * * 1-5".
+    """
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse_field(field, low, high) for field, (low, high) in zip(fields, self.RANGES)
+        )
+        # Standard cron: if both day fields are restricted, either may match
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(field: str, low: int, high: int) -> set[int]:
+        values = set()
+        for part in field.split(","):
+            value_range, _, step = part.partition("/")
+            if value_range == "*":
+                start, end = low, high
+            elif "-" in value_range:
+                start, end = (int(v) for v in value_range.split("-"))
+            else:
+                start = end = int(value_range)
+                if step:
+                    end = high
+            if start < low or end > high or start > end:
+                raise ValueError(f"Cron field {field!r} is outside {low}-{high}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _day_matches(self, moment: datetime) -> bool:
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.isoweekday() % 7) in self.weekdays  # cron counts Sunday as 0
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, moment: datetime) -> datetime:
+        candidate = moment.astimezone(SGT).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months or not self._day_matches(candidate):
+                candidate = SGT.normalize((candidate + timedelta(days=1)).replace(hour=0, minute=0))
+            elif candidate.hour not in self.hours:
+                candidate = SGT.normalize((candidate + timedelta(hours=1)).replace(minute=0))
+            elif candidate.minute not in self.minutes:
+                candidate = candidate + timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+def _lease(slot: str | None, expires_at: float) -> dict:
+    return {"holder": INSTANCE_ID, "slot": slot, "expires_at": expires_at}
+
+async def acquire_lease(name: str, slot: str | None, ttl: float) -> str | None:
+    """
+    Takes the lease row of a job in the jsons table, so that one process
+    across all machines runs it. A lease is refused while another process
+    holds it, or when `slot` (the scheduled time) already ran elsewhere.
+    The write is a compare-and-set, so two processes cannot both win.
+    Returns the token release_lease needs.
+    """
+    key = f"jobLease:{name}"
+    now = time.time()
+    response = await select_rows("jsons", "json_value, modified_at", eq={"id": key})
+    if not response.data:
+        return await compare_and_set_json(key, _lease(slot, now + ttl), None)
+
+    current = response.data[0]["json_value"]
+    if isinstance(current, str):
+        current = json.loads(current)
+    if current.get("expires_at", 0) > now or (slot is not None and current.get("slot") == slot):
+        return None
+    return await compare_and_set_json(key, _lease(slot, now + ttl), response.data[0]["modified_at"])
+
+async def release_lease(name: str, slot: str | None, token: str):
+    """Expires a lease this process holds; the slot stays recorded as run."""
+    await compare_and_set_json(f"jobLease:{name}", _lease(slot, 0), token)
+
+class Job:
+    """
+    A scheduled or manually started job. Runs never overlap: a run that
+    finds the job busy, here or on another machine (see acquire_lease), is
+    skipped. Jobs sharing a `lease` name exclude one another too.
+    The job function receives the Job, plus the arguments of a manual start,
+    and can report progress through it.
+    """
+    def __init__(self, name: str, schedule: str | None, func, jitter_seconds: int = 0, lease: str | None = None):
+        self.name = name
+        self.schedule = CronSchedule(schedule) if schedule else None
+        self.func = func
+        self.jitter_seconds = jitter_seconds
+        self.lease = lease or name
+        self.lock = asyncio.Lock()
+        self.manual_run: asyncio.Task = None
+        self.status = {
+            "name": name,
+            "schedule": schedule,
+            "lease": self.lease,
+            "state": "idle",
+            "progress": None,
+            "next_run_at": None,
+            "last_run": None,
+            "last_skipped": None,
+        }
+
+    def progress(self, step: int, total: int, message: str):
+        self.status["progress"] = {"step": step, "total": total, "message": message}
+        print(f"[{self.name}] {step}/{total} {message}")
+
+    async def _claim(self, trigger: str, slot: str | None) -> str | None:
+        """Takes the local lock and the lease; returns the lease token, or None with nothing held."""
+        if self.lock.locked():
+            print(f"[{self.name}] Skipping {trigger} run, previous run still in progress")
+            return None
+        await self.lock.acquire()
+        try:
+            token = await acquire_lease(self.lease, slot, JOB_LEASE_SECONDS)
+        except Exception as e:
+            print(f"[{self.name}] Could not read the job lease: {e}")
+            token = None
+        if token is None:
+            self.lock.release()
+            print(f"[{self.name}] Skipping {trigger} run, it runs or already ran on another machine")
+            self.status["last_skipped"] = {"trigger": trigger, "slot": slot, "at": time.time()}
+        return token
+
+    async def _execute(self, trigger: str, slot: str | None, token: str, kwargs: dict):
+        """Runs the job function, then releases the lease and the lock _claim took."""
+        started_at = time.time()
+        start = time.perf_counter()
+        self.status["state"] = "running"
+        self.status["progress"] = None
+        last_run = {"trigger": trigger, "started_at": started_at}
+        try:
+            last_run["result"] = await self.func(self, **kwargs)
+            last_run["status"] = "success"
+        except Exception as e:
+            print(f"[{self.name}] Failed: {e}")
+            last_run["status"] = "failed"
+            last_run["error"] = str(e)
+        finally:
+            last_run["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            self.status["state"] = "idle"
+            self.status["last_run"] = last_run
+            try:
+                await release_lease(self.lease, slot, token)
+            except Exception as e:
+                print(f"[{self.name}] Could not release the job lease, it expires in {JOB_LEASE_SECONDS}s: {e}")
+            self.lock.release()
+
+    async def run(self, trigger: str = "schedule", slot: str | None = None) -> bool:
+        token = await self._claim(trigger, slot)
+        if token is None:
+            return False
+        await self._execute(trigger, slot, token, {})
+        return True
+
+    async def start(self, trigger: str = "manual", **kwargs) -> bool:
+        """Takes the lease now and runs the job in the background; False if it is already running."""
+        token = await self._claim(trigger, None)
+        if token is None:
+            return False
+        self.manual_run = asyncio.create_task(self._execute(trigger, None, token, kwargs))
+        return True
+
+    async def run_forever(self):
+        while True:
+            next_run = self.schedule.next_after(datetime.now(SGT))
+            delay = (next_run - datetime.now(SGT)).total_seconds() + random.uniform(0, self.jitter_seconds)
+            self.status["next_run_at"] = next_run.isoformat()
+            await asyncio.sleep(max(delay, 0))
+            await self.run(slot=next_run.isoformat())
+
+jobs: dict[str, Job] = {}
+
+def register_job(name: str, schedule: str | None = None, jitter_seconds: int = 0, lease: str | None = None):
+    """Decorator that registers an async job function under a cron schedule, or for manual runs only."""
+    def decorator(func):
+        jobs[name] = Job(name, schedule, func, jitter_seconds, lease)
+        return func
+    return decorator
+
+def start_scheduler() -> list[asyncio.Task]:
+    if not SCHEDULER_ENABLED:
+        print("ETL scheduler disabled")
+        return []
+    return [asyncio.create_task(job.run_forever()) for job in jobs.values() if job.schedule]
+
+async def start_job(name: str, **kwargs) -> dict:
+    """
+    Starts a job in the background for an endpoint. Raises 404 for an
+    unknown job and 409 while it, or a job sharing its lease, is running.
+    """
+    job = jobs.get(name)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{name}' not found")
+    if not await job.start(**kwargs):
+        raise HTTPException(status_code=409, detail=f"Job '{name}' is already running here or on another machine")
+    return {"message": f"Job '{name}' started", "job": name, "status": f"/jobs/{name}"}
+
+# Every bus dataset job takes this lease, so an extract started from an endpoint never
+# overlaps the nightly refresh or another extract
+BUS_DATASETS_LEASE = "bus_datasets"
+
+@register_job(
+    "bus_datasets", schedule=getEnvVariable("ETL_BUS_DATASETS_SCHEDULE", required=False) or "30 3 * * *",
+    jitter_seconds=600, lease=BUS_DATASETS_LEASE
+)
+async def refresh_bus_datasets(job: Job):
+    """
+    Off-peak refresh of every bus dataset, in the order from the readme:
+    bus routes, bus services, then bus stops (which read the new services list).
+    """
+    steps = [
+        ("Extracting bus routes", lambda: etl.extract_bus_routes(refresh=True)),
+        ("Extracting raw bus routes", lambda: etl.extract_bus_routes_raw()),
+        ("Extracting bus services", lambda: etl.refresh_bus_services()),
+        ("Updating bus stops", lambda: etl.extract_bus_stops()),
+    ]
+    for step, (message, run_step) in enumerate(steps, start=1):
+        job.progress(step, len(steps), message)
+        await run_step()
+    job.progress(len(steps), len(steps), "Done")
+    return {"steps": len(steps)}
+
+@register_job("bus_routes", lease=BUS_DATASETS_LEASE)
+async def extract_bus_routes(job: Job, refresh: bool = False):
+    return {"busRoutes": len(await etl.extract_bus_routes(refresh))}
+
+@register_job("bus_route_raw", lease=BUS_DATASETS_LEASE)
+async def extract_bus_routes_raw(job: Job, refresh: bool = False):
+    return await etl.extract_bus_routes_raw(refresh)
+
+@register_job("bus_stops", lease=BUS_DATASETS_LEASE)
+async def extract_bus_stops(job: Job):
+    return await etl.extract_bus_stops()
+
+@jobs_router.get("/jobs")
+async def list_jobs():
+    return {"enabled": SCHEDULER_ENABLED, "jobs": [job.status for job in jobs.values()]}
+
+@jobs_router.get("/jobs/{name}")
+async def get_job(name: str):
+    job = jobs.get(name)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{name}' not found")
+    return job.status
+
+@jobs_router.post("/jobs/{name}/run", status_code=202, dependencies=[Depends(require_admin_token)])
+async def run_job(name: str):
+    """
+    Starts a job in the background; poll /jobs/{name} for progress.
+    """
+    return await start_job(name)
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import zlib
+from fastapi.responses import StreamingResponse
+from routers.timing import span
+
+STREAM_GZIP_LEVEL = 6
+# Chunks at least this big are compressed in a worker thread. Not the CPU executor: the
+# compressor keeps state between chunks and cannot be sent to a process pool
+STREAM_OFFLOAD_SIZE = 64 * 1024
+
+def json_text(value) -> str:
+    """JSON text of a column value: text columns already hold JSON and pass through untouched."""
+    return value if isinstance(value, str) else json.dumps(value, separators=(",", ":"))
+
+async def prefetch_pages(pages):
+    """
+    Reads the first page of a read_table stream before the response starts,
+    so a failing query still becomes a 500 instead of a truncated body.
+    Returns None when the table is empty, otherwise the full page stream.
+    """
+    try:
+        first = await anext(pages)
+    except StopAsyncIteration:
+        return None
+
+    async def chained():
+        yield first
+        async for rows in pages:
+            yield rows
+
+    return chained()
+
+async def stream_json(pages, item, opening: bytes = b"[", closing: bytes = b"]"):
+    """
+    Writes a JSON array (or object) one page of rows at a time. item(row)
+    returns the JSON text of one element, or of one "key":value member
+    between opening b"{" and closing b"}". Only one page is held at a time.
+    """
+    yield opening
+    first = True
+    async for rows in pages:
+        with span("serialize"):
+            chunk = ",".join(item(row) for row in rows)
+        if not chunk:
+            continue
+        yield (chunk if first else "," + chunk).encode("utf-8")
+        first = False
+    yield closing
+
+def object_member(key, value_text: str) -> str:
+    return f"{json.dumps(str(key))}:{value_text}"
+
+async def tee_gzip(chunks, on_complete):
+    """
+    Passes chunks through while gzipping a copy of them. When the stream
+    finishes, on_complete(blob) is awaited to cache the whole body compressed,
+    so caching a streamed response never holds the uncompressed body.
+    """
+    compressor = zlib.compressobj(STREAM_GZIP_LEVEL, zlib.DEFLATED, 31)
+    parts = []
+    async for chunk in chunks:
+        if len(chunk) >= STREAM_OFFLOAD_SIZE:
+            parts.append(await asyncio.to_thread(compressor.compress, chunk))
+        else:
+            parts.append(compressor.compress(chunk))
+        yield chunk
+    parts.append(compressor.flush())
+    await on_complete(b"".join(parts))
+
+def json_stream_response(chunks, headers: dict | None = None) -> StreamingResponse:
+    """Streams JSON chunks; CompressionMiddleware compresses them incrementally."""
+    return StreamingResponse(chunks, media_type="application/json", headers=headers)
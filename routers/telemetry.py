@@ -0,0 +1,141 @@
+import datetime
+import random
+import time
+import uuid
+from urllib.parse import parse_qsl
+from routers.logshipper import LogShipper
+from routers.timing import SERVER_TIMING_ENABLED, end_request_timings, start_request_timings
+from routers.utils import getEnvVariable, is_admin_token
+
+# Sampling overrides on top of the rates passed to the middleware, e.g.
+# "axiom:/bustiming=0.01,firebase:/health=0"
+TELEMETRY_SAMPLING = getEnvVariable("TELEMETRY_SAMPLING", required=False) or ""
+
+class TelemetrySink:
+    """
+    A destination for request events: format turns the shared event into the
+    sink's own schema before it is queued on the sink's log shipper.
+    """
+    def __init__(self, shipper: LogShipper, format):
+        self.name = shipper.name
+        self.shipper = shipper
+        self.format = format
+
+    def emit(self, event: dict, sample_rate: float):
+        self.shipper.emit(self.format(event, sample_rate))
+
+def _parse_sampling(spec: str) -> dict[str, dict[str, float]]:
+    overrides: dict[str, dict[str, float]] = {}
+    for rule in filter(None, (item.strip() for item in spec.split(","))):
+        target, _, rate = rule.rpartition("=")
+        sink, _, prefix = target.partition(":")
+        overrides.setdefault(sink, {})[prefix] = float(rate)
+    return overrides
+
+def _has_admin_token(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name == b"x-admin-token":
+            return is_admin_token(value.decode("latin-1"))
+    return False
+
+class TelemetryMiddleware:
+    """
+    Pure ASGI middleware that records one event per response and fans it out
+    to every sink that sampled the request. Each sink has per-route sampling
+    rates keyed by path prefix (the longest matching prefix wins, unmatched
+    routes are always logged). The event is only built when at least one sink
+    samples the request, straight from the ASGI scope.
+    The event is emitted once the last body chunk is sent, so its duration
+    and timings cover streamed bodies too.
+    It also collects the spans (routers/timing.py) of sampled requests for
+    the event's timings. They are sent as a Server-Timing header only with
+    SERVER_TIMING_ENABLED or to requests carrying the admin token; the
+    header, sent before the body, only covers the time until then.
+    """
+    def __init__(self, app, sinks: list[TelemetrySink], sampling: dict[str, dict[str, float]] | None = None):
+        self.app = app
+        self.sinks = sinks
+        rates = {sink.name: dict((sampling or {}).get(sink.name, {})) for sink in sinks}
+        for sink_name, overrides in _parse_sampling(TELEMETRY_SAMPLING).items():
+            rates.setdefault(sink_name, {}).update(overrides)
+        # Longest prefix first so the most specific rule matches
+        self.rules = {
+            name: sorted(prefix_rates.items(), key=lambda rule: len(rule[0]), reverse=True)
+            for name, prefix_rates in rates.items()
+        }
+
+    def sample_rate(self, sink: TelemetrySink, path: str) -> float:
+        for prefix, rate in self.rules.get(sink.name, ()):
+            if path.startswith(prefix):
+                return rate
+        return 1.0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        sampled = []
+        for sink in self.sinks:
+            rate = self.sample_rate(sink, path)
+            if rate >= 1 or (rate > 0 and random.random() < rate):
+                sampled.append((sink, rate))
+        expose = SERVER_TIMING_ENABLED or _has_admin_token(scope)
+        timings, token = start_request_timings(expose or bool(sampled))
+        if timings is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = None
+        emitted = False
+
+        def emit_event():
+            nonlocal emitted
+            if not sampled or status is None or emitted:
+                return
+            emitted = True
+            event = self._event(scope, status, (time.perf_counter() - start) * 1000)
+            event["timings"] = timings.as_dict()
+            for sink, rate in sampled:
+                sink.emit(event, rate)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if expose:
+                    duration_ms = (time.perf_counter() - start) * 1000
+                    message = {**message, "headers": [*message.get("headers", ()), (b"server-timing", timings.header(duration_ms))]}
+            await send(message)
+            # The event covers the whole body, so streamed responses report their full duration
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                emit_event()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # A response that started but never finished (error, disconnect) is still logged
+            emit_event()
+            end_request_timings(token)
+
+    @staticmethod
+    def _event(scope, status: int, duration_ms: float) -> dict:
+        user_agent = None
+        for name, value in scope["headers"]:
+            if name == b"user-agent":
+                user_agent = value.decode("latin-1")
+                break
+        client = scope.get("client")
+        return {
+            "id": str(uuid.uuid4()),
+            "timestamp": datetime.datetime.utcnow().isoformat(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status,
+            "duration_ms": round(duration_ms, 2),
+            "ip": client[0] if client else None,
+            "user_agent": user_agent,
+            "params": dict(parse_qsl(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)),
+        }
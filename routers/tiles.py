@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import json
+from collections import defaultdict
+from routers.datasets import dataset_version, on_publish, published_version, read_dataset
+
+GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+TILE_PRECISIONS = (4, 5, 6)  # ~39km, ~4.9km and ~1.2km wide tiles
+
+def geohash_encode(latitude: float, longitude: float, precision: int) -> str:
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        value_range, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (value_range[0] + value_range[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            value_range[0] = mid
+        else:
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(geohash)
+
+class BusStopTiles:
+    """
+    Bus stops partitioned by geohash at each of TILE_PRECISIONS.
+    Each tile is serialized once; its ETag is a hash of the tile body, so a
+    tile only gets a new ETag when its own stops change. The ETags are weak
+    because CompressionMiddleware may send the same tile gzip or br encoded.
+    """
+    __slots__ = ("tiles",)
+
+    def __init__(self, bus_stops: list[dict]):
+        # geohash -> (body bytes, etag)
+        self.tiles: dict[str, tuple[bytes, str]] = {}
+
+        partitions = defaultdict(list)
+        for stop in sorted(bus_stops, key=lambda stop: stop["id"]):
+            if stop.get("latitude") is None or stop.get("longitude") is None:
+                continue
+            geohash = geohash_encode(stop["latitude"], stop["longitude"], max(TILE_PRECISIONS))
+            for precision in TILE_PRECISIONS:
+                partitions[geohash[:precision]].append(stop)
+
+        for geohash, stops in partitions.items():
+            body = json.dumps({"geohash": geohash, "busStops": stops}, separators=(",", ":")).encode("utf-8")
+            etag = f'W/"{hashlib.sha1(body).hexdigest()[:16]}"'
+            self.tiles[geohash] = (body, etag)
+
+    def get(self, geohash: str) -> tuple[bytes, str] | None:
+        return self.tiles.get(geohash)
+
+    def index(self, precision: int) -> dict[str, str]:
+        return {
+            geohash: etag
+            for geohash, (_, etag) in self.tiles.items()
+            if len(geohash) == precision
+        }
+
+# Shared tiles, built on first use and again after each bus_stops publish
+_tiles: BusStopTiles = None
+_tiles_version: str = None
+_tiles_lock = asyncio.Lock()
+
+async def get_tiles() -> BusStopTiles:
+    global _tiles, _tiles_version
+    if _tiles is not None and _tiles_version == dataset_version("bus_stops"):
+        return _tiles
+
+    async with _tiles_lock:
+        if _tiles is None or _tiles_version != dataset_version("bus_stops"):
+            version = await published_version("bus_stops")
+            bus_stops = []
+            async for rows in read_dataset("bus_stops", "id, description, latitude, longitude, road_name, bus_services", version=version):
+                bus_stops.extend(rows)
+            _tiles, _tiles_version = BusStopTiles(bus_stops), version
+            print(f"Built {len(_tiles.tiles)} bus stop tiles from {len(bus_stops)} stops")
+    return _tiles
+
+def reset_tiles():
+    """Drops the built tiles so the next request rebuilds them from bus_stops."""
+    global _tiles
+    _tiles = None
+
+on_publish("bus_stops", reset_tiles)
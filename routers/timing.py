@@ -0,0 +1,83 @@
+import os
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+# Read directly: routers.utils imports this module for its spans
+# Off by default: phase durations tell a client which backend was slow, so the header
+# is only sent to every client when this is set, otherwise only on admin requests
+SERVER_TIMING_ENABLED = (os.getenv("SERVER_TIMING_ENABLED") or "false").lower() == "true"
+
+class RequestTimings:
+    """
+    Time spent per phase of one request. A phase entered several times
+    (one DB query per page, one decode per row) adds up, and its count is
+    reported in the Server-Timing description.
+    """
+    __slots__ = ("phases",)
+
+    def __init__(self):
+        self.phases: dict[str, list] = {}
+
+    def add(self, name: str, seconds: float):
+        phase = self.phases.get(name)
+        if phase is None:
+            self.phases[name] = [seconds, 1]
+        else:
+            phase[0] += seconds
+            phase[1] += 1
+
+    def as_dict(self) -> dict[str, float]:
+        return {name: round(seconds * 1000, 2) for name, (seconds, _) in self.phases.items()}
+
+    def header(self, total_ms: float) -> bytes:
+        entries = [
+            f'{name};dur={seconds * 1000:.2f}' + (f';desc="x{count}"' if count > 1 else "")
+            for name, (seconds, count) in self.phases.items()
+        ]
+        entries.append(f"total;dur={total_ms:.2f}")
+        return ", ".join(entries).encode("latin-1")
+
+class _Span:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings: RequestTimings, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.add(self.name, time.perf_counter() - self.start)
+
+_request_timings: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+_NO_SPAN = nullcontext()
+
+def span(name: str):
+    """
+    Times a phase of the current request:
+
+        with span("serialize"):
+            body = await run_cpu(dump_json, data)
+
+    Outside a request, or in one whose timings are not collected, this is a
+    shared no-op context manager. Work run in the CPU executor does not see the
+    request context, so time it around the run_cpu call.
+    """
+    timings = _request_timings.get()
+    if timings is None:
+        return _NO_SPAN
+    return _Span(timings, name)
+
+def start_request_timings(collect: bool = True):
+    """Starts collecting spans for the current request; returns (timings, token) or (None, None)."""
+    if not collect:
+        return None, None
+    timings = RequestTimings()
+    return timings, _request_timings.set(timings)
+
+def end_request_timings(token):
+    if token is not None:
+        _request_timings.reset(token)
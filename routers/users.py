@@ -1,9 +1,7 @@
 from fastapi import APIRouter, HTTPException
-from routers.database import create_dbuser, get_dbuser, getDBClient
+from routers.database import create_dbuser, get_dbuser
 from routers.schemas import GetUser, User
 
-dbClient = getDBClient()
-
 users_router = APIRouter()
 
 @users_router.post("/user")
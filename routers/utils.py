@@ -1,16 +1,20 @@
 from datetime import datetime
 import gzip
+import hmac
 import json
 # import geopandas as gpd
 import os
 from collections import defaultdict
 from typing import Any, Dict, List, Optional
 from dotenv import load_dotenv
-from fastapi import HTTPException
+from fastapi import Header, HTTPException
 import httpx
 import re
+import socket
 
 from routers.client import get_client
+from routers.metrics import record_upstream_error
+from routers.timing import span
 
 load_dotenv()
 
@@ -34,16 +38,34 @@ def getEnvVariable(key: str, required: bool = True) -> str:
     return value
 
 ACCOUNT_KEY = getEnvVariable("ACCOUNT_KEY")
+# Operator endpoints (profiling) are disabled unless this is set
+ADMIN_TOKEN = getEnvVariable("ADMIN_TOKEN", required=False)
+
+def is_admin_token(token: str | None) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+def require_admin_token(x_admin_token: str | None = Header(default=None)):
+    """FastAPI dependency for operator endpoints: expects the X-Admin-Token header."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (ADMIN_TOKEN is not set)")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+# Identifies this process in job leases and dataset build reservations
+INSTANCE_ID = f"{getEnvVariable('FLY_MACHINE_ID', required=False) or socket.gethostname()}:{os.getpid()}"
 
 # Query LTA's API
 async def queryAPI(path: str, params: dict) -> dict:
     url = f"https://datamall2.mytransport.sg/{path}"
     client = get_client()
     try:
-        response = await client.get(url, params=params)
+        with span("upstream"):
+            response = await client.get(url, params=params)
         response.raise_for_status()
-        return response.json()
+        with span("decode"):
+            return response.json()
     except httpx.RequestError as exc:
+        record_upstream_error("lta", exc.request)
         print(f"Request error {exc.request.url!r}: {exc}")
         raise HTTPException(503, f"Error contacting LTA API: {exc}")
     except Exception as e:
@@ -246,6 +268,70 @@ def compress_to_gzip(data) -> bytes:
         # Return empty bytes or re-raise depending on your error policy
         raise e
 
+def dump_json(data) -> bytes:
+    """
+    Serializes data to JSON bytes; run it with run_cpu for large payloads.
+    Responses are compressed by CompressionMiddleware.
+    """
+    return json.dumps(data).encode("utf-8")
+
+def format_bus_route_raw_rows(stops_data: Dict[str, Any], modified_at: str) -> List[Dict]:
+    """Builds bus_route_raw rows, one JSON blob per bus stop."""
+    return [
+        {
+            "id": str(bus_stop_code),
+            "bus_stop_code": str(bus_stop_code),
+            "json_value": json.dumps(bus_stop_data),  # Convert dict to JSON string
+            "modified_at": modified_at
+        }
+        for bus_stop_code, bus_stop_data in stops_data.items()
+    ]
+
+# Douglas-Peucker tolerances in degrees (~1m, ~5m, ~20m at Singapore's latitude)
+POLYLINE_DETAIL_TOLERANCES = {
+    "full": 0.0,
+    "high": 0.00001,
+    "medium": 0.00005,
+    "low": 0.0002,
+}
+POLYLINE_FORMATS = ("json", "encoded")
+
+def simplify_polyline(coords: List[List[float]], tolerance: float) -> List[List[float]]:
+    """
+    Simplifies a [[lat, lng], ...] line with the Douglas-Peucker algorithm.
+    Points closer than `tolerance` degrees to the simplified line are dropped.
+    """
+    if tolerance <= 0 or len(coords) < 3:
+        return coords
+
+    keep = [False] * len(coords)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(coords) - 1)]
+    while stack:
+        start, end = stack.pop()
+        lat1, lng1 = coords[start]
+        lat2, lng2 = coords[end]
+        d_lat, d_lng = lat2 - lat1, lng2 - lng1
+        length_sq = d_lat * d_lat + d_lng * d_lng
+
+        max_dist_sq, max_index = 0.0, None
+        for i in range(start + 1, end):
+            lat, lng = coords[i]
+            if length_sq == 0:
+                dist_sq = (lat - lat1) ** 2 + (lng - lng1) ** 2
+            else:
+                cross = d_lat * (lng - lng1) - d_lng * (lat - lat1)
+                dist_sq = cross * cross / length_sq
+            if dist_sq > max_dist_sq:
+                max_dist_sq, max_index = dist_sq, i
+
+        if max_index is not None and max_dist_sq > tolerance * tolerance:
+            keep[max_index] = True
+            stack.append((start, max_index))
+            stack.append((max_index, end))
+
+    return [point for point, kept in zip(coords, keep) if kept]
+
 # def getBusStopAvailableServicesList(busRoutes: dict):
 #     bus_stop_master_list = defaultdict(list)  # BusStopCode -> List of ServiceNos
     
@@ -260,48 +346,90 @@ def compress_to_gzip(data) -> bytes:
 
 #     return bus_stop_master_list
 
-def getFormattedBusRoutesData(busRoutes: dict):
-    bus_route_dict = []  # List of service dictionaries
-    bus_stop_master_list = defaultdict(list)  # BusStopCode -> List of ServiceNos
+def build_bus_route_views(busRoutes: List[Dict]) -> Dict[str, Any]:
+    """
+    Builds every derived BusRoutes view in a single indexed pass.
 
-    service_dict = {}  # Temporary dictionary to store services
-    
-    if busRoutes:
-        for service in busRoutes:
-            service_no = service.get("ServiceNo", "")
-            bus_stop_code = service.get("BusStopCode", "")
-            stop_sequence = service.get("StopSequence", 0)
-            direction = str(service.get("Direction", 1))  # Default to 1 if no direction is specified
-
-            if service_no not in service_dict:
-                service_dict[service_no] = {"serviceNo": service_no, "routes": []}
-
-            # Find existing entry for this direction
-            route_entry = next((route for route in service_dict[service_no]["routes"] if route["direction"] == direction), None)
-            
-            if not route_entry:
-                route_entry = {"direction": direction, "busStopIDs": [], "polyline": ""}
-                service_dict[service_no]["routes"].append(route_entry)
-            
-            route_entry["busStopIDs"].append((stop_sequence, bus_stop_code))
+    Returns:
+        dict: {
+            "bus_routes": [{"serviceNo", "routes": [{"direction", "busStopIDs", "polyline"}]}],
+            "bus_stop_services": {BusStopCode: [ServiceNo, ...]},
+            "stops": {BusStopCode: stops-centric schedule structure},
+        }
+    """
+    service_dict = {}  # ServiceNo -> {"serviceNo", "routes"}
+    route_index = {}  # (ServiceNo, direction) -> route entry
+    bus_stop_services = defaultdict(set)  # BusStopCode -> ServiceNos
+    stops = {}
 
-            # Populate bus stop master list
-            if service_no not in bus_stop_master_list[bus_stop_code]:
-                bus_stop_master_list[bus_stop_code].append(service_no)
+    for route in busRoutes or []:
+        service_no = route.get("ServiceNo", "")
+        bus_stop_code = route.get("BusStopCode", "")
+        stop_sequence = route.get("StopSequence", 0)
+        raw_direction = route.get("Direction", 1)  # Default to 1 if no direction is specified
+        direction = str(raw_direction)
+
+        # Service -> direction -> stops
+        route_entry = route_index.get((service_no, direction))
+        if route_entry is None:
+            service = service_dict.get(service_no)
+            if service is None:
+                service = service_dict[service_no] = {"serviceNo": service_no, "routes": []}
+            route_entry = route_index[(service_no, direction)] = {"direction": direction, "busStopIDs": [], "polyline": ""}
+            service["routes"].append(route_entry)
+        route_entry["busStopIDs"].append((stop_sequence, bus_stop_code))
+
+        # Bus stop master list
+        bus_stop_services[bus_stop_code].add(service_no)
+
+        # Stops-centric schedules
+        stop = stops.get(bus_stop_code)
+        if stop is None:
+            stop = stops[bus_stop_code] = {"bus_stop_code": bus_stop_code, "services": {}}
+        stop_service = stop["services"].get(service_no)
+        if stop_service is None:
+            stop_service = stop["services"][service_no] = {
+                "service_no": service_no,
+                "operator": route.get("Operator"),
+                "directions": {}
+            }
+        stop_service["directions"][raw_direction] = {
+            "direction": raw_direction,
+            "stop_sequence": stop_sequence,
+            "distance": route.get("Distance"),
+            "schedules": {
+                "weekday": {
+                    "first_bus": route.get("WD_FirstBus"),
+                    "last_bus": route.get("WD_LastBus")
+                },
+                "saturday": {
+                    "first_bus": route.get("SAT_FirstBus"),
+                    "last_bus": route.get("SAT_LastBus")
+                },
+                "sunday": {
+                    "first_bus": route.get("SUN_FirstBus"),
+                    "last_bus": route.get("SUN_LastBus")
+                }
+            }
+        }
 
-        # Sort bus stop lists in bus_stop_master_list
-        for bus_stop in bus_stop_master_list:
-            bus_stop_master_list[bus_stop].sort(key=service_sort_key)
+    # Sort stops in each route by StopSequence
+    for route_entry in route_index.values():
+        route_entry["busStopIDs"].sort(key=lambda x: x[0])
+        route_entry["busStopIDs"] = [bus_stop_code for _, bus_stop_code in route_entry["busStopIDs"]]
 
-        # Sort and format bus stops in service_dict
-        for service_no in service_dict:
-            for route in service_dict[service_no]["routes"]:
-                route["busStopIDs"].sort(key=lambda x: x[0])  # Sort by StopSequence
-                route["busStopIDs"] = [bus_stop_code for _, bus_stop_code in route["busStopIDs"]]
-    
-    bus_route_dict = list(service_dict.values())  # Convert service_dict to a list
-    
-    return bus_route_dict, dict(bus_stop_master_list)
+    return {
+        "bus_routes": list(service_dict.values()),
+        "bus_stop_services": {
+            bus_stop_code: sorted(services, key=service_sort_key)
+            for bus_stop_code, services in bus_stop_services.items()
+        },
+        "stops": stops,
+    }
+
+def getFormattedBusRoutesData(busRoutes: dict):
+    views = build_bus_route_views(busRoutes)
+    return views["bus_routes"], views["bus_stop_services"]
         
 def service_sort_key(service_no: str):
     if not service_no:
@@ -346,55 +474,23 @@ def restructure_to_stops_only(raw_data: List[Dict]) -> Dict[str, Any]:
     """
     Restructure flat bus route data into stops-centric format only
     """
-    stops = {}
-    
-    # Process each route entry
-    for route in raw_data:
-        service_no = route['ServiceNo']
-        bus_stop_code = route['BusStopCode']
-        direction = route['Direction']
-        
-        # Build stop structure
-        if bus_stop_code not in stops:
-            stops[bus_stop_code] = {
-                "bus_stop_code": bus_stop_code,
-                "services": {}
-            }
-        
-        # Add service info to stop
-        if service_no not in stops[bus_stop_code]["services"]:
-            stops[bus_stop_code]["services"][service_no] = {
-                "service_no": service_no,
-                "operator": route['Operator'],
-                "directions": {}
-            }
-        
-        # Add direction info to service
-        stops[bus_stop_code]["services"][service_no]["directions"][direction] = {
-            "direction": direction,
-            "stop_sequence": route['StopSequence'],
-            "distance": route['Distance'],
-            "schedules": {
-                "weekday": {
-                    "first_bus": route['WD_FirstBus'],
-                    "last_bus": route['WD_LastBus']
-                },
-                "saturday": {
-                    "first_bus": route['SAT_FirstBus'],
-                    "last_bus": route['SAT_LastBus']
-                },
-                "sunday": {
-                    "first_bus": route['SUN_FirstBus'],
-                    "last_bus": route['SUN_LastBus']
-                }
-            }
-        }
-    
-    return stops
+    return build_bus_route_views(raw_data)["stops"]
 
 def cache_headers(ttl_seconds: int = 86400):
     return {"Cache-Control": f"public, s-maxage={ttl_seconds}, stale-while-revalidate={ttl_seconds}"}
 
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Weak comparison of an If-None-Match header (one ETag, a list, or *)
+    against an ETag, as If-None-Match requires.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
 # def shapefile_to_station_json_clean(folder_path, shapefile_name, json_file):
 #     """
 #     Reads a shapefile of train station exits, converts coordinates to lat/lon,
@@ -0,0 +1,130 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from fastapi import APIRouter, Depends
+from routers.logshipper import log_shippers
+from routers.metrics import Counter, Gauge, MetricsMiddleware, loop_lag
+from routers.utils import getEnvVariable, require_admin_token
+
+watchdog_router = APIRouter()
+
+LOOP_STALL_THRESHOLD = float(getEnvVariable("LOOP_STALL_THRESHOLD_MS", required=False) or 100) / 1000
+LOOP_HEARTBEAT_INTERVAL = 0.025    # seconds between event-loop heartbeats
+LOOP_LAG_WINDOW = 4096             # recent lag samples kept for percentiles (~100s)
+STALL_HISTORY = 50                 # recent stalls kept for /debug/loop
+STALL_STACK_DEPTH = 30
+STALL_LOG_SHIPPER = "axiom"        # stalls are also shipped here, as "loop_stall" events
+
+loop_stalls = Counter("event_loop_stalls_total", "Event-loop stalls longer than LOOP_STALL_THRESHOLD_MS.")
+
+def _describe_stack(frame) -> dict:
+    """
+    Stack of the blocked loop thread, innermost call last, and the request it
+    was serving: the MetricsMiddleware frame on the stack holds its scope.
+    """
+    route = method = None
+    current = frame
+    while current is not None:
+        if current.f_code is MetricsMiddleware.__call__.__code__:
+            scope = current.f_locals.get("scope") or {}
+            route = getattr(scope.get("route"), "path", None) or scope.get("path")
+            method = scope.get("method")
+            break
+        current = current.f_back
+    stack = [
+        f"{entry.filename}:{entry.lineno} in {entry.name}"
+        for entry in traceback.extract_stack(frame)[-STALL_STACK_DEPTH:]
+    ]
+    return {"route": route, "method": method, "stack": stack}
+
+class LoopWatchdog:
+    """
+    A heartbeat task on the event loop measures how late each wake-up is.
+    A daemon thread watches the heartbeat; once it is overdue by more than
+    the threshold, the thread grabs the loop thread's stack while the loop
+    is still blocked. When the loop wakes up again the stall is recorded
+    with its duration, the stack and the route that was executing.
+    A stall inside a single C call that holds the GIL (json.dumps of a big
+    object) keeps the thread out too, so it is recorded without a stack.
+    """
+    def __init__(self, threshold: float, interval: float):
+        self.threshold = threshold
+        self.interval = interval
+        self.heartbeat = time.perf_counter()
+        self.lags: deque[float] = deque(maxlen=LOOP_LAG_WINDOW)
+        self.stalls: deque[dict] = deque(maxlen=STALL_HISTORY)
+        self._loop_thread_id: int = None
+        self._captured: dict = None
+        self._captured_for: float = None
+        self._stop = threading.Event()
+
+    async def run(self):
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        try:
+            while True:
+                self.heartbeat = time.perf_counter()
+                await asyncio.sleep(self.interval)
+                lag = max(time.perf_counter() - self.heartbeat - self.interval, 0.0)
+                self.lags.append(lag)
+                loop_lag.observe(lag)
+                if lag >= self.threshold:
+                    self._record_stall(lag)
+        finally:
+            self._stop.set()
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            beat = self.heartbeat
+            if time.perf_counter() - beat > self.interval + self.threshold and self._captured_for != beat:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    self._captured = _describe_stack(frame)
+                    self._captured_for = beat
+
+    def _record_stall(self, lag: float):
+        captured = self._captured if self._captured_for == self.heartbeat else None
+        self._captured = None
+        stall = {
+            "at": time.time() - lag,
+            "duration_ms": round(lag * 1000, 2),
+            **(captured or {"route": None, "method": None, "stack": None}),
+        }
+        self.stalls.append(stall)
+        loop_stalls.inc()
+
+        where = f"{stall['method']} {stall['route']}" if stall["route"] else "outside a request"
+        top = stall["stack"][-1] if stall["stack"] else "no stack (blocked in native code holding the GIL)"
+        print(f"Event loop stalled {stall['duration_ms']}ms {where}: {top}")
+        if shipper := log_shippers.get(STALL_LOG_SHIPPER):
+            shipper.emit({"type": "loop_stall", **stall})
+
+    def percentiles(self) -> dict[str, float]:
+        lags = sorted(self.lags)
+        if not lags:
+            return {}
+        pick = lambda q: lags[min(int(len(lags) * q), len(lags) - 1)]
+        return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": lags[-1]}
+
+watchdog = LoopWatchdog(LOOP_STALL_THRESHOLD, LOOP_HEARTBEAT_INTERVAL)
+
+Gauge(
+    "event_loop_lag_quantile_seconds", "Event-loop lag percentiles over the last ~100s.", ("quantile",),
+    collect=lambda: [((name,), round(value, 6)) for name, value in watchdog.percentiles().items()]
+)
+
+@watchdog_router.get("/debug/loop", dependencies=[Depends(require_admin_token)])
+async def get_loop_stalls():
+    """
+    Event-loop lag percentiles and the most recent stalls with their stacks
+    (source paths of the server), for operators only.
+    """
+    return {
+        "threshold_ms": LOOP_STALL_THRESHOLD * 1000,
+        "lag_ms": {name: round(value * 1000, 3) for name, value in watchdog.percentiles().items()},
+        "stalls": list(reversed(watchdog.stalls)),
+    }
@@ -0,0 +1,90 @@
+"""
+In-memory stand-in for Redis that speaks enough RESP for the "redis" cache
+backend (PING, AUTH, SELECT, GET, SET [EX|PX], DEL, SCAN, FLUSHDB).
+For local runs of several workers without a Redis server:
+
+    python scripts/redis_standin.py 6379
+    CACHE_BACKEND=redis CACHE_REDIS_URL=redis://127.0.0.1:6379 uvicorn main:app --workers 2
+"""
+import asyncio
+import fnmatch
+import re
+import sys
+import time
+
+_store: dict[bytes, tuple[bytes, float | None]] = {}
+
+def _encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return b"+%s\r\n" % value.encode()
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(_encode(item) for item in value)
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+def _get(key: bytes) -> bytes | None:
+    entry = _store.get(key)
+    if entry is None:
+        return None
+    value, expires_at = entry
+    if expires_at is not None and time.time() >= expires_at:
+        del _store[key]
+        return None
+    return value
+
+def _execute(command: str, args: list[bytes]):
+    if command in ("PING", "AUTH", "SELECT"):
+        return "PONG" if command == "PING" else "OK"
+    if command == "GET":
+        return _get(args[0])
+    if command == "SET":
+        expires_at = None
+        options = [arg.upper() for arg in args[2::2]]
+        for option, amount in zip(options, args[3::2]):
+            expires_at = time.time() + int(amount) / (1000 if option == b"PX" else 1)
+        _store[args[0]] = (args[1], expires_at)
+        return "OK"
+    if command == "DEL":
+        return sum(_store.pop(key, None) is not None for key in args)
+    if command == "SCAN":
+        # Single pass: every live key matching the pattern, cursor back to 0
+        options = dict(zip((arg.upper() for arg in args[1::2]), args[2::2]))
+        # Redis escapes glob characters with a backslash, fnmatch with brackets
+        pattern = re.sub(r"\\(.)", r"[\1]", options.get(b"MATCH", b"*").decode())
+        keys = [key for key in list(_store) if _get(key) is not None and fnmatch.fnmatchcase(key.decode(), pattern)]
+        return [b"0", keys]
+    if command == "FLUSHDB":
+        _store.clear()
+        return "OK"
+    raise ValueError(f"unknown command '{command}'")
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            header = await reader.readuntil(b"\r\n")
+            args = []
+            for _ in range(int(header[1:-2])):
+                length = int((await reader.readuntil(b"\r\n"))[1:-2])
+                args.append((await reader.readexactly(length + 2))[:-2])
+            try:
+                reply = _encode(_execute(args[0].decode().upper(), args[1:]))
+            except Exception as e:
+                reply = b"-ERR %s\r\n" % str(e).encode()
+            writer.write(reply)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def main(port: int):
+    server = await asyncio.start_server(_handle, "127.0.0.1", port)
+    print(f"Redis stand-in listening on 127.0.0.1:{port}")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 6379))
@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+import pytest
+from postgrest.exceptions import APIError
+
+# The routers read their settings at import time
+for name in ("ACCOUNT_KEY", "SUPABASE_URL", "SUPABASE_API_KEY", "SUPABASE_EMAIL", "SUPABASE_PASSWORD",
+             "AXIOM_TOKEN", "AXIOM_DATASET", "ONEMAP_API_TOKEN", "ADMIN_TOKEN"):
+    os.environ.setdefault(name, "test")
+os.environ["SUPABASE_URL"] = "http://localhost:1"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class FakeDB:
+    """
+    In-memory tables behind the query helpers of routers.database, enough
+    for the jsons compare-and-set, paged reads, bulk writes and datasets.
+    `fail_upserts` makes that many upserts raise before one succeeds.
+    """
+    def __init__(self):
+        self.tables: dict[str, list[dict]] = {}
+        self.fail_upserts = 0
+        self.upserts = 0
+
+    def rows(self, table: str) -> list[dict]:
+        return self.tables.setdefault(table, [])
+
+    def json(self, key: str):
+        for row in self.rows("jsons"):
+            if row["id"] == key:
+                return json.loads(row["json_value"])
+        return None
+
+    @staticmethod
+    def _matches(row: dict, eq: dict | None, in_: dict | None) -> bool:
+        return all(row.get(column) == value for column, value in (eq or {}).items()) and all(
+            row.get(column) in values for column, values in (in_ or {}).items()
+        )
+
+    async def select_rows(self, table, columns="*", eq=None, in_=None, range_=None, order=None, count=None, head=None, timeout=None):
+        rows = [row for row in self.rows(table) if self._matches(row, eq, in_)]
+        if order is not None:
+            rows.sort(key=lambda row: str(row[order]))
+        total = len(rows)
+        if range_ is not None:
+            rows = rows[range_[0]:range_[1] + 1]
+        if columns != "*":
+            names = [name.strip() for name in columns.split(",")]
+            rows = [{name: row.get(name) for name in names} for row in rows]
+        return SimpleNamespace(data=[] if head else [dict(row) for row in rows], count=total if count else None)
+
+    async def insert_rows(self, table, rows, timeout=None):
+        for row in rows:
+            if table == "jsons" and any(existing["id"] == row["id"] for existing in self.rows(table)):
+                raise APIError({"code": "23505", "message": "duplicate key value"})
+            self.rows(table).append(dict(row))
+        return SimpleNamespace(data=rows)
+
+    async def upsert_rows(self, table, rows, on_conflict, timeout=None, **kwargs):
+        self.upserts += 1
+        if self.fail_upserts:
+            self.fail_upserts -= 1
+            raise RuntimeError("upsert failed")
+        keys = on_conflict.split(",")
+        for row in rows:
+            existing = [old for old in self.rows(table) if all(old.get(key) == row.get(key) for key in keys)]
+            if existing:
+                existing[0].update(row)
+            else:
+                self.rows(table).append(dict(row))
+        return SimpleNamespace(data=rows)
+
+    async def update_rows(self, table, values, eq, timeout=None):
+        changed = [row for row in self.rows(table) if self._matches(row, eq, None)]
+        for row in changed:
+            row.update(values)
+        return SimpleNamespace(data=[dict(row) for row in changed])
+
+    async def delete_rows(self, table, eq=None, in_=None, timeout=None):
+        self.tables[table] = [row for row in self.rows(table) if not self._matches(row, eq, in_)]
+        return SimpleNamespace(data=[])
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    from routers import database, datasets, scheduler
+    db = FakeDB()
+    for module in (database, datasets, scheduler):
+        for name in ("select_rows", "insert_rows", "upsert_rows", "update_rows", "delete_rows"):
+            if hasattr(module, name):
+                monkeypatch.setattr(module, name, getattr(db, name))
+    return db
@@ -0,0 +1,109 @@
+import asyncio
+import pytest
+from routers import admission
+from routers.admission import AdmissionMiddleware, RouteClass
+
+@pytest.fixture(autouse=True)
+def route_classes(monkeypatch):
+    classes = {
+        "interactive": RouteClass("interactive", 1, 2, 0.5, 1, 0),
+        "heavy": RouteClass("heavy", 1, 2, 0.5, 5, 1),
+    }
+    monkeypatch.setattr(admission, "route_classes", classes)
+    return classes
+
+class GatedApp:
+    """Records the order requests start in and holds each one until released."""
+    def __init__(self):
+        self.started = []
+        self.gates: dict[str, asyncio.Event] = {}
+
+    async def __call__(self, scope, receive, send):
+        name = scope["query_string"].decode()
+        self.started.append(name)
+        await self.gates.setdefault(name, asyncio.Event()).wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    def release(self, name: str):
+        self.gates.setdefault(name, asyncio.Event()).set()
+
+async def request(middleware, path: str, name: str) -> tuple[int, dict]:
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "path": path, "query_string": name.encode(), "headers": []}
+    await middleware(scope, None, send)
+    return sent[0]["status"], dict(sent[0]["headers"])
+
+def test_queued_requests_take_freed_slots_in_order(route_classes):
+    app = GatedApp()
+    middleware = AdmissionMiddleware(app, {"/getallbusstops": "heavy"})
+    interactive = route_classes["interactive"]
+
+    async def main():
+        first, second, third = (asyncio.create_task(request(middleware, "/bustiming", name)) for name in ("a", "b", "c"))
+        await asyncio.sleep(0.01)
+        assert app.started == ["a"] and len(interactive.waiters) == 2
+        app.release("a")
+        await asyncio.sleep(0.01)
+        # The slot went straight to the oldest waiter
+        assert app.started == ["a", "b"] and interactive.in_flight == 1
+        app.release("c")
+        app.release("b")
+        return [(await task)[0] for task in (first, second, third)]
+    assert asyncio.run(main()) == [200, 200, 200]
+    assert interactive.in_flight == 0 and not interactive.waiters
+
+def test_full_queue_and_queue_timeout_are_shed_with_retry_after(route_classes):
+    app = GatedApp()
+    middleware = AdmissionMiddleware(app, {"/getallbusstops": "heavy"})
+
+    async def main():
+        running = asyncio.create_task(request(middleware, "/getallbusstops", "a"))
+        queued = [asyncio.create_task(request(middleware, "/getallbusstops", name)) for name in ("b", "c")]
+        await asyncio.sleep(0.01)
+        status, headers = await request(middleware, "/getallbusstops", "d")
+        assert status == 503 and headers[b"retry-after"] == b"5"
+        # Nothing frees a slot before the queue timeout
+        assert [(await task)[0] for task in queued] == [503, 503]
+        app.release("a")
+        assert (await running)[0] == 200
+    asyncio.run(main())
+    assert app.started == ["a"]
+    assert route_classes["heavy"].in_flight == 0
+
+def test_lower_priority_classes_are_shed_while_interactive_requests_wait(route_classes):
+    app = GatedApp()
+    middleware = AdmissionMiddleware(app, {"/getallbusstops": "heavy"})
+
+    async def main():
+        interactive = [asyncio.create_task(request(middleware, "/bustiming", name)) for name in ("a", "b")]
+        heavy = asyncio.create_task(request(middleware, "/getallbusstops", "h1"))
+        await asyncio.sleep(0.01)
+        assert route_classes["interactive"].waiters and app.started == ["a", "h1"]
+        # heavy is at its limit and an interactive request is queued: shed rather than queue
+        assert (await request(middleware, "/getallbusstops", "h2"))[0] == 503
+        for name in ("a", "b", "h1"):
+            app.release(name)
+        return [(await task)[0] for task in (*interactive, heavy)]
+    assert asyncio.run(main()) == [200, 200, 200]
+
+def test_cancelled_waiter_leaves_the_queue(route_classes):
+    app = GatedApp()
+    middleware = AdmissionMiddleware(app, {})
+    interactive = route_classes["interactive"]
+
+    async def main():
+        running = asyncio.create_task(request(middleware, "/bustiming", "a"))
+        waiting = asyncio.create_task(request(middleware, "/bustiming", "b"))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        await asyncio.sleep(0.01)
+        assert not interactive.waiters
+        app.release("a")
+        await running
+    asyncio.run(main())
+    assert interactive.in_flight == 0
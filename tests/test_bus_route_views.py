@@ -0,0 +1,83 @@
+import random
+from collections import defaultdict
+from routers.utils import build_bus_route_views, getFormattedBusRoutesData, restructure_to_stops_only, service_sort_key
+
+# The formatters as they were before build_bus_route_views, as the reference output
+def reference_formatted(busRoutes):
+    service_dict = {}
+    bus_stop_master_list = defaultdict(list)
+    for service in busRoutes:
+        service_no = service.get("ServiceNo", "")
+        bus_stop_code = service.get("BusStopCode", "")
+        stop_sequence = service.get("StopSequence", 0)
+        direction = str(service.get("Direction", 1))
+        if service_no not in service_dict:
+            service_dict[service_no] = {"serviceNo": service_no, "routes": []}
+        route_entry = next((route for route in service_dict[service_no]["routes"] if route["direction"] == direction), None)
+        if not route_entry:
+            route_entry = {"direction": direction, "busStopIDs": [], "polyline": ""}
+            service_dict[service_no]["routes"].append(route_entry)
+        route_entry["busStopIDs"].append((stop_sequence, bus_stop_code))
+        if service_no not in bus_stop_master_list[bus_stop_code]:
+            bus_stop_master_list[bus_stop_code].append(service_no)
+    for bus_stop in bus_stop_master_list:
+        bus_stop_master_list[bus_stop].sort(key=service_sort_key)
+    for service_no in service_dict:
+        for route in service_dict[service_no]["routes"]:
+            route["busStopIDs"].sort(key=lambda x: x[0])
+            route["busStopIDs"] = [bus_stop_code for _, bus_stop_code in route["busStopIDs"]]
+    return list(service_dict.values()), dict(bus_stop_master_list)
+
+def reference_stops(raw_data):
+    stops = {}
+    for route in raw_data:
+        service_no, bus_stop_code, direction = route["ServiceNo"], route["BusStopCode"], route["Direction"]
+        if bus_stop_code not in stops:
+            stops[bus_stop_code] = {"bus_stop_code": bus_stop_code, "services": {}}
+        if service_no not in stops[bus_stop_code]["services"]:
+            stops[bus_stop_code]["services"][service_no] = {"service_no": service_no, "operator": route["Operator"], "directions": {}}
+        stops[bus_stop_code]["services"][service_no]["directions"][direction] = {
+            "direction": direction,
+            "stop_sequence": route["StopSequence"],
+            "distance": route["Distance"],
+            "schedules": {
+                "weekday": {"first_bus": route["WD_FirstBus"], "last_bus": route["WD_LastBus"]},
+                "saturday": {"first_bus": route["SAT_FirstBus"], "last_bus": route["SAT_LastBus"]},
+                "sunday": {"first_bus": route["SUN_FirstBus"], "last_bus": route["SUN_LastBus"]},
+            },
+        }
+    return stops
+
+def sample_bus_routes(seed: int) -> list[dict]:
+    rng = random.Random(seed)
+    codes = [f"{code:05d}" for code in rng.sample(range(1000, 99999), 60)]
+    rows = []
+    for service_no in ["2", "10", "10e", "291", "2A", "NR1", "960"]:
+        for direction in (1, 2) if rng.random() < 0.7 else (1,):
+            stops = rng.sample(codes, rng.randint(3, 15))
+            if service_no == "291":
+                stops.append(stops[0])  # loop back to the interchange
+            for sequence, code in enumerate(stops, start=1):
+                rows.append({
+                    "ServiceNo": service_no, "Operator": rng.choice(["SBST", "SMRT", "GAS"]), "Direction": direction,
+                    "StopSequence": sequence, "BusStopCode": code, "Distance": round(sequence * 0.7, 1),
+                    "WD_FirstBus": "0530", "WD_LastBus": "2330", "SAT_FirstBus": "0530",
+                    "SAT_LastBus": "2330", "SUN_FirstBus": "0600", "SUN_LastBus": "2300",
+                })
+    rng.shuffle(rows)
+    return rows
+
+def test_views_match_the_previous_formatters():
+    for seed in range(20):
+        rows = sample_bus_routes(seed)
+        assert getFormattedBusRoutesData(rows) == reference_formatted(rows)
+        assert restructure_to_stops_only(rows) == reference_stops(rows)
+
+def test_views_of_an_empty_ingest():
+    views = build_bus_route_views([])
+    assert (views["bus_routes"], views["bus_stop_services"], views["stops"]) == ([], {}, {})
+
+def test_missing_direction_defaults_to_1():
+    rows = [{"ServiceNo": "2", "BusStopCode": "01012", "StopSequence": 1}]
+    assert getFormattedBusRoutesData(rows) == reference_formatted(rows)
+    assert getFormattedBusRoutesData(rows)[0][0]["routes"][0]["direction"] == "1"
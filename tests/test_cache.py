@@ -0,0 +1,129 @@
+import asyncio
+import importlib.util
+import os
+import pytest
+from routers.cache import CacheBackend, CacheNamespace, RedisBackend, RedisError, SharedMemoryBackend
+
+def load_standin():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts", "redis_standin.py")
+    spec = importlib.util.spec_from_file_location("redis_standin", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+async def with_redis(test):
+    """Runs test(backend) against a RedisBackend talking to the stand-in server."""
+    standin = load_standin()
+    server = await asyncio.start_server(standin._handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    backend = RedisBackend(f"redis://127.0.0.1:{port}/1", timeout=2)
+    try:
+        await test(backend)
+    finally:
+        await backend.close()
+        server.close()
+        await server.wait_closed()
+
+def test_redis_get_set_delete():
+    async def test(redis):
+        assert await redis.get("missing") is None
+        await redis.set("a", b"\x00binary\r\nvalue", ttl=60)
+        assert await redis.get("a") == b"\x00binary\r\nvalue"
+        await redis.delete("a")
+        assert await redis.get("a") is None
+        assert await redis.command("PING") == "PONG"
+    asyncio.run(with_redis(test))
+
+def test_redis_expiry():
+    async def test(redis):
+        await redis.set("short", b"1", ttl=0.05)
+        assert await redis.get("short") == b"1"
+        await asyncio.sleep(0.1)
+        assert await redis.get("short") is None
+    asyncio.run(with_redis(test))
+
+def test_redis_delete_prefix_escapes_glob_characters():
+    async def test(redis):
+        for key in ("ns:a*b:1", "ns:a*b:2", "ns:axb:1", "other:a*b:1"):
+            await redis.set(key, b"v", ttl=60)
+        await redis.delete_prefix("ns:a*b:")
+        assert [await redis.get(key) for key in ("ns:a*b:1", "ns:a*b:2", "ns:axb:1", "other:a*b:1")] == [None, None, b"v", b"v"]
+    asyncio.run(with_redis(test))
+
+def test_redis_errors_and_reconnect():
+    async def test(redis):
+        with pytest.raises(RedisError):
+            await redis.command("NOSUCHCOMMAND")
+        # An error reply keeps the connection in sync
+        await redis.set("k", b"v", ttl=60)
+        redis._writer.close()
+        await asyncio.sleep(0)
+        assert await redis.get("k") == b"v"
+    asyncio.run(with_redis(test))
+
+def test_namespace_prefixes_keys_and_serializes():
+    async def test(redis):
+        cache = CacheNamespace("test_json")
+        cache.backend = redis
+        await cache.set("key", {"stops": [1, 2]}, ttl=60)
+        assert await redis.get("test_json:key") == b'{"stops":[1,2]}'
+        assert await cache.get("key") == {"stops": [1, 2]}
+        await cache.clear()
+        assert await cache.get("key") is None
+        assert (cache.hits, cache.misses) == (1, 1)
+    asyncio.run(with_redis(test))
+
+def test_namespace_treats_backend_errors_as_misses():
+    cache = CacheNamespace("test_unreachable")
+    cache.backend = RedisBackend("redis://127.0.0.1:1", timeout=0.5)
+
+    async def main():
+        await cache.set("key", 1, ttl=60)
+        assert await cache.get("key") is None
+        await cache.delete("key")
+        await cache.delete_prefix("k")
+    asyncio.run(main())
+    assert cache.errors == 4
+
+def test_shared_backend_evicts_oldest_beyond_caps(tmp_path):
+    shared = SharedMemoryBackend(str(tmp_path), max_entries=3, max_bytes=1024 * 1024)
+
+    async def main():
+        for i in range(5):
+            await shared.set(f"key{i}", b"x" * 10, ttl=60)
+            os.utime(shared._path(f"key{i}"), (1000 + i, 1000 + i))
+        await asyncio.to_thread(shared._sweep, lambda key, expires_at: False)
+        return [await shared.get(f"key{i}") for i in range(5)]
+    assert asyncio.run(main()) == [None, None, b"x" * 10, b"x" * 10, b"x" * 10]
+
+def test_shared_backend_byte_cap_and_prefix_delete(tmp_path):
+    shared = SharedMemoryBackend(str(tmp_path), max_entries=100, max_bytes=1010)
+
+    async def main():
+        await shared.set("ns:small", b"s", ttl=60)
+        os.utime(shared._path("ns:small"), (1000, 1000))
+        # Over a tenth of max_bytes, so this set sweeps; with headers the two files exceed it
+        await shared.set("ns:big", b"b" * 990, ttl=60)
+        assert await shared.get("ns:small") is None
+        assert await shared.get("ns:big") == b"b" * 990
+        await shared.delete_prefix("ns:")
+        assert await shared.get("ns:big") is None
+    asyncio.run(main())
+
+def test_concurrent_shared_writes_of_one_key(tmp_path):
+    shared = SharedMemoryBackend(str(tmp_path), max_entries=100, max_bytes=1024 * 1024)
+    values = [bytes([i]) * 50_000 for i in range(16)]
+
+    async def main():
+        await asyncio.gather(*[shared.set("same", value, ttl=60) for value in values])
+        return await shared.get("same")
+    assert asyncio.run(main()) in values
+    assert os.listdir(tmp_path) == [os.path.basename(shared._path("same"))]
+
+def test_backends_must_implement_every_operation():
+    class GetOnly(CacheBackend):
+        async def get(self, key: str):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
@@ -0,0 +1,78 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from fastapi import FastAPI
+from routers import client, database, datasets, scheduler
+
+class FakeAuth:
+    def __init__(self, expires_in: float, refresh_fails: bool = False):
+        self.expires_in = expires_in
+        self.refresh_fails = refresh_fails
+        self.calls = []
+
+    async def get_session(self):
+        return SimpleNamespace(expires_at=time.time() + self.expires_in)
+
+    async def refresh_session(self):
+        self.calls.append("refresh")
+        if self.refresh_fails:
+            raise RuntimeError("refresh token expired")
+
+    async def sign_in_with_password(self, credentials):
+        self.calls.append("sign_in")
+
+def run_refresh(monkeypatch, auth: FakeAuth) -> dict:
+    monkeypatch.setattr(database, "_db_client", SimpleNamespace(auth=auth))
+    monkeypatch.setattr(database, "DB_SESSION_CHECK_INTERVAL", 0.001)
+    status = {"refresh_count": 0, "refresh_failures": 0, "last_refresh_at": None}
+    monkeypatch.setattr(database, "_db_status", status)
+
+    async def main():
+        task = asyncio.create_task(database.refreshDBSession())
+        await asyncio.sleep(0.02)
+        task.cancel()
+    asyncio.run(main())
+    return status
+
+def test_session_is_left_alone_until_it_nears_expiry(monkeypatch):
+    auth = FakeAuth(expires_in=3600)
+    assert run_refresh(monkeypatch, auth)["refresh_count"] == 0
+    assert auth.calls == []
+
+def test_expiring_session_is_refreshed(monkeypatch):
+    auth = FakeAuth(expires_in=60)
+    status = run_refresh(monkeypatch, auth)
+    assert status["refresh_count"] > 0 and status["last_refresh_at"]
+    assert set(auth.calls) == {"refresh"}
+
+def test_invalid_refresh_token_signs_in_again(monkeypatch):
+    auth = FakeAuth(expires_in=60, refresh_fails=True)
+    run_refresh(monkeypatch, auth)
+    assert auth.calls[:2] == ["refresh", "sign_in"]
+
+def test_startup_does_not_wait_for_supabase(monkeypatch):
+    state = {}
+
+    async def slow_connect():
+        state["connecting"] = True
+        await asyncio.sleep(0.2)
+        state["connected"] = True
+
+    async def no_op():
+        pass
+
+    monkeypatch.setattr(database, "connectDB", slow_connect)
+    monkeypatch.setattr(client, "_warm_lta_connection", no_op)
+    monkeypatch.setattr(datasets, "refresh_versions", no_op)
+    monkeypatch.setattr(scheduler, "SCHEDULER_ENABLED", False)
+
+    async def main():
+        started = time.perf_counter()
+        async with client.lifespan(FastAPI()):
+            assert time.perf_counter() - started < 0.2
+            assert client.get_client() is not None
+            await asyncio.sleep(0.3)
+            assert state == {"connecting": True, "connected": True}
+            assert client.startup_timings["warm_up_ms"] >= 200
+    asyncio.run(main())
+    assert client.get_client().is_closed
@@ -0,0 +1,147 @@
+import asyncio
+import gzip
+import json
+import brotli
+import pytest
+from routers import compression, datasets, executor
+from routers import bus, busstop  # noqa: F401, they register the on_publish callbacks under test
+from routers.compression import CompressionMiddleware, _accepted_encodings, negotiate
+
+BODY = json.dumps([{"busStopCode": f"{i:05d}", "description": "Opp Blk 123"} for i in range(200)]).encode()
+
+def accepted(value: str) -> dict[str, float]:
+    return _accepted_encodings([(b"accept-encoding", value.encode())])
+
+@pytest.mark.parametrize("header, expected", [
+    ("gzip, deflate, br", "br"),
+    ("gzip, br;q=0.5", "gzip"),
+    ("br;q=0, gzip;q=0", "identity"),
+    ("*", "br"),
+    ("*;q=0.1, gzip;q=0.9", "gzip"),
+    ("identity", "identity"),
+    ("gzip;q=bogus, br", "br"),
+    ("", "identity"),
+])
+def test_negotiate(header, expected):
+    assert negotiate(accepted(header)) == expected
+
+def test_negotiate_without_brotli(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    assert negotiate(accepted("br, gzip;q=0.5")) == "gzip"
+
+def respond(body_messages: list[dict], headers: list, accept_encoding: str | None, status: int = 200) -> tuple[dict, bytes, list]:
+    """Runs one response through the middleware; returns (start message, body, body messages)."""
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": status, "headers": list(headers)})
+        for message in body_messages:
+            await send({"type": "http.response.body", **message})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    request_headers = [(b"accept-encoding", accept_encoding.encode())] if accept_encoding is not None else []
+    asyncio.run(CompressionMiddleware(app)({"type": "http", "headers": request_headers}, None, send))
+    bodies = sent[1:]
+    return sent[0], b"".join(message.get("body", b"") for message in bodies), bodies
+
+def header(start: dict, name: bytes) -> bytes | None:
+    return dict(start["headers"]).get(name)
+
+JSON = [(b"content-type", b"application/json"), (b"content-length", str(len(BODY)).encode())]
+
+def test_json_is_encoded_for_the_client():
+    start, body, _ = respond([{"body": BODY}], JSON, "gzip, br")
+    assert header(start, b"content-encoding") == b"br"
+    assert header(start, b"vary") == b"Accept-Encoding"
+    assert header(start, b"content-length") == str(len(body)).encode()
+    assert brotli.decompress(body) == BODY
+
+    start, body, _ = respond([{"body": BODY}], JSON, "gzip")
+    assert gzip.decompress(body) == BODY
+
+def test_small_uncompressible_and_unaccepted_bodies_pass_through():
+    start, body, _ = respond([{"body": b'{"ok":true}'}], [(b"content-type", b"application/json")], "gzip")
+    assert (header(start, b"content-encoding"), body) == (None, b'{"ok":true}')
+    assert header(start, b"vary") == b"Accept-Encoding"
+
+    start, body, _ = respond([{"body": BODY}], [(b"content-type", b"image/png")], "gzip")
+    assert (header(start, b"content-encoding"), header(start, b"vary"), body) == (None, None, BODY)
+
+    start, body, _ = respond([{"body": BODY}], JSON, None)
+    assert (header(start, b"content-encoding"), body) == (None, BODY)
+
+    start, body, _ = respond([{"body": b""}], JSON, "gzip", status=304)
+    assert header(start, b"content-encoding") is None
+
+def test_pre_encoded_bodies_pass_through_or_are_transcoded():
+    stored = gzip.compress(BODY)
+    gzipped = [(b"content-type", b"application/json"), (b"content-encoding", b"gzip")]
+    start, body, _ = respond([{"body": stored}], gzipped, "gzip, br")
+    assert (header(start, b"content-encoding"), body) == (b"gzip", stored)
+
+    start, body, _ = respond([{"body": stored}], gzipped, "identity")
+    assert (header(start, b"content-encoding"), body) == (None, BODY)
+
+    start, body, _ = respond([{"body": stored}], gzipped, "br")
+    assert header(start, b"content-encoding") == b"br"
+    assert brotli.decompress(body) == BODY
+
+def test_streams_are_compressed_chunk_by_chunk():
+    chunks = [BODY[i:i + 1000] for i in range(0, len(BODY), 1000)]
+    messages = [{"body": chunk, "more_body": True} for chunk in chunks] + [{"body": b"", "more_body": False}]
+    start, body, sent = respond(messages, [(b"content-type", b"application/json")], "gzip")
+    assert header(start, b"content-encoding") == b"gzip"
+    assert header(start, b"content-length") is None
+    assert gzip.decompress(body) == BODY
+    assert sent[-1]["more_body"] is False
+
+def test_encoded_bodies_are_cached_per_key(monkeypatch):
+    calls = []
+    transcode = compression.transcode
+
+    def counting_transcode(*args):
+        calls.append(args[2])
+        return transcode(*args)
+
+    monkeypatch.setattr(compression, "transcode", counting_transcode)
+    cached = [*JSON, (compression._ENCODING_CACHE_KEY, b"test_stops@v1"), (b"etag", b'"abc"')]
+    for _ in range(2):
+        start, body, _ = respond([{"body": BODY}], cached, "br")
+        assert brotli.decompress(body) == BODY
+        assert compression._ENCODING_CACHE_KEY not in dict(start["headers"])
+        assert header(start, b"etag") == b'W/"abc"'
+    assert calls == ["br"]
+    asyncio.run(compression.encoded_cache.delete_prefix("test_stops@"))
+
+@pytest.mark.parametrize("encoding, decompress", [("gzip", gzip.decompress), ("br", brotli.decompress)])
+def test_large_stream_chunks_compress_with_the_process_executor(monkeypatch, encoding, decompress):
+    # The stream encoder keeps state between chunks, so it must never be sent to a worker process
+    executor.shutdown_executor()
+    monkeypatch.setattr(executor, "CPU_EXECUTOR", "process")
+    big = BODY * (compression.COMPRESSION_OFFLOAD_SIZE // len(BODY) + 1)
+    try:
+        messages = [{"body": big, "more_body": True}, {"body": big, "more_body": True}, {"body": b"", "more_body": False}]
+        start, body, _ = respond(messages, [(b"content-type", b"application/json")], encoding)
+    finally:
+        executor.shutdown_executor()
+    assert header(start, b"content-encoding") == encoding.encode()
+    assert decompress(body) == big * 2
+
+def test_publish_drops_the_encodings_of_the_previous_version(monkeypatch):
+    monkeypatch.setattr(datasets, "_versions", {"bus_routes": "v1", "bus_stops": "v1"})
+    keys = ["bus_routes@v1:br", "bus_routes@v1:gzip", "all.json.gz@v1:br", "other@v1:br"]
+
+    async def main():
+        for key in keys:
+            await compression.encoded_cache.set(key, b"x", ttl=60)
+        await datasets._apply_versions({"bus_routes": "v2"})
+        after_routes = [await compression.encoded_cache.get(key) for key in keys]
+        await datasets._apply_versions({"bus_stops": "v2"})
+        after_stops = [await compression.encoded_cache.get(key) for key in keys]
+        await compression.encoded_cache.delete("other@v1:br")
+        return after_routes, after_stops
+    after_routes, after_stops = asyncio.run(main())
+    assert after_routes == [None, None, b"x", b"x"]
+    assert after_stops == [None, None, None, b"x"]
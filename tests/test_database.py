@@ -0,0 +1,140 @@
+import asyncio
+import httpx
+from types import SimpleNamespace
+import pytest
+from routers import database
+
+def fake_table(monkeypatch, rows: list[dict], max_rows: int = 1000):
+    """Serves rows from memory, at most max_rows per response like PostgREST's db-max-rows."""
+    requests = []
+
+    async def select_rows(table, columns="*", eq=None, in_=None, range_=None, order=None, **kwargs):
+        requests.append(range_)
+        start, end = range_
+        return SimpleNamespace(data=rows[start:min(end + 1, start + max_rows)])
+
+    async def count_rows(table, column="id", eq=None, timeout=None):
+        return len(rows)
+
+    monkeypatch.setattr(database, "select_rows", select_rows)
+    monkeypatch.setattr(database, "count_rows", count_rows)
+    return requests
+
+async def read_all(**kwargs) -> list[list[dict]]:
+    return [page async for page in database.read_table("bus_stops", **kwargs)]
+
+def test_read_table_yields_pages_in_order(monkeypatch):
+    rows = [{"id": i} for i in range(2500)]
+    fake_table(monkeypatch, rows)
+    pages = asyncio.run(read_all(page_size=1000, concurrency=2))
+    assert [len(page) for page in pages] == [1000, 1000, 500]
+    assert [row for page in pages for row in page] == rows
+
+def test_read_table_reads_the_rest_of_a_capped_range(monkeypatch):
+    rows = [{"id": i} for i in range(250)]
+    requests = fake_table(monkeypatch, rows, max_rows=100)
+    pages = asyncio.run(read_all(page_size=200, concurrency=4))
+    assert [len(page) for page in pages] == [200, 50]
+    assert (100, 199) in requests
+
+def test_read_table_of_an_empty_table(monkeypatch):
+    requests = fake_table(monkeypatch, [])
+    assert asyncio.run(read_all()) == []
+    assert requests == []
+
+def test_bulk_upsert_resumes_from_the_persisted_checkpoint(fake_db, monkeypatch):
+    from collections import defaultdict
+    monkeypatch.setattr(database, "DB_WRITE_RETRY_BACKOFF", 0)
+    rows = [{"id": str(i), "name": f"stop {i}", "modified_at": "now"} for i in range(6)]
+    written = []
+    broken = {"3"}
+
+    async def upsert_rows(table, batch, on_conflict, **kwargs):
+        if table != "jsons":
+            if broken & {row["id"] for row in batch}:
+                raise RuntimeError("connection reset")
+            written.append([row["id"] for row in batch])
+        return await fake_db.upsert_rows(table, batch, on_conflict, **kwargs)
+
+    monkeypatch.setattr(database, "upsert_rows", upsert_rows)
+    write = lambda: database.bulk_upsert("bus_stops", rows, on_conflict="id", job="stops@v1", batch_size=2, concurrency=1, retries=1)
+
+    with pytest.raises(database.HTTPException):
+        asyncio.run(write())
+    assert written == [["0", "1"], ["4", "5"]]
+    assert len(fake_db.json("bulkCheckpoint:stops@v1")) == 2
+
+    # A rerun on another machine has no in-memory checkpoint
+    monkeypatch.setattr(database, "_bulk_checkpoints", defaultdict(set))
+    broken.clear()
+    written.clear()
+    run = asyncio.run(write())
+    assert written == [["2", "3"]]
+    assert (run["status"], run["written_rows"], run["skipped_batches"]) == ("completed", 2, 2)
+    assert fake_db.json("bulkCheckpoint:stops@v1") is None
+    assert sorted(row["id"] for row in fake_db.rows("bus_stops")) == [str(i) for i in range(6)]
+
+def test_bulk_upsert_retries_a_failed_batch(fake_db, monkeypatch):
+    monkeypatch.setattr(database, "DB_WRITE_RETRY_BACKOFF", 0)
+    fake_db.fail_upserts = 2
+    run = asyncio.run(database.bulk_upsert("bus_stops", [{"id": "1"}], on_conflict="id", job="retry", retries=2))
+    assert (run["status"], run["retries"], run["written_rows"]) == ("completed", 2, 1)
+
+class FakeQuery:
+    def __init__(self, result=None, delay: float = 0.0, error: Exception | None = None):
+        self.result, self.delay, self.error = result, delay, error
+
+    async def execute(self):
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.result
+
+@pytest.fixture
+def db_client(monkeypatch):
+    client = object()
+    monkeypatch.setattr(database, "_db_client", client)
+    monkeypatch.setattr(database, "_query_stats", database.defaultdict(database._query_stats.default_factory))
+    return client
+
+def test_execute_runs_the_built_query_and_records_stats(db_client):
+    clients = []
+
+    def build(client):
+        clients.append(client)
+        return FakeQuery("rows")
+
+    assert asyncio.run(database.execute("bus_stops.select", build)) == "rows"
+    assert clients == [db_client]
+    assert database.get_query_stats()["bus_stops.select"]["count"] == 1
+
+def test_execute_turns_timeouts_into_504(db_client):
+    for query in (FakeQuery(delay=1), FakeQuery(error=httpx.ReadTimeout("slow"))):
+        with pytest.raises(database.HTTPException) as raised:
+            asyncio.run(database.execute("jsons.select", lambda client: query, timeout=0.01))
+        assert raised.value.status_code == 504
+    stats = database.get_query_stats()["jsons.select"]
+    assert (stats["count"], stats["timeouts"], stats["errors"]) == (2, 2, 0)
+
+def test_execute_counts_and_reraises_errors(db_client):
+    with pytest.raises(ValueError):
+        asyncio.run(database.execute("jsons.upsert", lambda client: FakeQuery(error=ValueError("bad row"))))
+    assert database.get_query_stats()["jsons.upsert"]["errors"] == 1
+
+def test_failed_sign_in_closes_the_http_client(monkeypatch):
+    monkeypatch.setattr(database, "_db_client", None)
+    monkeypatch.setattr(database, "_db_http_client", None)
+    created = []
+
+    async def acreate_client(url, key, options):
+        created.append(options.httpx_client)
+        raise RuntimeError("invalid login")
+
+    monkeypatch.setattr(database, "acreate_client", acreate_client)
+    with pytest.raises(RuntimeError):
+        asyncio.run(database.getDBClient())
+    assert created[0].is_closed
+    assert database._db_client is None and database._db_http_client is None
+    # connectDB keeps startup going
+    asyncio.run(database.connectDB())
+    assert len(created) == 2
@@ -0,0 +1,164 @@
+import asyncio
+from collections import defaultdict
+import json
+import time
+import pytest
+from routers import datasets
+from routers.datasets import dataset_build, publish_dataset, read_dataset
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(datasets, "_versions", {})
+    monkeypatch.setattr(datasets, "_building", defaultdict(int))
+    monkeypatch.setattr(datasets, "_invalidators", defaultdict(list))
+    monkeypatch.setattr(datasets, "_dataset_status", {"published_at": {}, "publish_failures": {}, "last_poll_at": None, "poll_failures": 0})
+    monkeypatch.setattr(datasets, "DATASET_PUBLISH_BACKOFF", 0)
+
+async def read_ids(dataset: str = "bus_stops") -> list[str]:
+    return sorted([row["id"] async for rows in read_dataset(dataset) for row in rows])
+
+async def build(fake_db, ids: list[str], fail: bool = False):
+    async with dataset_build("bus_stops") as current:
+        await fake_db.upsert_rows("bus_stops", current.tag([{"id": stop_id} for stop_id in ids]), on_conflict="id,version")
+        if fail:
+            raise RuntimeError("LTA is down")
+    return current
+
+def test_publish_switches_readers_to_the_new_version(fake_db):
+    fake_db.rows("bus_stops").extend([{"id": "1"}, {"id": "2"}])  # rows from before versioning
+    published = []
+    datasets.on_publish("bus_stops", lambda: published.append(datasets.dataset_version("bus_stops")))
+
+    async def main():
+        assert await read_ids() == ["1", "2"]
+        first = await build(fake_db, ["1", "2", "3"])
+        assert first.summary() == {"version": first.version, "published": True}
+        assert await read_ids() == ["1", "2", "3"]
+        assert published == [first.version]
+        assert fake_db.json("datasetVersion:bus_stops") == {"version": first.version, "previous": None, "building": None}
+    asyncio.run(main())
+
+def test_readers_never_see_a_build_in_progress(fake_db):
+    async def main():
+        first = await build(fake_db, ["1"])
+        async with dataset_build("bus_stops") as second:
+            fake_db.rows("bus_stops").extend(second.tag([{"id": "1"}, {"id": "2"}]))
+            assert await read_ids() == ["1"]
+            assert (await datasets.get_datasets())["building"] == ["bus_stops"]
+        assert await read_ids() == ["1", "2"]
+        assert datasets.dataset_version("bus_stops") == second.version != first.version
+    asyncio.run(main())
+
+def test_failed_build_is_resumed_and_pruned(fake_db):
+    async def main():
+        first = await build(fake_db, ["1"])
+        with pytest.raises(RuntimeError):
+            await build(fake_db, ["1", "9"], fail=True)
+        pointer = fake_db.json("datasetVersion:bus_stops")
+        assert pointer["version"] == first.version and pointer["building"]
+        assert await read_ids() == ["1"]
+
+        rerun = await build(fake_db, ["1", "2"])
+        assert rerun.resumed and rerun.version == pointer["building"]
+        assert rerun.checkpoint == f"bus_stops@{rerun.version}"
+        assert await read_ids() == ["1", "2"]
+    asyncio.run(main())
+
+def test_publish_drops_the_version_before_the_previous_one(fake_db):
+    async def main():
+        versions = [(await build(fake_db, [str(i)])).version for i in range(3)]
+        return versions
+    versions = asyncio.run(main())
+    assert {row["version"] for row in fake_db.rows("bus_stops")} == set(versions[1:])
+
+def test_failed_publish_is_reported_not_raised(fake_db, monkeypatch):
+    async def unavailable(*args):
+        raise RuntimeError("jsons is unavailable")
+
+    async def main():
+        first = await build(fake_db, ["1"])
+        pending = await datasets._start_build("bus_stops")
+        monkeypatch.setattr(datasets, "compare_and_set_json", unavailable)
+        await publish_dataset(pending)
+        assert pending.summary() == {"version": pending.version, "published": False, "publish_error": "jsons is unavailable"}
+        assert datasets._dataset_status["publish_failures"]["bus_stops"]["version"] == pending.version
+        assert datasets.dataset_version("bus_stops") == first.version
+    asyncio.run(main())
+
+def test_publish_retries_when_the_pointer_changes(fake_db, monkeypatch):
+    real = datasets.compare_and_set_json
+    attempts = []
+
+    async def racing(key, value, expected):
+        attempts.append(value)
+        if len(attempts) == 2:
+            return None  # another machine moved the pointer first
+        return await real(key, value, expected)
+
+    monkeypatch.setattr(datasets, "compare_and_set_json", racing)
+
+    async def main():
+        current = await build(fake_db, ["1"])
+        assert current.published
+    asyncio.run(main())
+    assert len(attempts) == 3
+
+def hold_build(fake_db, holder: str, expires_at: float, version: str = "held-1") -> str:
+    """Leases the bus_stops build of version to another process."""
+    pointer = fake_db.json("datasetVersion:bus_stops")
+    pointer.update({"building": version, "holder": holder, "expires_at": expires_at})
+    for row in fake_db.rows("jsons"):
+        if row["id"] == "datasetVersion:bus_stops":
+            row["json_value"] = json.dumps(pointer)
+    return version
+
+def test_build_held_by_another_process_is_not_resumed(fake_db):
+    async def main():
+        first = await build(fake_db, ["1"])
+        hold_build(fake_db, "other:1", time.time() + 60)
+        with pytest.raises(RuntimeError, match="being built by other:1"):
+            await build(fake_db, ["1", "2"])
+        pointer = fake_db.json("datasetVersion:bus_stops")
+        assert pointer["holder"] == "other:1" and pointer["building"] == "held-1"
+        assert await read_ids() == ["1"] and datasets.dataset_version("bus_stops") == first.version
+    asyncio.run(main())
+
+def test_build_with_an_expired_lease_is_taken_over(fake_db):
+    async def main():
+        await build(fake_db, ["1"])
+        version = hold_build(fake_db, "other:1", time.time() - 1)
+        rerun = await build(fake_db, ["1", "2"])
+        assert rerun.resumed and rerun.version == version and rerun.published
+        assert await read_ids() == ["1", "2"]
+    asyncio.run(main())
+
+def test_build_that_lost_its_lease_is_not_published(fake_db):
+    async def main():
+        first = await build(fake_db, ["1"])
+        async with dataset_build("bus_stops") as current:
+            fake_db.rows("bus_stops").extend(current.tag([{"id": "2"}]))
+            # Stalled past its lease, another process took the version over
+            hold_build(fake_db, "other:1", time.time() + 60, current.version)
+        assert not current.published and current.summary()["publish_error"] == "another process took the build over"
+        assert datasets.dataset_version("bus_stops") == first.version
+    asyncio.run(main())
+
+def test_running_build_renews_its_lease(fake_db, monkeypatch):
+    monkeypatch.setattr(datasets, "DATASET_BUILD_LEASE_SECONDS", 0.06)
+
+    async def main():
+        async with dataset_build("bus_stops") as current:
+            started = fake_db.json("datasetVersion:bus_stops")["expires_at"]
+            await asyncio.sleep(0.1)
+            pointer = fake_db.json("datasetVersion:bus_stops")
+            assert pointer["holder"] == datasets.INSTANCE_ID and pointer["expires_at"] > started
+        assert current.published
+    asyncio.run(main())
+
+def test_failed_build_releases_its_lease(fake_db):
+    async def main():
+        with pytest.raises(RuntimeError):
+            await build(fake_db, ["1"], fail=True)
+        pointer = fake_db.json("datasetVersion:bus_stops")
+        assert pointer["building"] and pointer["expires_at"] == 0
+    asyncio.run(main())
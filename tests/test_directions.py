@@ -0,0 +1,142 @@
+import asyncio
+import json
+import pytest
+from routers import directions
+from routers.cache import BoundedCache
+from routers.directions import TransitRouteRequest, route_cache_key
+
+def trip(**kwargs) -> TransitRouteRequest:
+    fields = {"start_lat": 1.30012, "start_lon": 103.85011, "end_lat": 1.35204, "end_lon": 103.94007, "date": "10-19-2026", "time": "08:31:00"}
+    fields.update(kwargs)
+    return TransitRouteRequest(**{name: value for name, value in fields.items() if value is not None})
+
+def test_nearby_trips_in_one_time_bucket_share_a_key():
+    key = route_cache_key(trip())
+    assert key == "1.300|103.850|1.352|103.940|10-19-2026|51"
+    assert route_cache_key(trip(start_lat=1.30049, end_lon=103.94040, time="08:39")) == key
+    assert route_cache_key(trip(start_lat=1.30051)) != key
+    assert route_cache_key(trip(time="08:40:00")) != key
+    assert route_cache_key(trip(date="10-20-2026")) != key
+
+def test_missing_or_bad_time_uses_the_current_bucket():
+    assert route_cache_key(trip(time=None)) == route_cache_key(trip(time="not a time"))
+    assert route_cache_key(trip(date=None)).split("|")[4] == directions.datetime.now(directions.SGT).strftime("%m-%d-%Y")
+
+def test_concurrent_misses_share_one_fetch():
+    cache = BoundedCache(max_entries=10)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return b"route"
+
+    async def main():
+        results = await asyncio.gather(*(cache.get_or_fetch("k", 60, fetch) for _ in range(5)))
+        assert results == [b"route"] * 5
+        assert await cache.get_or_fetch("k", 60, fetch) == b"route"
+    asyncio.run(main())
+    assert calls == [1]
+    assert {k: cache.stats()[k] for k in ("hits", "misses", "coalesced")} == {"hits": 1, "misses": 1, "coalesced": 4}
+
+def test_failed_fetches_are_not_cached():
+    cache = BoundedCache(max_entries=10)
+
+    async def failing():
+        raise RuntimeError("OneMap is down")
+
+    async def working():
+        return b"route"
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            await cache.get_or_fetch("k", 60, failing)
+        assert await cache.get_or_fetch("k", 60, working) == b"route"
+    asyncio.run(main())
+
+def test_least_recently_used_entries_are_evicted():
+    cache = BoundedCache(max_entries=2)
+    cache.set("a", 1, 60)
+    cache.set("b", 2, 60)
+    cache.get("a")
+    cache.set("c", 3, 60)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+
+def test_transit_route_full_calls_onemap_once_per_key(monkeypatch):
+    calls = []
+
+    async def fetch_onemap_route(body):
+        calls.append(body)
+        await asyncio.sleep(0.01)
+        return b'{"plan":{}}'
+
+    monkeypatch.setattr(directions, "fetch_onemap_route", fetch_onemap_route)
+    monkeypatch.setattr(directions, "onemap_route_cache", BoundedCache(max_entries=10))
+
+    async def main():
+        return await asyncio.gather(directions.get_transit_route_full(trip()), directions.get_transit_route_full(trip(start_lat=1.30049)))
+    responses = asyncio.run(main())
+    assert [response.body for response in responses] == [b'{"plan":{}}'] * 2
+    assert len(calls) == 1
+
+LEG_POINTS = [(1.3, 103.8), (1.30001, 103.801), (1.3, 103.802), (1.31, 103.803)]
+ONEMAP = {"plan": {"from": {"name": "A"}, "to": {"name": "B"}, "itineraries": [{
+    "duration": 1800, "transfers": 0, "fare": "1.19", "walkDistance": 120, "startTime": 1, "endTime": 2,
+    "legs": [
+        {"mode": "WALK", "distance": 100, "from": {"name": "A"}, "to": {"name": "Opp Blk 1", "stopCode": "01012"},
+         "duration": 60, "legGeometry": {"points": directions.polyline.encode([(1.3, 103.8), (1.3001, 103.8)])}},
+        {"mode": "BUS", "routeId": "10", "distance": 2000, "transitLeg": True, "from": {"name": "Opp Blk 1", "stopCode": "01012"},
+         "to": {"name": "B", "stopCode": "75009"}, "duration": 900,
+         "legGeometry": {"points": directions.polyline.encode(LEG_POINTS)},
+         "intermediateStops": [{"name": "Mid", "stopCode": "76059", "lat": 1.305, "lon": 103.81, "arrival": 3, "departure": 4}]},
+    ],
+}]}}
+
+def test_summary_profile_has_no_geometry_or_stops():
+    result = directions.decode_transit_route(ONEMAP, 0.0, "json", "summary")
+    bus = result["itineraries"][0]["legs"][1]
+    assert bus == {"mode": "BUS", "distance": 2000, "start_name": "Opp Blk 1", "start_code": "01012",
+                   "end_name": "B", "end_code": "75009", "route_id": "10", "duration": 900}
+    assert result["itineraries"][0]["fare"] == "1.19"
+
+def test_full_detail_encoded_passes_onemap_geometry_through():
+    result = directions.decode_transit_route(ONEMAP, 0.0, "encoded", "encoded")
+    bus = result["itineraries"][0]["legs"][1]
+    assert bus["polyline"] == ONEMAP["plan"]["itineraries"][0]["legs"][1]["legGeometry"]["points"]
+    assert bus["intermediate_stops"][0]["stopCode"] == "76059"
+    assert result["itineraries"][0]["legs"][0]["intermediate_stops"] == []
+
+def test_json_format_decodes_and_simplifies():
+    full = directions.decode_transit_route(ONEMAP, 0.0, "json")["itineraries"][0]["legs"][1]["coordinates"]
+    assert full == LEG_POINTS
+    low = directions.decode_transit_route(ONEMAP, 0.0002, "json")["itineraries"][0]["legs"][1]["coordinates"]
+    assert low == [LEG_POINTS[0], LEG_POINTS[2], LEG_POINTS[3]]
+    encoded = directions.decode_transit_route(ONEMAP, 0.0002, "encoded")["itineraries"][0]["legs"][1]["polyline"]
+    assert directions.polyline.decode(encoded) == low
+
+def test_profiles_share_one_onemap_response_and_validate_params(monkeypatch):
+    calls = []
+
+    async def fetch_onemap_route(body):
+        calls.append(body)
+        return json.dumps(ONEMAP).encode()
+
+    monkeypatch.setattr(directions, "fetch_onemap_route", fetch_onemap_route)
+    monkeypatch.setattr(directions, "onemap_route_cache", BoundedCache(max_entries=10))
+    monkeypatch.setattr(directions, "transit_route_cache", BoundedCache(max_entries=10))
+
+    async def main():
+        summary = await directions.get_transit_route(trip(), profile="summary", detail="low")
+        encoded = await directions.get_transit_route(trip(), profile="encoded")
+        with pytest.raises(directions.HTTPException):
+            await directions.get_transit_route(trip(), profile="tiny")
+        with pytest.raises(directions.HTTPException):
+            await directions.get_transit_route(trip(), detail="extreme")
+        return json.loads(summary.body), json.loads(encoded.body)
+    summary, encoded = asyncio.run(main())
+    assert "coordinates" not in summary["itineraries"][0]["legs"][1]
+    assert "polyline" in encoded["itineraries"][0]["legs"][1]
+    assert len(calls) == 1
+    assert set(directions.transit_route_cache._store) == {
+        f"{route_cache_key(trip())}|summary|full|json", f"{route_cache_key(trip())}|encoded|full|encoded"
+    }
@@ -0,0 +1,50 @@
+import asyncio
+import os
+import threading
+import time
+from routers import executor
+
+def busy(seconds: float) -> str:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(1000))
+    return threading.current_thread().name
+
+def use_executor(monkeypatch, kind: str):
+    executor.shutdown_executor()
+    monkeypatch.setattr(executor, "CPU_EXECUTOR", kind)
+
+def test_thread_executor_keeps_the_loop_running(monkeypatch):
+    use_executor(monkeypatch, "thread")
+    ticks = []
+
+    async def heartbeat():
+        while True:
+            ticks.append(time.perf_counter())
+            await asyncio.sleep(0.005)
+
+    async def main():
+        task = asyncio.create_task(heartbeat())
+        await asyncio.sleep(0)
+        thread_name = await executor.run_cpu(busy, 0.2)
+        task.cancel()
+        return thread_name
+    assert asyncio.run(main()).startswith("cpu")
+    # The loop kept ticking while the transform ran
+    assert len(ticks) > 10
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.1
+    executor.shutdown_executor()
+
+def test_inline_executor_runs_on_the_loop(monkeypatch):
+    use_executor(monkeypatch, "inline")
+    assert executor.get_executor() is None
+    assert asyncio.run(executor.run_cpu(busy, 0)) == threading.current_thread().name
+    assert asyncio.run(executor.run_cpu(sorted, [3, 1, 2], reverse=True)) == [3, 2, 1]
+
+def test_process_executor_runs_in_a_worker_process(monkeypatch):
+    use_executor(monkeypatch, "process")
+    try:
+        assert asyncio.run(executor.run_cpu(os.getpid)) != os.getpid()
+    finally:
+        executor.shutdown_executor()
+    assert executor._executor is None
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import httpx
+from routers import logshipper
+from routers.logshipper import LogShipper
+
+def mock_ingest(monkeypatch, status: int = 200) -> list:
+    """Routes the shippers' posts to an in-memory endpoint; returns the payloads it receives."""
+    received = []
+    real_client = httpx.AsyncClient
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        received.append(json.loads(request.content))
+        return httpx.Response(status)
+
+    monkeypatch.setattr(logshipper.httpx, "AsyncClient", lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs))
+    return received
+
+def test_full_queue_drops_the_oldest_events(monkeypatch):
+    monkeypatch.setattr(logshipper, "LOG_QUEUE_SIZE", 3)
+    shipper = LogShipper("test", "http://ingest.test")
+    for i in range(5):
+        shipper.emit({"n": i})
+    assert [event["n"] for event in shipper._queue] == [2, 3, 4]
+    assert shipper.status() == {"queued": 5, "sent": 0, "dropped": 2, "failed": 0, "batches": 0, "pending": 3}
+
+def test_events_are_sent_in_batches(monkeypatch):
+    received = mock_ingest(monkeypatch)
+    monkeypatch.setattr(logshipper, "LOG_BATCH_SIZE", 2)
+    monkeypatch.setattr(logshipper, "LOG_FLUSH_INTERVAL", 60)
+
+    async def main():
+        shipper = LogShipper("test", "http://ingest.test")
+        shipper.start()
+        for i in range(4):
+            shipper.emit({"n": i})
+        # A full batch wakes the background task without waiting for the flush interval
+        for _ in range(100):
+            if shipper.stats["sent"] == 4:
+                break
+            await asyncio.sleep(0.01)
+        await shipper.stop()
+        return shipper
+    shipper = asyncio.run(main())
+    assert received == [[{"n": 0}, {"n": 1}], [{"n": 2}, {"n": 3}]]
+    assert shipper.stats["batches"] == 2
+
+def test_stop_flushes_pending_events(monkeypatch):
+    received = mock_ingest(monkeypatch)
+    monkeypatch.setattr(logshipper, "LOG_FLUSH_INTERVAL", 60)
+
+    async def main():
+        shipper = LogShipper("test", "http://ingest.test", accepts_batches=False)
+        shipper.start()
+        shipper.emit({"n": 0})
+        shipper.emit({"n": 1})
+        await shipper.stop()
+        return shipper
+    shipper = asyncio.run(main())
+    assert received == [{"n": 0}, {"n": 1}]
+    assert shipper.status()["sent"] == 2 and shipper.status()["pending"] == 0
+
+def test_failed_posts_are_counted_not_raised(monkeypatch):
+    mock_ingest(monkeypatch, status=500)
+
+    async def main():
+        shipper = LogShipper("test", "http://ingest.test")
+        shipper.start()
+        shipper.emit({"n": 0})
+        await shipper.stop()
+        return shipper
+    assert asyncio.run(main()).stats["failed"] == 1
@@ -0,0 +1,59 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routers import metrics
+from routers.metrics import Counter, Gauge, Histogram, MetricsMiddleware, render_metrics
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, "registry", [])
+
+def test_histogram_renders_cumulative_buckets():
+    latency = Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value, "/bustiming")
+    assert latency.render() == [
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{route="/bustiming",le="0.1"} 2',
+        'latency_seconds_bucket{route="/bustiming",le="1.0"} 3',
+        'latency_seconds_bucket{route="/bustiming",le="+Inf"} 4',
+        'latency_seconds_sum{route="/bustiming"} 3.65',
+        'latency_seconds_count{route="/bustiming"} 4',
+    ]
+
+def test_counters_gauges_and_collected_values():
+    requests = Counter("requests_total", "Requests.", ("status",))
+    requests.inc(200)
+    requests.inc(200, amount=2)
+    Gauge("depth", "Queue depth.", ("name",), collect=lambda: [(('say "hi"\n',), 3)])
+    assert render_metrics().splitlines()[2:] == [
+        'requests_total{status="200"} 3',
+        "# HELP depth Queue depth.",
+        "# TYPE depth gauge",
+        'depth{name="say \\"hi\\"\\n"} 3',
+    ]
+
+def test_middleware_records_route_templates_and_errors(monkeypatch):
+    monkeypatch.setattr(metrics, "http_requests", Counter("http_requests_total", "", ("method", "route", "status")))
+    monkeypatch.setattr(metrics, "http_request_duration", Histogram("http_request_duration_seconds", "", ("method", "route")))
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(metrics.metrics_router)
+
+    @app.get("/stops/{code}")
+    async def stop(code: str):
+        return {"code": code}
+
+    @app.get("/broken")
+    async def broken():
+        raise RuntimeError("boom")
+
+    client = TestClient(app, raise_server_exceptions=False)
+    client.get("/stops/1")
+    client.get("/stops/2")
+    assert client.get("/broken").status_code == 500
+    body = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/stops/{code}",status="200"} 2' in body
+    assert 'http_requests_total{method="GET",route="/broken",status="500"} 1' in body
+    assert 'http_request_duration_seconds_count{method="GET",route="/stops/{code}"} 2' in body
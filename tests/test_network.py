@@ -0,0 +1,66 @@
+import asyncio
+import json
+from routers import datasets, network
+from routers.network import BusNetwork
+
+BUS_ROUTES = [
+    {"serviceNo": "10", "routes": [
+        {"direction": 1, "busStopIDs": ["75009", "76059", "76069", "01012"]},
+        {"direction": 2, "busStopIDs": ["01012", "76069", "75009"]},
+    ]},
+    {"serviceNo": "2", "routes": [{"direction": 1, "busStopIDs": ["75009", "01012"]}]},
+    # Loop service: 75009 is visited twice
+    {"serviceNo": "291", "routes": [{"direction": 1, "busStopIDs": ["75009", "76059", "76069", "75009"]}]},
+    {"serviceNo": "2A", "routes": [{"direction": 1, "busStopIDs": ["01012"]}]},
+]
+
+def test_services_and_routes_at_a_stop():
+    bus_network = BusNetwork(BUS_ROUTES)
+    assert bus_network.services_at("75009") == ["2", "10", "291"]
+    assert bus_network.services_at("01012") == ["2", "2A", "10"]
+    assert bus_network.stop_routes["76069"] == [("10", "1"), ("10", "2"), ("291", "1")]
+    assert bus_network.services_at("99999") is None
+
+def test_stops_of_a_route():
+    bus_network = BusNetwork(BUS_ROUTES)
+    assert bus_network.stops_of("10", "2") == ("01012", "76069", "75009")
+    assert bus_network.stops_of("10", "3") is None
+
+def test_adjacent_stops():
+    bus_network = BusNetwork(BUS_ROUTES)
+    assert bus_network.adjacent_stops("10", "1", "76059") == ("75009", "76069")
+    assert bus_network.adjacent_stops("10", "1", "75009") == (None, "76059")
+    assert bus_network.adjacent_stops("10", "1", "01012") == ("76069", None)
+    # First visit of a loop's terminal
+    assert bus_network.adjacent_stops("291", "1", "75009") == (None, "76059")
+    assert bus_network.adjacent_stops("2", "1", "76059") is None
+
+def test_stop_distance():
+    bus_network = BusNetwork(BUS_ROUTES)
+    assert bus_network.stop_distance("10", "1", "75009", "01012") == 3
+    assert bus_network.stop_distance("10", "1", "76069", "76069") == 0
+    assert bus_network.stop_distance("10", "1", "01012", "75009") is None
+    # Around the loop back to the terminal
+    assert bus_network.stop_distance("291", "1", "76069", "75009") == 1
+    assert bus_network.stop_distance("2", "1", "75009", "76059") is None
+
+def test_network_is_reloaded_after_a_publish(fake_db, monkeypatch):
+    monkeypatch.setattr(datasets, "_versions", {})
+    monkeypatch.setattr(datasets, "_dataset_status", {"published_at": {}, "publish_failures": {}, "last_poll_at": None, "poll_failures": 0})
+    monkeypatch.setattr(network, "_network", None)
+    fake_db.rows("bus_route").extend(
+        {"id": str(i), "service_no": route["serviceNo"], "json_value": json.dumps(route), "version": None}
+        for i, route in enumerate(BUS_ROUTES)
+    )
+
+    async def main():
+        first = await network.get_network()
+        assert first.services_at("01012") == ["2", "2A", "10"]
+        assert await network.get_network() is first
+        fake_db.rows("bus_route").append(
+            {"id": "9", "service_no": "3", "json_value": json.dumps({"serviceNo": "3", "routes": []}), "version": "v2"}
+        )
+        datasets._versions["bus_routes"] = "v2"
+        reloaded = await network.get_network()
+        assert reloaded is not first and reloaded.routes == {}
+    asyncio.run(main())
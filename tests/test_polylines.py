@@ -0,0 +1,112 @@
+import asyncio
+import json
+import httpx
+import polyline
+from routers import polylines
+from routers.polylines import encode_route_geometry
+from routers.utils import simplify_polyline
+
+def test_simplify_drops_points_within_tolerance():
+    line = [[0.0, 0.0], [0.00001, 1.0], [0.0, 2.0], [1.0, 3.0], [0.0, 4.0]]
+    assert simplify_polyline(line, 0.0001) == [[0.0, 0.0], [0.0, 2.0], [1.0, 3.0], [0.0, 4.0]]
+    assert simplify_polyline(line, 0.0) == line
+    assert simplify_polyline(line, 10.0) == [[0.0, 0.0], [0.0, 4.0]]
+
+def test_simplify_keeps_short_and_closed_lines():
+    assert simplify_polyline([[1.0, 1.0], [2.0, 2.0]], 1.0) == [[1.0, 1.0], [2.0, 2.0]]
+    loop = [[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 0.0]]
+    assert simplify_polyline(loop, 0.1) == loop
+
+def test_encode_route_geometry_formats():
+    coords = [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]]
+    assert encode_route_geometry(coords, "full", "encoded") == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    assert json.loads(encode_route_geometry(coords)) == coords
+    assert encode_route_geometry(None) == ""
+    assert encode_route_geometry([], "low", "encoded") == ""
+
+def test_encode_route_geometry_simplifies_by_detail():
+    straight = [[1.3, 103.8 + i * 0.0001] for i in range(50)]
+    assert polyline.decode(encode_route_geometry(straight, "low", "encoded")) == [(1.3, 103.8), (1.3, 103.8049)]
+    assert len(json.loads(encode_route_geometry(straight, "full"))) == 50
+
+def test_variants_are_built_on_request_and_cached(monkeypatch):
+    bus_routes = [
+        {"serviceNo": "10", "routes": [{"direction": 1}]},
+        {"serviceNo": "2", "routes": [{"direction": 1}, {"direction": 2}]},
+    ]
+    geometry = {"10|1": [[1.3, 103.8], [1.31, 103.81]], "2|1": [[1.35, 103.9], [1.36, 103.91]]}
+    monkeypatch.setattr(polylines, "_index", polylines._build_index(bus_routes, geometry))
+    monkeypatch.setattr(polylines, "_index_generation", 1)
+    monkeypatch.setattr(polylines, "_variant_cache", polylines.BoundedCache(10))
+
+    defaults = asyncio.run(polylines.get_polyline_services(["2", "10", "404"]))
+    assert [service["serviceNo"] for service in defaults] == ["10", "2"]
+    assert defaults[1]["routes"][1]["polyline"] == ""
+    assert polylines._variant_cache.stats()["entries"] == 0
+
+    encoded = asyncio.run(polylines.get_polyline_services(["2"], "low", "encoded"))
+    assert polyline.decode(encoded[0]["routes"][0]["polyline"]) == [(1.35, 103.9), (1.36, 103.91)]
+    assert asyncio.run(polylines.get_polyline_services(["2"], "low", "encoded"))[0] is encoded[0]
+
+GEOJSON = {"features": [
+    {"properties": {"number": "10", "pattern": 0}, "geometry": {"coordinates": [[103.8, 1.3], [103.81, 1.31]]}},
+    {"properties": {"number": "10", "pattern": 0}, "geometry": {"coordinates": [[103.82, 1.32]]}},
+    {"properties": {"number": "10", "pattern": 1}, "geometry": {"coordinates": [[103.82, 1.32], [103.8, 1.3]]}},
+    {"properties": {"number": "10", "pattern": 2}, "geometry": {"coordinates": [[103.0, 1.0]]}},
+    {"properties": {"number": "2", "pattern": 0}, "geometry": {"coordinates": []}},
+]}
+
+def test_parse_geojson_routes():
+    assert polylines.parse_geojson_routes(GEOJSON) == {
+        "10|1": [[1.3, 103.8], [1.31, 103.81], [1.32, 103.82]],
+        "10|2": [[1.32, 103.82], [1.3, 103.8]],
+    }
+
+def test_geometry_is_refetched_conditionally(monkeypatch):
+    requests = []
+
+    def handler(request):
+        requests.append(dict(request.headers))
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json=GEOJSON, headers={"etag": '"v1"'})
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(polylines.httpx, "AsyncClient", lambda **kwargs: real_client(transport=httpx.MockTransport(handler)))
+    monkeypatch.setattr(polylines, "_geometry", {})
+    monkeypatch.setattr(polylines, "_geojson_validators", {})
+
+    assert asyncio.run(polylines._fetch_geometry()) is True
+    assert asyncio.run(polylines._fetch_geometry()) is False
+    assert requests[1]["if-none-match"] == '"v1"'
+    assert polylines._geometry["10|2"] == [[1.32, 103.82], [1.3, 103.8]]
+
+def test_index_is_rebuilt_only_when_a_source_changes(monkeypatch):
+    views = {"bus_routes": [{"serviceNo": "10", "routes": [{"direction": 1}, {"direction": 2}]}]}
+    changed = [True]
+
+    async def fetch_geometry():
+        monkeypatch.setattr(polylines, "_geometry", polylines.parse_geojson_routes(GEOJSON))
+        return changed.pop() if changed else False
+
+    async def get_views():
+        return views
+
+    monkeypatch.setattr(polylines, "_fetch_geometry", fetch_geometry)
+    monkeypatch.setattr(polylines, "get_bus_route_views", get_views)
+    monkeypatch.setattr(polylines, "_geometry", {})
+    monkeypatch.setattr(polylines, "_index", None)
+    monkeypatch.setattr(polylines, "_index_views", None)
+    monkeypatch.setattr(polylines, "_index_generation", 0)
+
+    async def main():
+        services = await polylines.get_polyline_services(["10"])
+        assert json.loads(services[0]["routes"][1]["polyline"]) == [[1.32, 103.82], [1.3, 103.8]]
+        await polylines.refresh_polylines(force_geometry=True)
+        assert polylines._index_generation == 1
+        emptied = {"bus_routes": []}
+        monkeypatch.setattr(polylines, "get_bus_route_views", lambda: asyncio.sleep(0, emptied))
+        await polylines.refresh_polylines()
+        assert polylines._index_generation == 2
+        assert await polylines.get_polyline_services(["10"]) == []
+    asyncio.run(main())
@@ -0,0 +1,77 @@
+import asyncio
+import marshal
+import time
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from routers import utils
+from routers.profiling import ProfilingMiddleware, profile, profiling_router
+
+def spin(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+async def busy_loop(until: float):
+    while time.perf_counter() < until:
+        spin(0.01)
+        await asyncio.sleep(0)
+
+async def slow_handler(scope, receive, send):
+    spin(0.02)
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+async def call(app, path: str):
+    async def send(message):
+        pass
+    await app({"type": "http", "method": "GET", "path": path, "headers": []}, None, send)
+
+def test_sampling_profile_returns_collapsed_loop_stacks():
+    async def main():
+        busy = asyncio.create_task(busy_loop(time.perf_counter() + 0.3))
+        response = await profile(seconds=0.2, mode="sampling", interval_ms=2)
+        await busy
+        return response
+    response = asyncio.run(main())
+    lines = response.body.decode().splitlines()
+    assert int(response.headers["X-Profile-Samples"]) > 10
+    assert any(line.startswith("MainThread;") and "spin (" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+def test_route_profile_covers_the_next_requests_only():
+    app = ProfilingMiddleware(slow_handler)
+
+    async def main():
+        report = asyncio.create_task(profile(seconds=5, mode="cprofile", format="pstats", route="/bustiming", requests=2))
+        await asyncio.sleep(0.01)
+        for path in ("/health", "/bustiming", "/bustiming", "/bustiming"):
+            await call(app, path)
+        return await report
+    response = asyncio.run(main())
+    assert response.headers["X-Profiled-Requests"] == "2"
+    stats = marshal.loads(response.body)
+    [calls] = [entry[1] for (_, _, name), entry in stats.items() if name == "slow_handler"]
+    assert calls == 2
+
+def test_invalid_and_concurrent_profiles_are_rejected():
+    async def main():
+        with pytest.raises(HTTPException) as error:
+            await profile(mode="perf")
+        assert error.value.status_code == 400
+        with pytest.raises(HTTPException) as error:
+            await profile(mode="sampling", format="pstats")
+        assert error.value.status_code == 400
+        running = asyncio.create_task(profile(seconds=0.1))
+        await asyncio.sleep(0.01)
+        with pytest.raises(HTTPException) as error:
+            await profile(seconds=0.1)
+        assert error.value.status_code == 409
+        await running
+    asyncio.run(main())
+
+def test_profile_needs_the_admin_token(monkeypatch):
+    monkeypatch.setattr(utils, "ADMIN_TOKEN", "secret")
+    app = FastAPI()
+    app.include_router(profiling_router)
+    assert TestClient(app).get("/debug/profile?seconds=0.01").status_code == 401
@@ -0,0 +1,89 @@
+import asyncio
+import pytest
+from routers import ratelimit
+from routers.ratelimit import GcraLimiter, RateLimitMiddleware, RouteLimit, _client_key
+
+def test_gcra_allows_a_burst_then_one_per_interval():
+    limiter = GcraLimiter(3, 60)
+    assert [limiter.hit("a", 0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.hit("a", 0.0) == pytest.approx(20.0)
+    assert limiter.hit("a", 19.0) == pytest.approx(1.0)
+    assert limiter.hit("a", 20.0) == 0.0
+    assert limiter.hit("b", 20.0) == 0.0
+
+def test_gcra_drops_idle_clients_after_two_periods():
+    limiter = GcraLimiter(2, 10)
+    limiter.rotated_at = 0.0
+    limiter.hit("a", 0.0)
+    limiter.hit("b", 11.0)
+    assert len(limiter) == 2
+    assert limiter.hit("a", 11.0) == 0.0
+    limiter.hit("c", 35.0)
+    assert len(limiter) == 1
+
+def scope(query: bytes = b"", headers=(), client=("10.0.0.1", 5000)) -> dict:
+    return {"type": "http", "path": "/bustiming", "query_string": query, "headers": list(headers), "client": client}
+
+def test_client_key_prefers_user_then_device_then_ip():
+    assert _client_key(scope(b"userID=u1&deviceToken=d1")) == ("user", "user:10.0.0.1:u1", "10.0.0.1")
+    assert _client_key(scope(b"deviceToken=d1")) == ("device", "device:10.0.0.1:d1", "10.0.0.1")
+    assert _client_key(scope(headers=[(b"x-device-token", b"d2")])) == ("device", "device:10.0.0.1:d2", "10.0.0.1")
+    assert _client_key(scope(client=None)) == ("ip", "ip:unknown", "unknown")
+
+def test_fly_client_ip_is_only_trusted_behind_the_proxy(monkeypatch):
+    forwarded = scope(headers=[(b"fly-client-ip", b"203.0.113.9")])
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_TRUST_PROXY", False)
+    assert _client_key(forwarded)[2] == "10.0.0.1"
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_TRUST_PROXY", True)
+    assert _client_key(forwarded)[2] == "203.0.113.9"
+
+def test_rotating_user_ids_are_capped_per_ip(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_IP_FACTOR", 3)
+    limit = RouteLimit("/bustiming", 2, 60)
+    allowed = [not RateLimitMiddleware.check(limit, scope(f"userID=u{i}".encode())) for i in range(10)]
+    assert allowed == [True] * 6 + [False] * 4
+    # Another IP is not affected
+    assert not RateLimitMiddleware.check(limit, scope(b"userID=u0", client=("10.0.0.2", 5000)))
+    assert limit.blocked_keys == {"ip:10.0.0.1": 4}
+
+def test_users_sharing_an_ip_each_get_their_own_limit():
+    # Carrier-grade NAT: many real users behind one address, each at the full per-user rate
+    limit = RouteLimit("/bustiming", 30, 60)
+    for user in range(50):
+        allowed = [not RateLimitMiddleware.check(limit, scope(f"userID=u{user}".encode())) for _ in range(31)]
+        assert allowed == [True] * 30 + [False]
+    assert set(limit.blocked_keys) == {f"user:10.0.0.1:u{user}" for user in range(50)}
+    # Unidentified requests from the same IP have their own limit, not the shared cap
+    assert not RateLimitMiddleware.check(limit, scope())
+
+def test_spoofed_user_id_does_not_use_up_the_owners_limit():
+    limit = RouteLimit("/bustiming", 2, 60)
+    for _ in range(5):
+        RateLimitMiddleware.check(limit, scope(b"userID=victim", client=("10.0.0.66", 5000)))
+    assert not RateLimitMiddleware.check(limit, scope(b"userID=victim"))
+
+def test_middleware_rejects_with_retry_after(monkeypatch):
+    monkeypatch.setattr(ratelimit, "route_limits", {})
+    calls = []
+
+    async def app(scope, receive, send):
+        calls.append(scope["path"])
+
+    middleware = RateLimitMiddleware(app, {"/bustiming": "1/30", "/": "100/1"})
+
+    async def request(path):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+        await middleware(dict(scope(), path=path), None, send)
+        return sent
+
+    async def main():
+        assert await request("/bustiming") == []
+        rejected = await request("/bustiming")
+        assert rejected[0]["status"] == 429
+        assert (b"retry-after", b"30") in rejected[0]["headers"]
+        assert await request("/health") == []
+    asyncio.run(main())
+    assert calls == ["/bustiming", "/health"]
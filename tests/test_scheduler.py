@@ -0,0 +1,114 @@
+import asyncio
+from datetime import datetime
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from routers import bus, busstop, etl, scheduler, utils
+from routers.scheduler import SGT, CronSchedule, acquire_lease, release_lease
+
+def sgt(*args) -> datetime:
+    return SGT.localize(datetime(*args))
+
+def test_daily_schedule():
+    schedule = CronSchedule("30 3 * * *")
+    assert schedule.next_after(sgt(2026, 10, 19, 3, 29, 59)) == sgt(2026, 10, 19, 3, 30)
+    assert schedule.next_after(sgt(2026, 10, 19, 3, 30)) == sgt(2026, 10, 20, 3, 30)
+    assert schedule.next_after(sgt(2026, 12, 31, 4, 0)) == sgt(2027, 1, 1, 3, 30)
+
+def test_steps_ranges_and_weekdays():
+    schedule = CronSchedule("0 */6 * * 1-5")
+    assert schedule.hours == {0, 6, 12, 18}
+    # Friday evening -> Monday midnight
+    assert schedule.next_after(sgt(2026, 10, 23, 19, 0)) == sgt(2026, 10, 26, 0, 0)
+    assert CronSchedule("5/15,1 * * * *").minutes == {1, 5, 20, 35, 50}
+
+def test_day_of_month_or_weekday():
+    # Both day fields restricted: the 13th or any Friday
+    schedule = CronSchedule("0 0 13 * 5")
+    assert schedule.next_after(sgt(2026, 10, 19, 12, 0)) == sgt(2026, 10, 23, 0, 0)
+    assert schedule.next_after(sgt(2026, 11, 7, 12, 0)) == sgt(2026, 11, 13, 0, 0)
+    # Sunday is 0
+    assert CronSchedule("0 9 * * 0").next_after(sgt(2026, 10, 19, 0, 0)) == sgt(2026, 10, 25, 9, 0)
+
+def test_next_after_converts_to_singapore_time():
+    schedule = CronSchedule("30 3 * * *")
+    assert schedule.next_after(datetime.fromisoformat("2026-10-19T19:00:00+00:00")) == sgt(2026, 10, 20, 3, 30)
+
+@pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "5-1 * * * *", "0 0 31 2 *"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression).next_after(sgt(2026, 10, 19))
+
+def test_lease_is_exclusive_per_job_and_slot(fake_db):
+    async def main():
+        token = await acquire_lease("bus_datasets", "03:30", 60)
+        assert token
+        assert await acquire_lease("bus_datasets", "03:30", 60) is None
+        assert await acquire_lease("bus_datasets", None, 60) is None
+        await release_lease("bus_datasets", "03:30", token)
+        # Released, but the slot already ran
+        assert await acquire_lease("bus_datasets", "03:30", 60) is None
+        assert await acquire_lease("bus_datasets", "next day", 60)
+        assert await acquire_lease("other_job", "03:30", 60)
+    asyncio.run(main())
+
+def test_expired_lease_is_taken_over(fake_db, monkeypatch):
+    async def main():
+        assert await acquire_lease("bus_datasets", None, -1)
+        monkeypatch.setattr(scheduler, "INSTANCE_ID", "other:1")
+        assert await acquire_lease("bus_datasets", None, 60)
+        assert fake_db.json("jobLease:bus_datasets")["holder"] == "other:1"
+    asyncio.run(main())
+
+def test_job_run_is_skipped_while_leased_elsewhere(fake_db):
+    calls = []
+
+    async def func(job):
+        calls.append(job.name)
+        return "done"
+
+    job = scheduler.Job("test_job", "* * * * *", func)
+
+    async def main():
+        assert await acquire_lease("test_job", None, 60)
+        assert not await job.run(slot="a")
+        assert job.status["last_skipped"]["slot"] == "a"
+        fake_db.tables["jsons"].clear()
+        assert await job.run(slot="a")
+        assert job.status["last_run"]["result"] == "done"
+    asyncio.run(main())
+    assert calls == ["test_job"]
+
+def test_extract_endpoints_share_the_nightly_jobs_lease(fake_db, monkeypatch):
+    release = asyncio.Event()
+
+    async def extract_bus_stops():
+        await release.wait()
+        return {"new": 1}
+
+    monkeypatch.setattr(etl, "extract_bus_stops", extract_bus_stops)
+
+    async def main():
+        assert (await busstop.extract_bus_stops())["status"] == "/jobs/bus_stops"
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as conflict:
+            await bus.extract_bus_routes_raw_data()
+        assert conflict.value.status_code == 409
+        assert not await scheduler.jobs["bus_datasets"].run(slot="03:30")
+        release.set()
+        await scheduler.jobs["bus_stops"].manual_run
+        assert scheduler.jobs["bus_stops"].status["last_run"]["result"] == {"new": 1}
+        assert fake_db.json("jobLease:bus_datasets")["expires_at"] == 0
+    asyncio.run(main())
+
+def test_manual_run_needs_the_admin_token(fake_db, monkeypatch):
+    monkeypatch.setattr(utils, "ADMIN_TOKEN", "secret")
+    started = []
+    monkeypatch.setattr(scheduler.jobs["bus_stops"], "start", lambda **kwargs: asyncio.sleep(0, started.append(kwargs) or True))
+    app = FastAPI()
+    app.include_router(scheduler.jobs_router)
+    client = TestClient(app)
+    assert client.post("/jobs/bus_stops/run").status_code == 401
+    assert client.post("/jobs/bus_stops/run", headers={"X-Admin-Token": "secret"}).status_code == 202
+    assert client.post("/jobs/nope/run", headers={"X-Admin-Token": "secret"}).status_code == 404
+    assert started == [{}]
@@ -0,0 +1,88 @@
+import asyncio
+import gzip
+import json
+from collections import defaultdict
+from routers import busstop, datasets, executor
+from routers.streaming import json_text, object_member, prefetch_pages, stream_json, tee_gzip
+
+async def page_stream(pages):
+    for rows in pages:
+        yield rows
+
+async def collect(chunks) -> bytes:
+    return b"".join([chunk async for chunk in chunks])
+
+ROWS = [{"id": f"{i:05d}", "description": f"Stop {i}", "bus_services": ["10", "10e"]} for i in range(25)]
+PAGES = [ROWS[:10], [], ROWS[10:20], ROWS[20:]]
+
+def test_stream_json_matches_the_whole_body():
+    async def main():
+        array = await collect(stream_json(page_stream(PAGES), json_text))
+        wrapped = await collect(stream_json(page_stream(PAGES), json_text, b'{"busStops":[', b"]}"))
+        members = await collect(stream_json(
+            page_stream(PAGES), lambda row: object_member(row["id"], json_text(row)), b"{", b"}"
+        ))
+        empty = await collect(stream_json(page_stream([[]]), json_text))
+        return array, wrapped, members, empty
+    array, wrapped, members, empty = asyncio.run(main())
+    assert json.loads(array) == ROWS
+    assert array == json.dumps(ROWS, separators=(",", ":")).encode()
+    assert json.loads(wrapped) == {"busStops": ROWS}
+    assert json.loads(members) == {row["id"]: row for row in ROWS}
+    assert empty == b"[]"
+
+def test_json_text_columns_pass_through_undecoded():
+    assert json_text('{"a": 1}') == '{"a": 1}'
+    assert json_text({"a": 1}) == '{"a":1}'
+
+def test_prefetch_pages_reads_the_first_page_up_front():
+    async def failing():
+        raise RuntimeError("query failed")
+        yield
+
+    async def main():
+        assert await prefetch_pages(page_stream([])) is None
+        pages = await prefetch_pages(page_stream(PAGES))
+        assert [rows async for rows in pages] == PAGES
+        try:
+            await prefetch_pages(failing())
+        except RuntimeError:
+            return True
+    assert asyncio.run(main())
+
+def test_tee_gzip_passes_chunks_through_and_gzips_a_copy(monkeypatch):
+    # Chunks over STREAM_OFFLOAD_SIZE go to a thread, never to the process executor
+    executor.shutdown_executor()
+    monkeypatch.setattr(executor, "CPU_EXECUTOR", "process")
+    chunks = [b"[", json.dumps(ROWS * 1000).encode()[1:-1], b"]"]
+    stored = []
+
+    async def on_complete(blob: bytes):
+        stored.append(blob)
+
+    try:
+        body = asyncio.run(collect(tee_gzip(page_stream(chunks), on_complete)))
+    finally:
+        executor.shutdown_executor()
+    assert body == b"".join(chunks)
+    assert gzip.decompress(stored[0]) == body
+
+def test_all_bus_stops_streams_the_same_body_it_caches(fake_db, monkeypatch):
+    monkeypatch.setattr(datasets, "_versions", {})
+    monkeypatch.setattr(datasets, "_dataset_status", {"published_at": {}, "publish_failures": {}, "last_poll_at": None, "poll_failures": 0})
+    monkeypatch.setattr(datasets, "_invalidators", defaultdict(list))
+    rows = [
+        {"id": f"{i:05d}", "description": f"Stop {i}", "latitude": 1.3, "longitude": 103.8, "road_name": "Road", "bus_services": "[\"10\"]"}
+        for i in range(2500)
+    ]
+    fake_db.rows("bus_stops").extend(rows)
+
+    async def main():
+        response = await busstop.get_all_bus_stops()
+        body = await collect(response.body_iterator)
+        cached = await busstop.bus_stop_cache.get(datasets.versioned_key("bus_stops", "all.json.gz"))
+        await busstop.bus_stop_cache.clear()
+        return body, cached
+    body, cached = asyncio.run(main())
+    assert json.loads(body) == {"busStops": sorted(rows, key=lambda row: row["id"])}
+    assert gzip.decompress(cached) == body
@@ -0,0 +1,113 @@
+import asyncio
+import pytest
+from routers import telemetry, utils
+from routers.telemetry import TelemetryMiddleware
+from routers.timing import span
+
+class RecordingSink:
+    name = "axiom"
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event, rate):
+        self.events.append(event)
+
+async def app(scope, receive, send):
+    with span("db"):
+        pass
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+def request(sink: RecordingSink, rate: float, headers=()) -> bytes | None:
+    middleware = TelemetryMiddleware(app, [sink], {"axiom": {"/": rate}})
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/bustiming", "query_string": b"", "headers": list(headers)}
+    asyncio.run(middleware(scope, None, send))
+    return dict(sent[0]["headers"]).get(b"server-timing")
+
+@pytest.fixture(autouse=True)
+def admin_token(monkeypatch):
+    monkeypatch.setattr(telemetry, "SERVER_TIMING_ENABLED", False)
+    monkeypatch.setattr(utils, "ADMIN_TOKEN", "secret")
+
+def test_server_timing_is_not_sent_by_default():
+    sink = RecordingSink()
+    assert request(sink, 1.0) is None
+    assert "db" in sink.events[0]["timings"]
+
+def test_server_timing_is_sent_to_admin_requests_only():
+    sink = RecordingSink()
+    assert request(sink, 0.0, [(b"x-admin-token", b"secret")]).startswith(b"db;dur=")
+    assert request(sink, 0.0, [(b"x-admin-token", b"guess")]) is None
+    assert sink.events == []
+
+def test_server_timing_can_be_enabled_for_everyone(monkeypatch):
+    monkeypatch.setattr(telemetry, "SERVER_TIMING_ENABLED", True)
+    assert b"total;dur=" in request(RecordingSink(), 0.0)
+
+def test_longest_matching_prefix_sets_the_sample_rate():
+    sink = RecordingSink()
+    middleware = TelemetryMiddleware(app, [sink], {"axiom": {"/bus": 0.5, "/bustiming": 0.01, "/health": 0}})
+    assert middleware.sample_rate(sink, "/bustiming") == 0.01
+    assert middleware.sample_rate(sink, "/busstops/tiles") == 0.5
+    assert middleware.sample_rate(sink, "/health") == 0
+    assert middleware.sample_rate(sink, "/getallbusstops") == 1.0
+
+def test_sampling_overrides_from_the_environment(monkeypatch):
+    monkeypatch.setattr(telemetry, "TELEMETRY_SAMPLING", "axiom:/bustiming=0.25, firebase:/=0")
+    sink = RecordingSink()
+    middleware = TelemetryMiddleware(app, [sink], {"axiom": {"/bustiming": 1, "/health": 0}})
+    assert middleware.sample_rate(sink, "/bustiming") == 0.25
+    assert middleware.sample_rate(sink, "/health") == 0
+    assert middleware.rules["firebase"] == [("/", 0.0)]
+
+def test_partial_rates_log_that_share_of_requests(monkeypatch):
+    sink = RecordingSink()
+    draws = iter([0.1, 0.9])
+    monkeypatch.setattr(telemetry.random, "random", lambda: next(draws))
+    request(sink, 0.5)
+    request(sink, 0.5)
+    assert len(sink.events) == 1
+
+def test_streamed_responses_are_logged_once_the_body_is_sent():
+    sink = RecordingSink()
+
+    async def streaming_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        for chunk in (b"[1,", b"2]"):
+            assert sink.events == []
+            with span("serialize"):
+                await asyncio.sleep(0.05)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send(message):
+        pass
+
+    middleware = TelemetryMiddleware(streaming_app, [sink], {"axiom": {"/": 1}})
+    scope = {"type": "http", "method": "GET", "path": "/getallbusstops", "query_string": b"", "headers": []}
+    asyncio.run(middleware(scope, None, send))
+    [event] = sink.events
+    assert event["duration_ms"] >= 100 and event["timings"]["serialize"] >= 100
+
+def test_unfinished_responses_are_still_logged():
+    sink = RecordingSink()
+
+    async def failing_app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"[", "more_body": True})
+        raise RuntimeError("stream broke")
+
+    async def send(message):
+        pass
+
+    middleware = TelemetryMiddleware(failing_app, [sink], {"axiom": {"/": 1}})
+    scope = {"type": "http", "method": "GET", "path": "/getallbusstops", "query_string": b"", "headers": []}
+    with pytest.raises(RuntimeError):
+        asyncio.run(middleware(scope, None, send))
+    assert [event["status"] for event in sink.events] == [200]
@@ -0,0 +1,46 @@
+import json
+from routers.tiles import TILE_PRECISIONS, BusStopTiles, geohash_encode
+from routers.utils import etag_matches
+
+STOPS = [
+    {"id": "01012", "description": "Hotel Grand Pacific", "latitude": 1.29684, "longitude": 103.85253},
+    {"id": "01013", "description": "St. Joseph's Church", "latitude": 1.29771, "longitude": 103.85361},
+    {"id": "75009", "description": "Tampines Int", "latitude": 1.35408, "longitude": 103.94336},
+    {"id": "99999", "description": "No location", "latitude": None, "longitude": None},
+]
+
+def test_geohash_encode_known_points():
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geohash_encode(1.29684, 103.85253, 6) == "w21z7h"
+    assert geohash_encode(1.29684, 103.85253, 4) == geohash_encode(1.29684, 103.85253, 6)[:4]
+
+def test_tiles_partition_stops_at_every_precision():
+    tiles = BusStopTiles(STOPS)
+    for precision in TILE_PRECISIONS:
+        index = tiles.index(precision)
+        stop_ids = sorted(
+            stop["id"] for geohash in index for stop in json.loads(tiles.get(geohash)[0])["busStops"]
+        )
+        assert stop_ids == ["01012", "01013", "75009"]
+    assert len(tiles.index(4)) == 1
+    assert len(tiles.index(6)) == 2
+
+def test_tile_etag_only_changes_with_its_stops():
+    before = BusStopTiles(STOPS)
+    moved = [dict(stop, description="Tampines Interchange") if stop["id"] == "75009" else stop for stop in STOPS]
+    after = BusStopTiles(moved)
+    city = geohash_encode(1.29684, 103.85253, 6)
+    tampines = geohash_encode(1.35408, 103.94336, 6)
+    assert before.get(city)[1] == after.get(city)[1]
+    assert before.get(tampines)[1] != after.get(tampines)[1]
+    assert before.get(city)[1].startswith('W/"')
+
+def test_etag_matches_weakly_and_in_lists():
+    etag = 'W/"abc"'
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('"xyz", W/"abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"xyz"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("", etag)
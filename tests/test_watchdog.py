@@ -0,0 +1,34 @@
+import asyncio
+import time
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from routers import utils, watchdog
+from routers.watchdog import LoopWatchdog, watchdog_router
+
+def block_the_loop(seconds: float):
+    time.sleep(seconds)
+
+def test_stalls_are_recorded_with_the_blocking_stack():
+    monitor = LoopWatchdog(threshold=0.05, interval=0.01)
+
+    async def main():
+        task = asyncio.create_task(monitor.run())
+        await asyncio.sleep(0.05)
+        block_the_loop(0.2)
+        await asyncio.sleep(0.05)
+        task.cancel()
+    asyncio.run(main())
+    [stall] = monitor.stalls
+    assert stall["duration_ms"] >= 150
+    assert "in block_the_loop" in stall["stack"][-1]
+    assert monitor.percentiles()["max"] >= 0.15
+
+def test_loop_report_needs_the_admin_token(monkeypatch):
+    monkeypatch.setattr(utils, "ADMIN_TOKEN", "secret")
+    app = FastAPI()
+    app.include_router(watchdog_router)
+    client = TestClient(app)
+    assert client.get("/debug/loop").status_code == 401
+    response = client.get("/debug/loop", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 200
+    assert response.json()["threshold_ms"] == watchdog.LOOP_STALL_THRESHOLD * 1000